@@ -10,10 +10,11 @@ from qcodes.parameters import ManualParameter
 from quantify_scheduler.gettables import ScheduleGettable
 from numpy import array, arange, real, imag, arctan2
 from quantify_core.measurement.control import MeasurementControl
-from qcat.analysis.resonator.photon_dep.res_data import ResonatorData
+from qblox_drive_AS.analysis.BatchFitting import batch_resonator_fit
 from qblox_drive_AS.support import Data_manager, QDmanager, compose_para_for_multiplexing
 from qblox_drive_AS.support.Pulse_schedule_library import One_tone_multi_sche, pulse_preview
 from qblox_drive_AS.support.Pulser import ScheduleConductor
+from qblox_drive_AS.support.UserFriend import *
 from qblox_drive_AS.support.Pulse_schedule_library import Schedule, Readout, Multi_Readout, Integration
 from quantify_scheduler.operations.gate_library import Reset
 from quantify_scheduler.operations.pulse_library import IdlePulse,SetClockFrequency
@@ -97,20 +98,33 @@ def QD_RO_init(QD_agent:QDmanager, ro_elements:dict):
 def multiplexing_CS_ana(QD_agent:QDmanager, ds:Dataset, save_pic_folder:str=None)->dict:
     """
     # Return\n
-    A dict sorted by q_name with its fit results.\n
+    A dict sorted by q_name with its fit results, a qubit whose fit failed is warned and left out.\n
     Ex. {'q0':{..}, ...}\n
     ----------------------------
     # fit results key names: \n
     ['Qi_dia_corr', 'Qi_no_corr', 'absQc', 'Qc_dia_corr', 'Ql', 'fr', 'theta0', 'phi0', 'phi0_err', 'Ql_err', 'absQc_err', 'fr_err', 'chi_square', 'Qi_no_corr_err', 'Qi_dia_corr_err', 'A', 'alpha', 'delay', 'input_power']
     """
     fit_results = {}
+    qubits = [q for q in ds.data_vars if str(q).split("_")[-1] != "freq"]
+    S21s = {q: array(ds[q])[0] + array(ds[q])[1]*1j for q in qubits}
+    freqs = {q: array(ds[f"{q}_freq"])[0][5:] for q in qubits}
+    # fit all the qubits in one batch when their freq points are the same
+    if len(set(freqs[q].shape[0] for q in qubits)) == 1:
+        res_fits = batch_resonator_fit(array([freqs[q] for q in qubits]), array([S21s[q][5:] for q in qubits]), keep_curves=True)
+        fitted = {q: (res_fits["results"][idx], res_fits["curves"][idx]) for idx, q in enumerate(qubits)}
+    else:
+        fitted = {}
+        for q in qubits:
+            res_fits = batch_resonator_fit(freqs[q], S21s[q][5:], workers=1, keep_curves=True)
+            fitted[q] = (res_fits["results"][0], res_fits["curves"][0])
 
-    for idx, q in enumerate(ds.data_vars):
-        if str(q).split("_")[-1] != "freq":
-            S21 = array(ds[q])[0] + array(ds[q])[1]*1j
-            freq = array(ds[f"{q}_freq"])[0][5:]
-            res_er = ResonatorData(freq=freq,zdata=array(S21)[5:])
-            result, data2plot, fit2plot = res_er.fit()
+    for q in qubits:
+        S21, freq = S21s[q], freqs[q]
+        result, curves = fitted[q]
+        if result is None:
+            warning_print(f"Resonator fit of {q} failed, {q} is left out of the results.")
+        else:
+            data2plot, fit2plot = curves
             fig, ax = plt.subplots(2,2,figsize=(12,12))
             ax0:plt.Axes = ax[0][0] 
             ax0.grid()       
@@ -152,6 +166,8 @@ def CS_ana(QD_agent:QDmanager, cs_ds:Dataset, pic_save_folder:str=None, keep_bar
     Quality_values = ["Qi_dia_corr", "Qc_dia_corr", "Ql"]
     Quality_errors = ["Qi_dia_corr_err", "absQc_err", "Ql_err"]
     CS_results = multiplexing_CS_ana(QD_agent,cs_ds, Data_manager().get_today_picFolder() if pic_save_folder is None else pic_save_folder)
+    for qubit in [q for q in cs_ds.data_vars if str(q).split("_")[-1] != "freq" and q not in CS_results]:
+        warning_print(f"{qubit} readout frequency isn't updated, its resonator fit failed.")
     for qubit in CS_results:
         qu = QD_agent.quantum_device.get_element(qubit)
         qu.clock_freqs.readout(float(CS_results[qubit]['fr']))
@@ -10,7 +10,8 @@ from qblox_drive_AS.support.Pulse_schedule_library import One_tone_multi_sche, p
 from qblox_drive_AS.SOP.FluxQubit import z_pulse_amp_OVER_const_z
 from xarray import Dataset
 
-def FluxCav_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,flux_ctrl:dict,ro_elements:dict,flux_samples:ndarray,n_avg:int=300,run:bool=True)->Dataset:
+def FluxCav_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,flux_ctrl:dict,ro_elements:dict,flux_samples:ndarray,n_avg:int=300,run:bool=True,outer_batch:int=0)->Dataset:
+    """ `outer_batch` > 0 folds that many flux points into one compiled schedule, 0 compiles once per flux point. """
     sche_func = One_tone_multi_sche
     original_rof = {}
     flux_dura = 0
@@ -24,7 +25,9 @@ def FluxCav_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,flux_ctrl:dict,
     freq = ManualParameter(name="freq", unit="Hz", label="Frequency")
     freq.batched = True
     bias = ManualParameter(name="bias", unit="V", label="Flux voltage")
-    bias.batched = False
+    bias.batched = outer_batch > 0
+    if bias.batched:
+        bias.batch_size = outer_batch*freq_datapoint_idx.shape[0]
     
     spec_sched_kwargs = dict(   
         frequencies=ro_elements,
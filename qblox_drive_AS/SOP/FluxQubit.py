@@ -16,7 +16,8 @@ from qblox_drive_AS.support.Pulse_schedule_library import multi_Z_gate_two_tone_
 z_pulse_amp_OVER_const_z = sqrt(2)/2.5
 
 
-def Zgate_two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,XYFs:dict,Bias_element:list,Bias_samples:ndarray,n_avg:int=1000,run:bool=True):
+def Zgate_two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,XYFs:dict,Bias_element:list,Bias_samples:ndarray,n_avg:int=1000,run:bool=True,outer_batch:int=0):
+    """ `outer_batch` > 0 folds that many bias points into one compiled schedule, 0 compiles once per bias point. """
     print("Zgate 2tone start")
     
     sche_func = multi_Z_gate_two_tone_sche
@@ -33,7 +34,9 @@ def Zgate_two_tone_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,XYFs:dic
     freq.batched = True
     
     Z_bias = ManualParameter(name="Flux", unit="V", label="Z bias")
-    Z_bias.batched = False
+    Z_bias.batched = outer_batch > 0
+    if Z_bias.batched:
+        Z_bias.batch_size = outer_batch*freq_datapoint_idx.shape[0]
     
     
     spec_sched_kwargs = dict(   
@@ -15,7 +15,8 @@ from qblox_drive_AS.support import init_meas, init_system_atte, shut_down
 from qblox_drive_AS.support.Pulse_schedule_library import One_tone_multi_sche, pulse_preview
 
 
-def PowerDep_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict,power_samples:ndarray,n_avg:int=100,run:bool=True)->Dataset:
+def PowerDep_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:dict,power_samples:ndarray,n_avg:int=100,run:bool=True,outer_batch:int=0)->Dataset:
+    """ `outer_batch` > 0 folds that many readout amplitudes into one compiled schedule, 0 compiles once per amplitude. """
 
     sche_func = One_tone_multi_sche
     freq_datapoint_idx = arange(0,len(list(list(ro_elements.values())[0])))
@@ -33,7 +34,9 @@ def PowerDep_spec(QD_agent:QDmanager,meas_ctrl:MeasurementControl,ro_elements:di
     freq.batched = True
     
     ro_pulse_amp = ManualParameter(name="ro_amp", unit="", label="Readout pulse amplitude")
-    ro_pulse_amp.batched = False
+    ro_pulse_amp.batched = outer_batch > 0
+    if ro_pulse_amp.batched:
+        ro_pulse_amp.batch_size = outer_batch*freq_datapoint_idx.shape[0]
     
     
     spec_sched_kwargs = dict(   
@@ -2,13 +2,19 @@ import os, sys, time
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from xarray import Dataset
 from qblox_drive_AS.support.UserFriend import *
-from numpy import array, moveaxis, arange
-from quantify_scheduler.gettables import ScheduleGettable
+from numpy import array, moveaxis, arange, uint8, ndarray
+from qblox_drive_AS.support.ScheduleCache import CachedScheduleGettable
 from qblox_drive_AS.support import QDmanager, Data_manager, compose_para_for_multiplexing
 from qblox_drive_AS.support.Pulse_schedule_library import multi_Qubit_SS_sche, pulse_preview
+from qblox_drive_AS.analysis.DiscriminatorStore import discriminator_store, discriminator_key, acq_threshold_for
 
 
-def Qubit_state_single_shot(QD_agent:QDmanager,ro_elements:list,shots:int=1000,run:bool=True):
+def Qubit_state_single_shot(QD_agent:QDmanager,ro_elements:list,shots:int=1000,run:bool=True,thresholded:bool=False,raw_subsample:int=0):
+    """
+    ### Args:\n
+    * thresholded: discriminate the shots on the instrument with `acq_threshold_for`, the dataset keeps the state bits (uint8) instead of I/Q.\n
+    * raw_subsample: with `thresholded`, also take this many raw-IQ shots per state, kept as `{q}_rawIQ` and used to refresh the stored discriminators.
+    """
     sche_func = multi_Qubit_SS_sche 
 
     for q in ro_elements:
@@ -16,11 +22,13 @@ def Qubit_state_single_shot(QD_agent:QDmanager,ro_elements:list,shots:int=1000,r
         eyeson_print(f"{q} Reset time: {round(qubit_info.reset.duration()*1e6,0)} µs")
         eyeson_print(f"{q} Integration time: {round(qubit_info.measure.integration_time()*1e6,1)} µs")
 
-    
-    folder = []
+    acq_thresholds = {q: acq_threshold_for(QD_agent,q) for q in ro_elements} if thresholded else {}
+    for q in acq_thresholds:
+        eyeson_print(f"{q} discriminated on the instrument, rotation = {round(acq_thresholds[q][0],2)} deg, threshold = {round(acq_thresholds[q][1]*1000,3)} mV")
 
-    def state_dep_sched(ini_state:str):
-        slightly_print(f"Shotting for |{ini_state}>")
+    def state_dep_sched(ini_state:str, thresholds:dict, shot_num:int)->ndarray:
+        """ |g> and |e> are interleaved in one schedule, returns (ro_q, IQ, state, shots), or (ro_q, state, shots) with `thresholds`. """
+        slightly_print(f"Shotting for |{ini_state[0]}> and |{ini_state[1]}> interleaved")
         sched_kwargs = dict(   
             ini_state=ini_state,
             waveformer = QD_agent.Waveformer,
@@ -30,10 +38,11 @@ def Qubit_state_single_shot(QD_agent:QDmanager,ro_elements:list,shots:int=1000,r
             R_duration=compose_para_for_multiplexing(QD_agent,ro_elements,'r3'),
             R_integration=compose_para_for_multiplexing(QD_agent,ro_elements,'r4'),
             R_inte_delay=compose_para_for_multiplexing(QD_agent,ro_elements,'r2'),
+            acq_thresholds=thresholds,
         )
         
         if run:
-            gettable = ScheduleGettable(
+            gettable = CachedScheduleGettable(
                 QD_agent.quantum_device,
                 schedule_function=sche_func, 
                 schedule_kwargs=sched_kwargs,
@@ -41,23 +50,41 @@ def Qubit_state_single_shot(QD_agent:QDmanager,ro_elements:list,shots:int=1000,r
                 batched=True,
                 num_channels=len(ro_elements),
             )
-            QD_agent.quantum_device.cfg_sched_repetitions(shots)
-            ss_da= gettable.get() # DataArray (2*ro_q, shots)
-            reshaped_data = list(array(ss_da).reshape(len(ro_elements),2,shots)) # (ro_q, IQ, shots)
-            folder.append(reshaped_data) # (state, ro_q, IQ, shots)
+            QD_agent.quantum_device.cfg_sched_repetitions(shot_num)
+            ss_da= gettable.get() # DataArray (2*ro_q, shots*2), the 2 acq_index of a shot are adjacent
+            if thresholds:
+                # state bits, only the real part means something
+                return moveaxis(array(ss_da).reshape(len(ro_elements),-1,shot_num,2)[:,0].round().astype(uint8),-1,1) # (ro_q, shots, state) -> (ro_q, state, shots)
+            else:
+                return moveaxis(array(ss_da).reshape(len(ro_elements),2,shot_num,2),-1,2) # (ro_q, IQ, shots, state) -> (ro_q, IQ, state, shots)
 
         else:
             pulse_preview(QD_agent.quantum_device,sche_func,sched_kwargs)
+            return None
 
             
-    state_dep_sched('g')
-    state_dep_sched('e')
-    folder = moveaxis(array(folder),0,2) # (state,ro_q,IQ,shots) -> (ro_q, IQ, state, shots)
+    folder = state_dep_sched('ge', acq_thresholds, shots)
+    raw_folder = state_dep_sched('ge', {}, raw_subsample) if (thresholded and raw_subsample > 0) else None
+    if folder is None:
+        return None
+
     output_dict = {}
-    for q_idx, q_name in enumerate(ro_elements):
-        output_dict[q_name] = (["mixer","prepared_state","index"],folder[q_idx])
+    if not thresholded:
+        for q_idx, q_name in enumerate(ro_elements):
+            output_dict[q_name] = (["mixer","prepared_state","index"],folder[q_idx])
+    else:
+        for q_idx, q_name in enumerate(ro_elements):
+            output_dict[q_name] = (["prepared_state","index"],folder[q_idx],{"acq_rotation":acq_thresholds[q_name][0],"acq_threshold":acq_thresholds[q_name][1]})
+        if raw_folder is not None:
+            for q_idx, q_name in enumerate(ro_elements):
+                output_dict[f"{q_name}_rawIQ"] = (["mixer","prepared_state","raw_index"],raw_folder[q_idx])
+                # refresh the discriminator (drift check) for the next thresholded run
+                discriminator_store.classify(discriminator_key(QD_agent,q_name),raw_folder[q_idx][:,0]*1000,raw_folder[q_idx][:,1]*1000)
 
-    SS_ds = Dataset(output_dict, coords= {"mixer":array(["I","Q"]), "prepared_state":array([0,1]),"index":arange(shots)})
+    coords = {"mixer":array(["I","Q"]), "prepared_state":array([0,1]),"index":arange(shots)}
+    if raw_folder is not None:
+        coords["raw_index"] = arange(raw_subsample)
+    SS_ds = Dataset(output_dict, coords=coords)
     SS_ds.attrs["end_time"] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
     SS_ds.attrs["execution_time"] = Data_manager().get_time_now()
     
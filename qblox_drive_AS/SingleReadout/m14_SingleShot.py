@@ -44,7 +44,7 @@ def Qubit_state_single_shot(QD_agent:QDmanager,shots:int=1000,run:bool=True,q:st
                      )
     print(qubit_info.rxy.amp180())
     def state_dep_sched(ini_state:str):
-        slightly_print(f"Shotting for |{ini_state}>")
+        slightly_print(f"Shotting for |{ini_state[0]}> and |{ini_state[1]}> interleaved")
         sched_kwargs = dict(   
             q=q,
             ini_state=ini_state,
@@ -65,9 +65,10 @@ def Qubit_state_single_shot(QD_agent:QDmanager,shots:int=1000,run:bool=True,q:st
                 batched=True,
             )
             QD_agent.quantum_device.cfg_sched_repetitions(shots)
-            ss_ds= gettable.get()
+            ss_ds= gettable.get() # [I, Q], the 2 acq_index of a shot are adjacent
             
-            data[ini_state] = ss_ds
+            for state_idx, state in enumerate(ini_state):
+                data[state] = [array(ss_ds[0]).reshape(shots,2)[:,state_idx], array(ss_ds[1]).reshape(shots,2)[:,state_idx]]
             show_args(exp_kwargs, title="Single_shot_kwargs: Meas.qubit="+q)
             if Experi_info != {}:
                 show_args(Experi_info(q))
@@ -80,8 +81,7 @@ def Qubit_state_single_shot(QD_agent:QDmanager,shots:int=1000,run:bool=True,q:st
                 show_args(Experi_info(q))
             
     tau= qubit_info.measure.integration_time()        
-    state_dep_sched('g')
-    state_dep_sched('e')
+    state_dep_sched('ge')
     SS_dict = {
         "e":{"dims":("I","Q"),"data":array(data['e'])},
         "g":{"dims":("I","Q"),"data":array(data['g'])},
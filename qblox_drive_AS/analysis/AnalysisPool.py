@@ -0,0 +1,110 @@
+""" Run many `Multiplex_analyzer` jobs (files x qubits) in this process or on a process pool, the figures are rendered in the workers with the Agg backend. """
+import os, sys, traceback
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', ".."))
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from qblox_drive_AS.support.UserFriend import *
+from qblox_drive_AS.support.PhaseTracer import traced
+
+
+# worker number used when `run_analysis_jobs` isn't told, 1 analyzes in this process. More uses a spawn pool, which re-imports
+# the `__main__` script in every worker, only raise it in the scripts guarded by `if __name__ == "__main__"`
+default_workers:int = 1
+
+
+class AnalysisJob():
+    """
+    Everything a worker needs to analyze one qubit in one `.nc` file, only plain python objects so it can be pickled.\n
+    #### Args:\n
+    * exp_name: the key of `Multiplex_analyzer`, like 'm13'.\n
+    * nc_path: the raw data file.\n
+    * var_dimension: same as `Multiplex_analyzer._import_data`.\n
+    * start_kwargs: given to `Multiplex_analyzer._start_analysis`, like {"var_name":"q0"}.\n
+    * refIQ, fq_Hz: same as `Multiplex_analyzer._import_data`.\n
+    * data_var: import only this variable of the dataset (multiplied by `scale`) instead of the whole dataset.\n
+    * pic_save_folder: given to `Multiplex_analyzer._export_result`, no figure if it's None. The figures follow the mode of `figure_renderer` in this process, also in the pool workers.\n
+    * tag: anything to recognize the job, it's returned with the result.
+    """
+    def __init__(self, exp_name:str, nc_path:str, var_dimension:int, start_kwargs:dict={}, refIQ:list=[], fq_Hz:float=None, data_var:str=None, scale:float=1, pic_save_folder:str=None, tag=None):
+        self.exp_name:str = exp_name
+        self.nc_path:str = nc_path
+        self.var_dimension:int = var_dimension
+        self.start_kwargs:dict = dict(start_kwargs)
+        self.refIQ:list = list(refIQ)
+        self.fq_Hz:float = fq_Hz
+        self.data_var:str = data_var
+        self.scale:float = scale
+        self.pic_save_folder:str = pic_save_folder
+        self.tag = tag
+
+
+def run_analysis_job(job:AnalysisJob)->dict:
+    """ Analyze one job in this process, returns {"tag", "fit_packs", "plot_item"}, or {"tag", "error"} if it failed. """
+    from qblox_drive_AS.support.DataLayout import open_raw_dataset
+    from qblox_drive_AS.analysis.Multiplexing_analysis import Multiplex_analyzer
+    try:
+        with open_raw_dataset(job.nc_path) as ds:
+            data = ds if job.data_var is None else ds[job.data_var]*job.scale
+            ANA = Multiplex_analyzer(job.exp_name)
+            ANA._import_data(data, var_dimension=job.var_dimension, refIQ=job.refIQ, fq_Hz=job.fq_Hz)
+            ANA._start_analysis(**job.start_kwargs)
+            if job.pic_save_folder is not None:
+                ANA._export_result(job.pic_save_folder)
+            return {"tag":job.tag, "fit_packs":ANA.fit_packs, "plot_item":getattr(ANA, "plot_item", {})}
+    except Exception:
+        return {"tag":job.tag, "error":traceback.format_exc()}
+
+
+# a spawn pool which can't start (like a `__main__` without the guard) or broke, the callers do the work in this process then
+pool_errors:tuple = (OSError, RuntimeError, BrokenProcessPool)
+
+
+def _init_worker(figure_mode:str=None):
+    """ Agg backend, and the figure mode of the parent if given, "async" draws in the worker, which is already out of the measurement process. """
+    import matplotlib
+    matplotlib.use("Agg")
+    if figure_mode is not None:
+        from qblox_drive_AS.analysis.FigureRender import figure_renderer
+        figure_renderer.mode = "inline" if figure_mode == "async" else figure_mode
+
+
+def spawn_pool(workers:int=None, figure_mode:str=None)->ProcessPoolExecutor:
+    """
+    The process pool of the analyses, fits and figures. The workers are spawned so they don't inherit the instruments and the GUI backend of this process,
+    they plot with Agg in `figure_mode` (see `FigureRenderer`). Spawning re-imports the `__main__` script, it raises one of `pool_errors` without the guard.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=_init_worker, initargs=(figure_mode,))
+
+
+@traced("analysis_pool")
+def run_analysis_jobs(jobs:list, workers:int=None)->list:
+    """
+    Analyze `jobs` in this process or on a process pool, the results are in the same order as `jobs` whatever the workers finish first.\n
+    #### Args:\n
+    * jobs: list of `AnalysisJob`.\n
+    * workers: int, process number, default is `default_workers`. 1 runs the jobs one by one in this process,
+      more spawns a pool which re-imports the `__main__` script, so only give it under `if __name__ == "__main__"`.
+      If the pool breaks, the jobs are run here.\n
+    #### Returns:\n
+    list of the dict given by `run_analysis_job`, a failed job has the key "error" with its traceback.
+    """
+    from qblox_drive_AS.analysis.FigureRender import figure_renderer
+    workers = default_workers if workers is None else workers
+    workers = max([1, min([workers, len(jobs)])])
+    results = []
+    if workers != 1:
+        slightly_print(f"Analyze {len(jobs)} jobs with {workers} workers ...")
+        try:
+            with spawn_pool(workers, figure_renderer.mode) as pool:
+                results = list(pool.map(run_analysis_job, jobs))
+        except pool_errors as err:
+            warning_print(f"Analysis pool broke ({err!r}), analyze the jobs here.")
+            results = []
+    if len(results) == 0:
+        results = [run_analysis_job(job) for job in jobs]
+
+    for result in results:
+        if "error" in result:
+            warning_print(f"Analysis job {result['tag']} failed:\n{result['error']}")
+    return results
@@ -0,0 +1,231 @@
+""" Fit many T1/T2 curves at once, for the repeated histograms like `histo_counts` in T1/T2 measurements, and many resonator S21 rows on a process pool. """
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', ".."))
+from numpy import ndarray, array, asarray, exp, cos, sin, pi, sqrt, log, abs, mean, max, min, argmax, arange, linspace, clip, where, stack, ones, full, inf, isfinite, einsum, diagonal, eye, angle
+from numpy.fft import rfft, rfftfreq
+from numpy.linalg import solve, pinv, LinAlgError
+from numpy import nan, broadcast_to
+from multiprocessing import parent_process
+from qblox_drive_AS.support.UserFriend import *
+from qblox_drive_AS.analysis.AnalysisPool import spawn_pool, pool_errors
+
+
+def exp_decay(t:ndarray, A:ndarray, tau:ndarray, offset:ndarray)->ndarray:
+    """ A*exp(-t/tau)+offset, the parameters can be arrays with a trailing axis for `t`. """
+    return A*exp(-t/tau)+offset
+
+def damped_cos(t:ndarray, A:ndarray, T2:ndarray, f:ndarray, phase:ndarray, offset:ndarray)->ndarray:
+    """ A*exp(-t/T2)*cos(2*pi*f*t+phase)+offset, same as `Ramsey_func`. """
+    return A*exp(-t/T2)*cos(2*pi*f*t+phase)+offset
+
+
+def _exp_decay_jac(t:ndarray, p:ndarray)->tuple[ndarray, ndarray]:
+    A, tau, offset = p[:, 0:1], p[:, 1:2], p[:, 2:3]
+    decay = exp(-t/tau)
+    jac = stack([decay, A*decay*t/tau**2, ones(decay.shape)], axis=-1)
+    return A*decay+offset, jac
+
+def _damped_cos_jac(t:ndarray, p:ndarray)->tuple[ndarray, ndarray]:
+    A, T2, f, phase, offset = p[:, 0:1], p[:, 1:2], p[:, 2:3], p[:, 3:4], p[:, 4:5]
+    decay, arg = exp(-t/T2), 2*pi*f*t+phase
+    c, s = cos(arg), sin(arg)
+    jac = stack([decay*c, A*decay*c*t/T2**2, -A*decay*s*2*pi*t, -A*decay*s, ones(decay.shape)], axis=-1)
+    return A*decay*c+offset, jac
+
+
+def batch_levenberg_marquardt(model_jac:callable, t:ndarray, y:ndarray, p0:ndarray, lower:ndarray=None, upper:ndarray=None, max_iter:int=200, tol:float=1e-10)->tuple[ndarray, ndarray, ndarray]:
+    """
+    Levenberg-Marquardt on all the curves together, every curve keeps its own damping.\n
+    #### Args:\n
+    * model_jac: callable(t, p) returns (model (m, n), jacobian (m, n, k)).\n
+    * t: (n,) shared x samples. y: (m, n) curves. p0: (m, k) initial parameters.\n
+    * lower, upper: (m, k) or (k,) bounds, the steps are clipped into them.\n
+    #### Returns:\n
+    (parameters (m, k), standard errors (m, k), reduced chi-square (m,))
+    """
+    p = p0.astype(float).copy()
+    lower = full(p.shape, -inf) if lower is None else lower*ones(p.shape)
+    upper = full(p.shape, inf) if upper is None else upper*ones(p.shape)
+    p = clip(p, lower, upper)
+    damping = full(p.shape[0], 1e-3)
+    model, jac = model_jac(t, p)
+    residual = y-model
+    cost = (residual**2).sum(axis=1)
+    active = ones(p.shape[0], dtype=bool)
+    identity = eye(p.shape[1])
+
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        JTJ = einsum("mnk,mnl->mkl", jac, jac)
+        JTr = einsum("mnk,mn->mk", jac, residual)
+        lhs = JTJ+damping[:, None, None]*(diagonal(JTJ, axis1=1, axis2=2)[:, :, None]*identity+1e-12*identity)
+        try:
+            step = solve(lhs, JTr[:, :, None])[:, :, 0]
+        except LinAlgError:
+            step = einsum("mkl,ml->mk", pinv(lhs), JTr)
+        trial = clip(p+step*active[:, None], lower, upper)
+        trial_model, trial_jac = model_jac(t, trial)
+        trial_residual = y-trial_model
+        trial_cost = (trial_residual**2).sum(axis=1)
+        better = (trial_cost < cost) & isfinite(trial_cost)
+
+        converged = better & (abs(cost-trial_cost) <= tol*(cost+tol))
+        p = where(better[:, None], trial, p)
+        jac = where(better[:, None, None], trial_jac, jac)
+        residual = where(better[:, None], trial_residual, residual)
+        cost = where(better, trial_cost, cost)
+        damping = where(better, damping/10, damping*10)
+        active &= ~converged & (damping < 1e12)
+
+    dof = y.shape[1]-p.shape[1]
+    red_chi2 = cost/dof if dof > 0 else cost
+    JTJ = einsum("mnk,mnl->mkl", jac, jac)
+    covariance = pinv(JTJ)*red_chi2[:, None, None]
+    errors = sqrt(abs(diagonal(covariance, axis1=1, axis2=2)))
+    return p, errors, red_chi2
+
+
+def _as_curves(t:ndarray, data:ndarray)->tuple[ndarray, ndarray, tuple]:
+    t, data = asarray(t, dtype=float), asarray(data, dtype=float)
+    return t, data.reshape(-1, t.shape[0]), data.shape[:-1]
+
+
+def batch_T1_fit(t:ndarray, data:ndarray)->dict:
+    """
+    Fit `exp_decay` to every curve in `data`.\n
+    #### Args:\n
+    * t: (n,) evolution time, the returned tau has the same unit.\n
+    * data: (..., n), like (qubit, repeat, time).\n
+    #### Returns:\n
+    {"A", "tau", "offset", "tau_err", "red_chi2"}, each is an array in the leading shape of `data`.
+    """
+    t, y, lead_shape = _as_curves(t, data)
+    # closed-form guess, log-linear regression weighted by the signal
+    offset = y[:, -max([1, t.shape[0]//10]):].mean(axis=1)
+    signal = abs(y-offset[:, None])+1e-15
+    weight = signal**2
+    sw, st, sz = weight.sum(axis=1), (weight*t).sum(axis=1), (weight*log(signal)).sum(axis=1)
+    stt, stz = (weight*t*t).sum(axis=1), (weight*t*log(signal)).sum(axis=1)
+    slope = (sw*stz-st*sz)/(sw*stt-st**2+1e-30)
+    tau = where(slope < 0, -1/where(slope < 0, slope, -1), mean(t))
+    tau = clip(tau, (t.max()-t.min())/100, 10*t.max())
+    A = y[:, 0]-offset
+
+    p, err, red_chi2 = batch_levenberg_marquardt(_exp_decay_jac, t, y, stack([A, tau, offset], axis=1),
+                                                lower=array([-inf, 1e-3*(t[1]-t[0] if t.shape[0] > 1 else 1), -inf]), upper=array([inf, 1e3*t.max(), inf]))
+    return {"A":p[:, 0].reshape(lead_shape), "tau":p[:, 1].reshape(lead_shape), "offset":p[:, 2].reshape(lead_shape),
+            "tau_err":err[:, 1].reshape(lead_shape), "red_chi2":red_chi2.reshape(lead_shape)}
+
+
+def batch_T2_fit(t:ndarray, data:ndarray, f_max:float=None)->dict:
+    """
+    Fit `damped_cos` to every Ramsey curve in `data`, the initial frequency and phase come from the FFT of each curve.\n
+    #### Args:\n
+    * t: (n,) evolution time, T2 has the same unit and f is in its inverse unit.\n
+    * data: (..., n), like (qubit, repeat, time).\n
+    * f_max: the upper bound of the frequency, default is the Nyquist frequency of `t`.\n
+    #### Returns:\n
+    {"A", "T2", "f", "phase", "offset", "T2_err", "f_err", "red_chi2"}, each is an array in the leading shape of `data`.
+    """
+    t, y, lead_shape = _as_curves(t, data)
+    offset = y.mean(axis=1)
+    # resample on an uniform grid, so logspace sampling also works for the FFT
+    uniform_t = linspace(t.min(), t.max(), t.shape[0])
+    right = clip(t.searchsorted(uniform_t), 1, t.shape[0]-1)
+    gap = t[right]-t[right-1]
+    frac = where(gap != 0, (uniform_t-t[right-1])/where(gap != 0, gap, 1), 0)[None, :]
+    uniform_y = y[:, right-1]*(1-frac)+y[:, right]*frac-offset[:, None]
+    spectrum = rfft(uniform_y, axis=1)
+    spectrum[:, 0] = 0  # remove DC
+    freqs = rfftfreq(t.shape[0], uniform_t[1]-uniform_t[0])
+    peak = argmax(abs(spectrum), axis=1)
+    f = freqs[peak]
+    phase = angle(spectrum[arange(y.shape[0]), peak])-2*pi*f*uniform_t[0]
+    A = (y.max(axis=1)-y.min(axis=1))/2
+    T2 = full(y.shape[0], mean(t))
+    f_max = freqs[-1] if f_max is None else f_max
+
+    p, err, red_chi2 = batch_levenberg_marquardt(_damped_cos_jac, t, y, stack([A, T2, f, phase, offset], axis=1),
+                                                lower=array([0, (t.max()-t.min())/100, 0, -inf, -inf]), upper=array([inf, 5*mean(t), f_max, inf, inf]))
+    return {"A":p[:, 0].reshape(lead_shape), "T2":p[:, 1].reshape(lead_shape), "f":p[:, 2].reshape(lead_shape), "phase":p[:, 3].reshape(lead_shape),
+            "offset":p[:, 4].reshape(lead_shape), "T2_err":err[:, 1].reshape(lead_shape), "f_err":err[:, 2].reshape(lead_shape), "red_chi2":red_chi2.reshape(lead_shape)}
+
+
+def fit_curve(result:dict, t:ndarray, index:tuple=(), oversampling:int=50)->tuple[ndarray, ndarray]:
+    """ Build the fitting curve of one curve in a `batch_T1_fit` or `batch_T2_fit` result on demand, returns (t_dense, curve). """
+    t_dense = linspace(min(t), max(t), oversampling*len(t))
+    if "T2" in result:
+        return t_dense, damped_cos(t_dense, *[float(result[key][index]) for key in ["A", "T2", "f", "phase", "offset"]])
+    return t_dense, exp_decay(t_dense, *[float(result[key][index]) for key in ["A", "tau", "offset"]])
+
+
+# worker number used when `batch_resonator_fit` isn't told, 1 fits in this process. More uses a spawn pool, which re-imports
+# the `__main__` script in every worker, only raise it in the scripts guarded by `if __name__ == "__main__"`
+resonator_fit_workers:int = 1
+# the pool only pays off when every worker gets a few rows, the workers import qcat first
+resonator_rows_per_worker:int = 4
+# returned name: key in the result of `ResonatorData.fit`
+resonator_fit_keys:dict = {"fr":"fr", "Ql":"Ql", "Qi":"Qi_dia_corr", "Qc":"Qc_dia_corr", "chi_square":"chi_square",
+                           "fr_err":"fr_err", "Ql_err":"Ql_err", "Qi_err":"Qi_dia_corr_err", "Qc_err":"absQc_err"}
+
+
+def _fit_resonator_rows(freq:ndarray, rows:ndarray, keep_curves:bool)->list:
+    """ `ResonatorData.fit` of every row in this process, a failed row gives (None, error message). """
+    from qcat.analysis.resonator.photon_dep.res_data import ResonatorData
+    fitted = []
+    for row_freq, row in zip(freq, rows):
+        try:
+            result, data2plot, fit2plot = ResonatorData(freq=row_freq, zdata=row).fit()
+            fitted.append((dict(result), (data2plot, fit2plot) if keep_curves else None))
+        except Exception as err:
+            fitted.append((None, f"{type(err).__name__}: {err}"))
+    return fitted
+
+
+def batch_resonator_fit(freq:ndarray, S21:ndarray, workers:int=None, keep_curves:bool=False)->dict:
+    """
+    Fit the resonator circle of every S21 row by `ResonatorData.fit`, in this process or shared by a process pool.\n
+    #### Args:\n
+    * freq: (n,) shared frequencies, or (..., n) one axis per row.\n
+    * S21: (..., n) complex, like (bias, freq) or (power, freq).\n
+    * workers: int, process number, default is `resonator_fit_workers`. 1 fits the rows one by one in this process,
+      more spawns a pool which re-imports the `__main__` script, so only give it under `if __name__ == "__main__"`.\n
+    * keep_curves: also return the (data2plot, fit2plot) of every row for plotting.\n
+    #### Returns:\n
+    {"fr", "Ql", "Qi", "Qc", "chi_square", "fr_err", "Ql_err", "Qi_err", "Qc_err"} arrays in the leading shape of `S21`, NaN for the failed rows,
+    "results" the full fit results (None if failed) and "curves" (with `keep_curves`), both are flat lists in the row order.
+    """
+    S21 = asarray(S21, dtype=complex)
+    lead_shape = S21.shape[:-1]
+    rows = S21.reshape(-1, S21.shape[-1])
+    freq = broadcast_to(asarray(freq, dtype=float), S21.shape).reshape(rows.shape)
+
+    if workers is None:
+        # no pool inside a pool worker, like the `run_analysis_jobs` ones
+        workers = 1 if parent_process() is not None else resonator_fit_workers
+    workers = int(max([1, min([workers, rows.shape[0]//resonator_rows_per_worker])]))
+    fitted = []
+    if workers != 1:
+        chunks = [slice(start, rows.shape[0], workers) for start in range(workers)]
+        try:
+            with spawn_pool(workers) as pool:
+                chunk_fits = list(pool.map(_fit_resonator_rows, [freq[chunk] for chunk in chunks], [rows[chunk] for chunk in chunks], [keep_curves]*workers))
+            fitted = [None]*rows.shape[0]
+            for chunk, chunk_fit in zip(chunks, chunk_fits):
+                fitted[chunk] = chunk_fit
+        except pool_errors as err:
+            warning_print(f"Resonator fit pool isn't available ({err}), fit the rows one by one.")
+            fitted = []
+    if len(fitted) == 0:
+        fitted = _fit_resonator_rows(freq, rows, keep_curves)
+
+    results = [result for result, _ in fitted]
+    for idx, (result, message) in enumerate(fitted):
+        if result is None:
+            warning_print(f"Resonator fit of row {idx} failed: {message}")
+    fit_values = {name: array([nan if result is None else float(result.get(key, nan)) for result in results]).reshape(lead_shape) for name, key in resonator_fit_keys.items()}
+    fit_values["results"] = results
+    if keep_curves:
+        fit_values["curves"] = [curves if result is not None else None for result, curves in fitted]
+    return fit_values
@@ -0,0 +1,127 @@
+""" Trained single-shot discriminators kept across runs, a new single-shot file is classified by the stored Gaussians instead of a full fit. """
+import os, sys, json, time, hashlib, threading
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', ".."))
+from numpy import ndarray, array, sqrt, sum, abs, max, vstack, exp, clip, arctan2, cos, sin, pi
+from qblox_drive_AS.support.UserFriend import *
+from qblox_drive_AS.support.QDmanager import QDmanager
+from qblox_drive_AS.support.Path_Book import qdevice_backup_dir
+from qblox_drive_AS.support.Pulse_schedule_library import two_gaussian_EM
+
+
+def readout_signature(QD_agent:QDmanager, q:str)->dict:
+    """ The readout settings of `q` a discriminator belongs to. """
+    qubit = QD_agent.quantum_device.get_element(q)
+    return {"ROF":qubit.clock_freqs.readout(), "pulse_amp":qubit.measure.pulse_amp(), "pulse_duration":qubit.measure.pulse_duration(),
+            "integration_time":qubit.measure.integration_time(), "acq_delay":qubit.measure.acq_delay()}
+
+
+def discriminator_key(QD_agent:QDmanager, q:str)->str:
+    """ `q` and a hash of its `readout_signature`, changing any readout setting gives a new key. """
+    signature = json.dumps(readout_signature(QD_agent, q), sort_keys=True, default=float)
+    return f"{q}_{hashlib.sha1(signature.encode()).hexdigest()[:12]}"
+
+
+class DiscriminatorStore():
+    """
+    Two-Gaussian discriminators (see `two_gaussian_EM`) keyed by `discriminator_key`, saved in a JSON file.\n
+    `classify` re-uses the stored Gaussians and fits only the populations. If the blobs moved more than `drift_sigma`
+    sigma (or sigma changed by more than the same fraction), the Gaussians are refitted starting from the stored ones.\n
+    The centers and sigma are in the unit of the given shots, use the same unit (mV in the analyzers) for a key.
+    """
+    def __init__(self, file_path:str=None, drift_sigma:float=0.3):
+        self.file_path:str = file_path
+        self.drift_sigma:float = drift_sigma
+        self.models:dict = {}
+        self.__lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        if self.file_path is None or not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path) as rec:
+                self.models = json.load(rec)
+        except (OSError, ValueError) as err:
+            warning_print(f"Broken discriminator store was ignored: {err}")
+
+    def save(self):
+        if self.file_path is None:
+            return
+        temp_path = f"{self.file_path}.{os.getpid()}.tmp"
+        with self.__lock:
+            with open(temp_path, 'w') as rec:
+                json.dump(self.models, rec, indent=1)
+            os.replace(temp_path, self.file_path)
+
+    def invalidate(self, key:str=None):
+        """ Forget the discriminator of `key`, or all of them if None. """
+        if key is None:
+            self.models.clear()
+        else:
+            self.models.pop(key, None)
+        self.save()
+
+    def classify(self, key:str, g_IQ:ndarray, e_IQ:ndarray)->dict:
+        """
+        Populations of the g- and e-prepared shots with the discriminator of `key`, train one if there's no such discriminator.\n
+        #### Returns:\n
+        `two_gaussian_EM` result with "source": 'cached', 'refit' (drifted) or 'trained', and "drift" in sigma.
+        """
+        g_IQ, e_IQ = array(g_IQ, dtype=float), array(e_IQ, dtype=float)
+        model = self.models.get(key)
+        if model is None:
+            result = two_gaussian_EM(g_IQ, e_IQ)
+            result["source"], result["drift"] = "trained", 0.
+        else:
+            result = two_gaussian_EM(g_IQ, e_IQ, init=model, fixed_gaussians=True)
+            result["drift"] = self.__drift(model, g_IQ, e_IQ, result)
+            result["source"] = "cached"
+            if result["drift"] > self.drift_sigma:
+                eyeson_print(f"Discriminator {key} drifted {round(result['drift'],2)} sigma, refit it.")
+                drift = result["drift"]
+                result = two_gaussian_EM(g_IQ, e_IQ, init=model)
+                result["source"], result["drift"] = "refit", drift
+            else:
+                return result
+
+        self.reload()  # keep the discriminators other processes saved meanwhile
+        self.models[key] = {"cg":[float(x) for x in result["cg"]], "ce":[float(x) for x in result["ce"]], "sigma":float(result["sigma"]),
+                            "n_shots":int(g_IQ.shape[-1]+e_IQ.shape[-1]), "trained_at":time.strftime('%Y-%m-%d %H:%M:%S')}
+        self.save()
+        return result
+
+    @staticmethod
+    def __drift(model:dict, g_IQ:ndarray, e_IQ:ndarray, result:dict)->float:
+        """ How far the blobs moved from the stored ones in the unit of sigma, by one M-step with the responsibilities of the stored Gaussians. """
+        cg, ce, sigma = array(model["cg"]), array(model["ce"]), model["sigma"]
+        shots = vstack([g_IQ.T, e_IQ.T])
+        d2_g, d2_e = sum((shots-cg)**2, axis=1), sum((shots-ce)**2, axis=1)
+        prior_e = clip(array([result["Thermal"]]*g_IQ.shape[-1]+[1-result["Relax_frac"]]*e_IQ.shape[-1]), 1e-9, 1-1e-9)
+        r_e = 1/(1+(1-prior_e)/prior_e*exp(clip((d2_e-d2_g)/(2*sigma**2), -700, 700)))
+        new_cg = sum((1-r_e)[:,None]*shots, axis=0)/sum(1-r_e)
+        new_ce = sum(r_e[:,None]*shots, axis=0)/sum(r_e)
+        new_sigma = sqrt((sum((1-r_e)*sum((shots-new_cg)**2, axis=1))+sum(r_e*sum((shots-new_ce)**2, axis=1)))/(2*shots.shape[0]))
+        return float(max([sqrt(sum((new_cg-cg)**2))/sigma, sqrt(sum((new_ce-ce)**2))/sigma, abs(new_sigma/sigma-1)]))
+
+
+def acq_threshold_for(QD_agent:QDmanager, q:str, store:DiscriminatorStore=None)->tuple[float, float]:
+    """
+    (rotation in degree, threshold in V) for the on-instrument discrimination of `q`.\n
+    The rotation is the stored `QD_agent.rotate_angle`, or the direction from the g to the e center if it's 0.
+    The threshold is the middle of the two centers of the stored discriminator on the rotated I axis.
+    """
+    store = discriminator_store if store is None else store
+    model = store.models.get(discriminator_key(QD_agent, q))
+    if model is None:
+        raise KeyError(f"No discriminator for {q} with the present readout settings, analyze a raw-IQ single shot (histo_ana or QubitMonitor) first !")
+    cg, ce = array(model["cg"])/1000, array(model["ce"])/1000 # mV -> V
+    if q in QD_agent.rotate_angle and QD_agent.rotate_angle[q][0] != 0:
+        angle_degree = float(QD_agent.rotate_angle[q][0])
+    else:
+        angle_degree = float(arctan2(ce[1]-cg[1], ce[0]-cg[0])*180/pi)
+    angle = angle_degree*pi/180
+    rotated_I = [center[0]*cos(angle)+center[1]*sin(angle) for center in [cg, ce]]  # same as `rotate_data`
+    return angle_degree, float(sum(rotated_I)/2)
+
+
+discriminator_store = DiscriminatorStore(os.path.join(qdevice_backup_dir, "readout_discriminators.json"))
@@ -0,0 +1,155 @@
+""" Render the analysis figures out of the measurement process: the analyzer dumps its plot state to a sidecar `.npz`, an Agg process pool makes the PNGs later or never. """
+import os, sys, atexit, pickle, traceback
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', ".."))
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from numpy import ndarray, load, savez, frombuffer, uint8, array
+from xarray import Dataset
+from qblox_drive_AS.support.UserFriend import *
+from qblox_drive_AS.analysis.AnalysisPool import spawn_pool, pool_errors
+
+
+figure_modes:tuple = ("inline", "async", "on_demand", "off")
+sidecar_suffix:str = ".plotitem.npz"
+
+
+def _plot_view(ds:Dataset, qubit:str)->Dataset:
+    """ What the plots read from the raw dataset: its attrs, coords and the variables of `qubit`, loaded in the memory. """
+    keep = [var for var in ds.data_vars if str(var).split("_")[0] == qubit]
+    return ds[keep].compute()
+
+
+def dump_plot_state(analyzer, pic_save_folder:str)->str:
+    """
+    Save what `analyzer._render_figures` needs into a sidecar next to the figures, returns its path.\n
+    `pic_save_folder` is given to `_render_figures` as it is, some analyses take a file path (or stem) there instead of a folder,
+    then the sidecar goes into the folder of that path.\n
+    The arrays of the analyzer are saved as npz entries, the others (dicts, fit results...) are pickled into one entry.
+    The raw dataset is cut down to the analyzed qubit, the attributes can't be pickled (like a fit function) are skipped.
+    """
+    arrays, objects = {}, {}
+    for name, value in vars(analyzer).items():
+        if isinstance(value, ndarray) and value.dtype != object:
+            arrays[f"attr.{name}"] = value
+            continue
+        if name == "ds" and isinstance(value, Dataset):
+            value = _plot_view(value, getattr(analyzer, "qubit", getattr(analyzer, "target_q", "")))
+        try:
+            objects[name] = pickle.dumps(value)
+        except Exception:
+            continue
+
+    label = getattr(analyzer, "qubit", getattr(analyzer, "target_q", ""))
+    sidecar_folder = pic_save_folder if os.path.isdir(pic_save_folder) else os.path.dirname(os.path.abspath(pic_save_folder))
+    path = os.path.join(sidecar_folder, f"{analyzer.exp_name}_{label}_{id(analyzer):x}_{os.getpid()}{sidecar_suffix}")
+    savez(path, exp_name=array(analyzer.exp_name), pic_save_folder=array(pic_save_folder), objects=frombuffer(pickle.dumps(objects), dtype=uint8), **arrays)
+    return path
+
+
+def render_sidecar(path:str, remove:bool=True)->dict:
+    """ Make the figures of a sidecar by `dump_plot_state` in this process, returns {"path"} or {"path", "error"} with the traceback. """
+    from qblox_drive_AS.analysis.Multiplexing_analysis import Multiplex_analyzer
+    try:
+        with load(path) as sidecar:
+            ANA = Multiplex_analyzer(str(sidecar["exp_name"]))
+            pic_save_folder = str(sidecar["pic_save_folder"])
+            objects = pickle.loads(sidecar["objects"].tobytes())
+            for name, value in objects.items():
+                setattr(ANA, name, pickle.loads(value))
+            for key in sidecar.files:
+                if key.startswith("attr."):
+                    setattr(ANA, key[len("attr."):], sidecar[key])
+        ANA._render_figures(pic_save_folder)
+        if remove:
+            os.remove(path)
+        return {"path":path}
+    except Exception:
+        return {"path":path, "error":traceback.format_exc()}
+
+
+class FigureRenderer():
+    """
+    How `Multiplex_analyzer._export_result` makes the figures, set `mode` to:\n
+    * "inline": plot in the analysis process, same as before.\n
+    * "async": dump a sidecar and render it on the Agg process pool, the analysis goes on at once. `flush` waits for them.\n
+    * "on_demand": only dump the sidecars, `render_pending` renders them later.\n
+    * "off": no figure at all, for the high-rate monitoring.\n
+    Without a picture folder (the figure is shown on screen) "async" and "on_demand" plot inline.
+    #### Args:\n
+    * mode: one of `figure_modes`.\n
+    * workers: int, process number of the pool, None means `os.cpu_count()`.
+    """
+    def __init__(self, mode:str="inline", workers:int=None):
+        self.mode = mode
+        self.workers:int = workers
+        self.keep_sidecars:bool = False
+        self.__pool:ProcessPoolExecutor = None
+        self.__futures:list = []
+        atexit.register(self.__flush_at_exit)
+
+    @property
+    def mode(self)->str:
+        return self.__mode
+    @mode.setter
+    def mode(self, mode:str):
+        if mode not in figure_modes:
+            raise ValueError(f"Figure mode should be one of {figure_modes}, but '{mode}' was given !")
+        self.__mode = mode
+
+    @property
+    def enabled(self)->bool:
+        """ False in the "off" mode, the callers skip their figures. """
+        return self.__mode != "off"
+
+    def export(self, analyzer, pic_save_folder:str=None):
+        """ Make the figures of `analyzer` in the current mode. """
+        if self.__mode == "off":
+            return
+        if self.__mode == "inline" or pic_save_folder is None:
+            analyzer._render_figures(pic_save_folder)
+            return
+        path = dump_plot_state(analyzer, pic_save_folder)
+        if self.__mode == "async":
+            self.__submit(path)
+
+    def render_pending(self, folder:str, wait:bool=True)->int:
+        """ Render the sidecars in `folder` (and its sub-folders) on the pool, like the "on_demand" ones. Returns how many were submitted. """
+        paths = [os.path.join(parent, name) for parent, _, files in os.walk(folder) for name in sorted(files) if name.endswith(sidecar_suffix)]
+        for path in paths:
+            self.__submit(path)
+        if wait:
+            self.flush()
+        return len(paths)
+
+    def flush(self):
+        """ Wait for the submitted renders, the failed ones are warned with their traceback. """
+        futures, self.__futures = self.__futures, []
+        for future in futures:
+            try:
+                result = future.result()
+            except BrokenProcessPool as err:
+                result = {"path":"", "error":repr(err)}
+            if "error" in result:
+                warning_print(f"Figure of {result['path']} failed:\n{result['error']}")
+
+    def __submit(self, path:str):
+        try:
+            if self.__pool is None:
+                self.__pool = spawn_pool(self.workers)
+            self.__futures.append(self.__pool.submit(render_sidecar, path, not self.keep_sidecars))
+        except pool_errors as err:
+            warning_print(f"Figure pool isn't available ({err}), render {path} here.")
+            self.__pool = None
+            result = render_sidecar(path, not self.keep_sidecars)
+            if "error" in result:
+                warning_print(f"Figure of {path} failed:\n{result['error']}")
+
+    def __flush_at_exit(self):
+        if len(self.__futures) != 0:
+            slightly_print(f"Waiting for {len(self.__futures)} figures ...")
+        self.flush()
+        if self.__pool is not None:
+            self.__pool.shutdown()
+
+
+figure_renderer = FigureRenderer()
@@ -1,5 +1,5 @@
 from numpy import array, mean, median, argmax, linspace, arange, moveaxis, empty_like, std, average, transpose, where, arctan2, sort, polyfit, delete, degrees
-from numpy import sqrt, pi
+from numpy import sqrt, pi, isfinite
 from numpy import ndarray
 from xarray import Dataset, DataArray, open_dataset
 from qcat.analysis.base import QCATAna
@@ -9,18 +9,21 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', "
 import quantify_core.data.handling as dh
 from qblox_drive_AS.support.UserFriend import *
 from qblox_drive_AS.support.QDmanager import QDmanager, Data_manager
-from qblox_drive_AS.support.Pulse_schedule_library import QS_fit_analysis, Rabi_fit_analysis, T2_fit_analysis, Fit_analysis_plot, T1_fit_analysis, cos_fit_analysis, IQ_data_dis, twotone_comp_plot, gate_phase_fit_analysis
-from qblox_drive_AS.support.QuFluxFit import remove_outlier_after_fit
+from qblox_drive_AS.support.PhaseTracer import traced
+from qblox_drive_AS.support.DataLayout import expand_dataset
+from qblox_drive_AS.support.Pulse_schedule_library import QS_fit_analysis, Rabi_fit_analysis, Fit_analysis_plot, T1_fit_analysis, cos_fit_analysis, IQ_data_dis, twotone_comp_plot, gate_phase_fit_analysis
+from qblox_drive_AS.support.QuFluxFit import remove_outlier_after_fit, sortAndDecora
 from scipy.optimize import curve_fit
 from qblox_drive_AS.support.QuFluxFit import remove_outliers_with_window
 from qcat.analysis.state_discrimination.readout_fidelity import GMMROFidelity
 from qcat.analysis.state_discrimination import p01_to_Teff
 from qcat.analysis.state_discrimination.discriminator import get_proj_distance
 from qcat.visualization.readout_fidelity import plot_readout_fidelity
-from qcat.analysis.resonator.photon_dep.res_data import ResonatorData
 from qblox_drive_AS.support import rotate_onto_Inphase, rotate_data
-from qcat.visualization.qubit_relaxation import plot_qubit_relaxation
 from qcat.analysis.qubit.relaxation import qubit_relaxation_fitting
+from qblox_drive_AS.analysis.BatchFitting import batch_T1_fit, batch_T2_fit, batch_resonator_fit, fit_curve
+from qblox_drive_AS.analysis.DiscriminatorStore import discriminator_store
+from qblox_drive_AS.analysis.FigureRender import figure_renderer
 from datetime import datetime
 from matplotlib.figure import Figure
 
@@ -239,19 +242,17 @@ class analysis_tools():
         self.collected_freq = []
         self.collected_flux = []
         try:
-            freq_fit = []
-            fit_err = []
-            for idx, _ in enumerate(S21):
-                res_er = ResonatorData(freq=self.freqs,zdata=array(S21[idx]))
-                result, _, _ = res_er.fit()
-                freq_fit.append(result['fr'])
-                fit_err.append(result['chi_square'])
+            # all the bias rows in one batch, the failed rows are skipped
+            res_fits = batch_resonator_fit(self.freqs, S21)
+            fitted = where(isfinite(res_fits["fr"]))[0]
+            freq_fit = res_fits["fr"][fitted]
+            fit_err = res_fits["chi_square"][fitted]
 
             _, indexs = remove_outliers_with_window(array(fit_err),int(len(fit_err)/3),m=1)
             
             for i in indexs:
                 self.collected_freq.append(freq_fit[i])
-                self.collected_flux.append(list(self.bias)[i])
+                self.collected_flux.append(self.bias[fitted][i])
             self.fit_results = cos_fit_analysis(array(self.collected_freq),array(self.collected_flux))
             paras = array(self.fit_results.attrs['coefs'])
 
@@ -352,24 +353,27 @@ class analysis_tools():
         else:
             self.contrast = rotate_data(IQarray,refIQ[0])[0]
         if fit_func is not None:
-            # try:
             self.fit_z = []
             self.fit_f = []
-            def parabola(x,a,b,c):
-                return a*array(x)**2+b*array(x)+c
             for z_idx, a_z_data in enumerate(self.contrast):
-                if min(self.f) <= fit_func(a_z_data,self.f).attrs['f01_fit'] and fit_func(a_z_data,self.f).attrs['f01_fit'] <= max(self.f):
-                    self.fit_f.append(fit_func(a_z_data,self.f).attrs['f01_fit']*1e-9) # GHz
+                f01_fit = fit_func(a_z_data,self.f).attrs['f01_fit']
+                if min(self.f) <= f01_fit and f01_fit <= max(self.f):
+                    self.fit_f.append(f01_fit*1e-9) # GHz
                     self.fit_z.append(self.z[z_idx])
-            
-            if not filter_outlier:
-                self.paras, _ = curve_fit(parabola,self.fit_z,self.fit_f)
-            else:
-                self.filtered_z, self.filtered_f, self.paras = remove_outlier_after_fit(parabola,self.fit_z,self.fit_f)
-            
-            self.fit_packs["sweet_bias"] = self.ref_z + float(-self.paras[1]/(2*self.paras[0])) # offset + z_pulse_amp
-            self.fit_packs["xyf"] = float(parabola(float(-self.paras[1]/(2*self.paras[0])),*self.paras))*1e9
-            self.fit_packs["parabola_paras"] = list(self.paras)
+        else:
+            # the peak of every bias column by the threshold scan, contrast is in (bias, freq)
+            peaks = sortAndDecora(self.z,self.f,self.contrast.transpose())
+            self.fit_z = list(peaks[:,0])
+            self.fit_f = list(peaks[:,1]*1e-9) # GHz
+
+        if not filter_outlier:
+            self.paras, _ = curve_fit(parabola,self.fit_z,self.fit_f)
+        else:
+            self.filtered_z, self.filtered_f, self.paras = remove_outlier_after_fit(parabola,self.fit_z,self.fit_f)
+        
+        self.fit_packs["sweet_bias"] = self.ref_z + float(-self.paras[1]/(2*self.paras[0])) # offset + z_pulse_amp
+        self.fit_packs["xyf"] = float(parabola(float(-self.paras[1]/(2*self.paras[0])),*self.paras))*1e9
+        self.fit_packs["parabola_paras"] = list(self.paras)
     
     def fluxQb_plot(self, save_pic_path:str=None):
         fig, ax = plt.subplots(figsize=(13,9))
@@ -430,16 +434,39 @@ class analysis_tools():
         if save_pic_path != "": slightly_print(f"pic saved located:\n{save_pic_path}")
         Fit_analysis_plot(self.fit_packs,save_path=save_pic_path,P_rescale=None,Dis=None,q=self.qubit)
 
-    def oneshot_ana(self,data:DataArray,tansition_freq_Hz:float=None):
+    def oneshot_ana(self,data:DataArray,tansition_freq_Hz:float=None,discriminator_key:str=None):
+        """
+        With `discriminator_key`, the shots are classified by the stored discriminator (see `DiscriminatorStore`) instead of training a GMM.
+        Thresholded data (state bits, no `mixer` dimension) is counted directly, and the rotation angle is None.
+        """
         self.fq = tansition_freq_Hz
-        self.gmm2d_fidelity = GMMROFidelity()
-        self.gmm2d_fidelity._import_data(data)
-        self.gmm2d_fidelity._start_analysis()
-        g1d_fidelity = self.gmm2d_fidelity.export_G1DROFidelity()
-        
-        p00 = g1d_fidelity.g1d_dist[0][0][0]
-        self.thermal_populations = g1d_fidelity.g1d_dist[0][0][1]
-        p11 = g1d_fidelity.g1d_dist[1][0][1]
+        self.thresholded:bool = "mixer" not in data.dims
+        if self.thresholded:
+            self.gmm2d_fidelity = None
+            bits = array(data.transpose("prepared_state","index")) != 0
+            self.thermal_populations = float(mean(bits[0]))
+            self.effT_mK = p01_to_Teff(self.thermal_populations, self.fq)*1000 if self.fq is not None else 0
+            self.RO_fidelity_percentage = (1-self.thermal_populations+float(mean(bits[1])))*100/2
+            self.RO_rotate_angle = None
+            self.fit_packs = {"effT_mK":self.effT_mK,"thermal_population":self.thermal_populations,"RO_fidelity":self.RO_fidelity_percentage,"RO_rotation_angle":self.RO_rotate_angle}
+            return
+        if discriminator_key is None:
+            self.gmm2d_fidelity = GMMROFidelity()
+            self.gmm2d_fidelity._import_data(data)
+            self.gmm2d_fidelity._start_analysis()
+            g1d_fidelity = self.gmm2d_fidelity.export_G1DROFidelity()
+            
+            p00 = g1d_fidelity.g1d_dist[0][0][0]
+            self.thermal_populations = g1d_fidelity.g1d_dist[0][0][1]
+            p11 = g1d_fidelity.g1d_dist[1][0][1]
+            centers = self.gmm2d_fidelity.mapped_centers
+        else:
+            self.gmm2d_fidelity = None # trained in `oneshot_plot` if it's needed
+            discrimination = discriminator_store.classify(discriminator_key, array(data)[:,0], array(data)[:,1])
+            p00 = 1-discrimination["Thermal"]
+            self.thermal_populations = discrimination["Thermal"]
+            p11 = 1-discrimination["Relax_frac"]
+            centers = [discrimination["cg"], discrimination["ce"]]
         if self.fq is not None:
             self.effT_mK = p01_to_Teff(self.thermal_populations, self.fq)*1000
         else:
@@ -447,7 +474,7 @@ class analysis_tools():
         self.RO_fidelity_percentage = (p00+p11)*100/2
 
 
-        _, self.RO_rotate_angle = rotate_onto_Inphase(self.gmm2d_fidelity.mapped_centers[0],self.gmm2d_fidelity.mapped_centers[1])
+        _, self.RO_rotate_angle = rotate_onto_Inphase(centers[0],centers[1])
         z = moveaxis(array(data),0,1) # (IQ, state, shots) -> (state, IQ, shots)
         self.rotated_data = empty_like(array(data))
         for state_idx, state_data in enumerate(z):
@@ -456,7 +483,12 @@ class analysis_tools():
         self.fit_packs = {"effT_mK":self.effT_mK,"thermal_population":self.thermal_populations,"RO_fidelity":self.RO_fidelity_percentage,"RO_rotation_angle":self.RO_rotate_angle}
 
     def oneshot_plot(self,save_pic_path:str=None):
+        if self.thresholded:
+            eyeson_print(f"Thresholded single shots have no I/Q to plot, P(|1>) of |0> = {round(self.thermal_populations*100,2)} %, fidelity = {round(self.RO_fidelity_percentage,2)} %")
+            return
         da = DataArray(moveaxis(self.rotated_data,0,1), coords= [("mixer",["I","Q"]), ("prepared_state",[0,1]), ("index",arange(array(self.rotated_data).shape[2]))] )
+        if self.gmm2d_fidelity is None:
+            self.gmm2d_fidelity = GMMROFidelity()
         self.gmm2d_fidelity._import_data(da)
         self.gmm2d_fidelity._start_analysis()
         g1d_fidelity = self.gmm2d_fidelity.export_G1DROFidelity()
@@ -469,24 +501,23 @@ class analysis_tools():
         time_samples = array(self.ds[f"{var}_x"])[0][0]
         reshaped = moveaxis(array(raw_data),0,1)  # (repeat, IQ, idx)
         self.qubit = var
+        self.echo:bool=False if raw_data.attrs["spin_num"] == 0 else True
 
+        if len(ref) == 1:
+            curves = array([rotate_data(data,ref[0])[0] for data in reshaped])
+        else:
+            curves = sqrt((reshaped[:,0]-ref[0])**2+(reshaped[:,1]-ref[1])**2)
+        self.plot_item = {"data":curves[-1]*1000,"time":array(time_samples)*1e6}
 
-        self.T2_fit = []
-        for idx, data in enumerate(reshaped):
-            self.echo:bool=False if raw_data.attrs["spin_num"] == 0 else True
-            if len(ref) == 1:
-                self.data_n = rotate_data(data,ref[0])[0]
-            else:
-                self.data_n = sqrt((data[0]-ref[0])**2+(data[1]-ref[1])**2)
-            self.plot_item = {"data":self.data_n*1000,"time":array(time_samples)*1e6}
-            if not self.echo:
-                self.ans = T2_fit_analysis(self.plot_item["data"]/1000,self.plot_item["time"]/1e6)
-                self.T2_fit.append(self.ans.attrs["T2_fit"]*1e6)
-                self.fit_packs["freq"] = self.ans.attrs['f']
-            else:
-                self.ans = qubit_relaxation_fitting(self.plot_item["time"],self.plot_item["data"])
-                self.T2_fit.append(self.ans.params["tau"].value)
-                self.fit_packs["freq"] = 0
+        # fit all the repeats together, time in µs
+        if not self.echo:
+            self.batch_fit = batch_T2_fit(self.plot_item["time"],curves,f_max=30)
+            self.T2_fit = list(self.batch_fit["T2"])
+            self.fit_packs["freq"] = float(self.batch_fit["f"][-1])*1e6
+        else:
+            self.batch_fit = batch_T1_fit(self.plot_item["time"],curves*1000)
+            self.T2_fit = list(self.batch_fit["tau"])
+            self.fit_packs["freq"] = 0
 
         
         self.fit_packs["median_T2"] = median(array(self.T2_fit))
@@ -515,21 +546,33 @@ class analysis_tools():
     def T2_plot(self,save_pic_path:str=None):
         save_pic_path = os.path.join(save_pic_path,f"{self.qubit}_{'Echo' if self.echo else 'Ramsey'}_{self.ds.attrs['execution_time'].replace(' ', '_')}.png") if save_pic_path is not None else ""
         if save_pic_path != "" : slightly_print(f"pic saved located:\n{save_pic_path}")
+        title = f"{self.qubit} {'T2' if self.echo else 'T2*'} = {round(self.fit_packs['median_T2'],1)} µs"
         if not self.echo:
-            Fit_analysis_plot(self.ans,P_rescale=False,Dis=None,spin_echo=self.echo,save_path=save_pic_path,q=self.qubit)
-        else:
-            fig, ax = plt.subplots()
-            ax = plot_qubit_relaxation(self.plot_item["time"],self.plot_item["data"], ax, self.ans)
-            ax.set_title(f"{self.qubit} T2 = {round(self.ans.params['tau'].value,1)} µs" )
-            if save_pic_path != "" : 
-                plt.savefig(save_pic_path)
-                plt.close()
-            else:
-                plt.show()
+            title += f", detuning = {round(self.fit_packs['freq']*1e-6,3)} MHz"
+        self._relaxation_plot(title, save_pic_path)
 
         if len(self.T2_fit) > 1:
             Data_manager().save_histo_pic(None,{str(self.qubit):self.T2_fit},self.qubit,mode=f"{'t2' if self.echo else 't2*'}",pic_folder=os.path.split(save_pic_path)[0])
 
+    def _relaxation_plot(self, title:str, save_pic_path:str):
+        """ The last repeat in `plot_item` with its curve in `batch_fit`, the title has the values in `fit_packs`. """
+        t_dense, fitted = fit_curve(self.batch_fit, self.plot_item["time"], (-1,))
+        if "T2" in self.batch_fit:
+            fitted = fitted*1000  # Ramsey is fitted in V
+        fig, ax = plt.subplots(nrows =1,figsize =(6,4),dpi =250)
+        ax.scatter(self.plot_item["time"],self.plot_item["data"],marker='o',s=8,label="data")
+        ax.plot(t_dense,fitted,color="red",label="fit")
+        ax.set_xlabel(r"$t_{f}$"+r"$\ [\mu$s]")
+        ax.set_ylabel('Contrast'+' [mV]')
+        ax.set_title(title)
+        ax.legend()
+        plt.tight_layout()
+        if save_pic_path != "" : 
+            plt.savefig(save_pic_path)
+            plt.close()
+        else:
+            plt.show()
+
     def XYF_cali_plot(self,save_pic_path:str=None,fq_MHz:int=None):
         save_pic_path = os.path.join(save_pic_path,f"{self.qubit}_XYFcalibration_{Data_manager().get_time_now()}.png") if save_pic_path is not None else ""
         if save_pic_path != "" : slightly_print(f"pic saved located:\n{save_pic_path}")
@@ -541,30 +584,23 @@ class analysis_tools():
         reshaped = moveaxis(array(raw_data),0,1)  # (repeat, IQ, idx)
         self.qubit = var
         self.plot_item = {"time":array(time_samples)*1e6}
-        self.T1_fit = []
-        for idx, data in enumerate(reshaped):
-            if len(ref) == 1:
-                self.plot_item["data"] = rotate_data(data,ref[0])[0]*1000 # I
-            else:
-                self.plot_item["data"] = sqrt((data[0]-ref[0])**2+(data[1]-ref[1])**2)*1000
+        if len(ref) == 1:
+            curves = array([rotate_data(data,ref[0])[0] for data in reshaped])*1000 # I
+        else:
+            curves = sqrt((reshaped[:,0]-ref[0])**2+(reshaped[:,1]-ref[1])**2)*1000
+        self.plot_item["data"] = curves[-1]
 
-            self.ans = qubit_relaxation_fitting(self.plot_item["time"],self.plot_item["data"])
-            self.T1_fit.append(self.ans.params["tau"].value)
+        # fit all the repeats together, time in µs
+        self.batch_fit = batch_T1_fit(self.plot_item["time"],curves)
+        self.T1_fit = list(self.batch_fit["tau"])
         self.fit_packs["median_T1"] = median(array(self.T1_fit))
         self.fit_packs["mean_T1"] = mean(array(self.T1_fit))
         self.fit_packs["std_T1"] = std(array(self.T1_fit))
     
     def T1_plot(self,save_pic_path:str=None):
         save_pic_path = os.path.join(save_pic_path,f"{self.qubit}_T1_{self.ds.attrs['execution_time'].replace(' ', '_')}.png") if save_pic_path is not None else ""
-        fig, ax = plt.subplots()
-        ax = plot_qubit_relaxation(self.plot_item["time"],self.plot_item["data"], ax, self.ans)
-        ax.set_title(f"{self.qubit} T1 = {round(self.ans.params['tau'].value,1)} µs" )
-        if save_pic_path != "" : 
-            slightly_print(f"pic saved located:\n{save_pic_path}")
-            plt.savefig(save_pic_path)
-            plt.close()
-        else:
-            plt.show()
+        if save_pic_path != "" : slightly_print(f"pic saved located:\n{save_pic_path}")
+        self._relaxation_plot(f"{self.qubit} T1 = {round(self.fit_packs['median_T1'],1)} µs", save_pic_path)
         if len(self.T1_fit) > 1:
             Data_manager().save_histo_pic(None,{str(self.qubit):self.T1_fit},self.qubit,mode="t1",pic_folder=os.path.split(save_pic_path)[0])
 
@@ -870,6 +906,15 @@ class analysis_tools():
 
     def gateError_ana(self,var:str,tansition_freq_Hz:float=None):
         self.qubit = var
+        self.fq = tansition_freq_Hz
+        if "mixer" not in self.ds[var].dims:
+            # thresholded on the instrument, the |1> population is the mean of the state bits
+            self.md = None
+            bits = array(self.ds[var].transpose("pulse_num","index")) != 0
+            gate_num = array(self.ds.coords["pulse_num"])
+            self.params = gate_phase_fit_analysis(mean(bits[1:],axis=1),gate_num[1:])
+            self.fit_packs = {"gate_num":self.params.coords['freeDu'].values, "f":self.params.attrs['f']*1000, "tau":self.params.attrs['T2_fit']}
+            return
         datas = moveaxis(array(self.ds[var]),0,1)*1000 # shape (pulse_num, IQ, shots) 
         gate_num = array(self.ds.coords["pulse_num"])
         p0_data = datas[0]
@@ -917,11 +962,12 @@ class analysis_tools():
 
     def gateError_plot(self,save_pic_path:str=None):
         
-        self.md._import_data(self.train_set)
-        self.md._start_analysis()
-        g1d_fidelity = self.md.export_G1DROFidelity()
-        plot_readout_fidelity(self.train_set, self.md, g1d_fidelity, self.fq, save_pic_path if save_pic_path is not None else None, plot=True if save_pic_path is None else False)
-        plt.close()
+        if self.md is not None:
+            self.md._import_data(self.train_set)
+            self.md._start_analysis()
+            g1d_fidelity = self.md.export_G1DROFidelity()
+            plot_readout_fidelity(self.train_set, self.md, g1d_fidelity, self.fq, save_pic_path if save_pic_path is not None else None, plot=True if save_pic_path is None else False)
+            plt.close()
 
         data = self.params['data'].values
         gate_num = self.params.coords['freeDu'].values
@@ -957,12 +1003,14 @@ class Multiplex_analyzer(QCATAna,analysis_tools):
 
 
     def _import_data( self, data:Dataset|DataArray, var_dimension:int, refIQ:list=[], fit_func:callable=None, fq_Hz:float=None):
-        self.ds = data
+        """ `data` can be in the legacy or the compact layout (see `compact_dataset`), the analyses always see the legacy one. """
+        self.ds = expand_dataset(data) if isinstance(data, Dataset) else data
         self.dim = var_dimension
         self.refIQ = refIQ if len(refIQ) != 0 else [0,0]
         self.fit_func:callable = fit_func
         self.transition_freq = fq_Hz
 
+    @traced("fit")
     def _start_analysis(self,**kwargs):
         match self.exp_name:
             case 'm5':
@@ -976,7 +1024,7 @@ class Multiplex_analyzer(QCATAna,analysis_tools):
             case 'm11': 
                 self.rabi_ana(kwargs["var_name"])
             case 'm14': 
-                self.oneshot_ana(self.ds,self.transition_freq)
+                self.oneshot_ana(self.ds,self.transition_freq,kwargs.get("discriminator_key"))
             case 'm12':
                 self.T2_ana(kwargs["var_name"],self.refIQ)
             case 'm13':
@@ -1001,6 +1049,11 @@ class Multiplex_analyzer(QCATAna,analysis_tools):
                 raise KeyError(f"Unknown measurement = {self.exp_name} was given !")
 
     def _export_result( self, pic_save_folder=None):
+        """ Make the figures in the mode of `figure_renderer`: here, on the Agg pool, on demand or not at all. """
+        figure_renderer.export(self, pic_save_folder)
+
+    @traced("plot")
+    def _render_figures( self, pic_save_folder=None):
         match self.exp_name:
             case 'm5':
                 self.fluxCoupler_plot(pic_save_folder)
@@ -2,7 +2,8 @@ import os, sys
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', ".."))
 from qcat.analysis.state_discrimination.readout_fidelity import GMMROFidelity
 from qcat.visualization.readout_fidelity import plot_readout_fidelity
-from xarray import Dataset, open_dataset, DataArray
+from xarray import Dataset, DataArray
+from qblox_drive_AS.support.DataLayout import open_raw_dataset
 from qblox_drive_AS.analysis.Radiator.RadiatorSetAna import OSdata_arranger
 from qblox_drive_AS.support.UserFriend import *
 from qblox_drive_AS.support.QDmanager import QDmanager
@@ -10,6 +11,7 @@ from numpy import array, moveaxis, mean, std, median, arange,ndarray, pi, sin, c
 import matplotlib.pyplot as plt
 from qblox_drive_AS.analysis.Radiator.RadiatorSetAna import sort_files
 from qcat.analysis.state_discrimination import p01_to_Teff
+from qblox_drive_AS.analysis.DiscriminatorStore import discriminator_store, discriminator_key
 from qblox_drive_AS.support import rotate_onto_Inphase, rotate_data
 
 def a_OSdata_analPlot(nc_path:str, QD_agent:QDmanager=None, target_q:str=None, plot:bool=True, pic_path:str='', save_pic:bool=False): # 
@@ -20,7 +22,7 @@ def a_OSdata_analPlot(nc_path:str, QD_agent:QDmanager=None, target_q:str=None, p
         pic_save_path = os.path.join(folder,os.path.split(nc_path)[1].split(".")[0]) if pic_path == '' else pic_path
     else:
         pic_save_path = None
-    SS_ds = open_dataset(nc_path)
+    SS_ds = open_raw_dataset(nc_path)
     ss_dict = Dataset.to_dict(SS_ds)
     # print(ss_dict)
     pe_I, pe_Q = ss_dict['data_vars']['e']['data']
@@ -79,27 +81,15 @@ def share_model_OSana(QD_agent:QDmanager,target_q:str,folder_path:str,pic_save:b
     else:
         pic_folder = None
 
-    for idx, file in enumerate(files):
-        SS_ds = open_dataset(file)
-        ss_dict = Dataset.to_dict(SS_ds)
-        # print(ss_dict)
-        pe_I, pe_Q = ss_dict['data_vars']['e']['data']
-        pg_I, pg_Q = ss_dict['data_vars']['g']['data']
-        pgI_collection = [pg_I]
-        pgQ_collection = [pg_Q]
-        peI_collection = [pe_I]
-        peQ_collection = [pe_Q]
-
-        OS_data = 1000*array([[pgI_collection,peI_collection],[pgQ_collection,peQ_collection]]) # can train or predict 2*2*histo_counts*shot
-        tarin_data, fit_arrays = OSdata_arranger(OS_data)
-        # train GMM
-        if idx == 0:
-            gmm2d_fidelity = GMMROFidelity()
-            gmm2d_fidelity._import_data(tarin_data[0])
-            gmm2d_fidelity._start_analysis()
-
-        gmm2d_fidelity.discriminator._import_data( fit_arrays[0] )
-        gmm2d_fidelity.discriminator._start_analysis()
+    # the discriminator is trained once and re-used by the following files, see `DiscriminatorStore`
+    key = discriminator_key(QD_agent, target_q)
+    for file in files:
+        with open_raw_dataset(file) as SS_ds:
+            pe_I, pe_Q = array(SS_ds['e'])
+            pg_I, pg_Q = array(SS_ds['g'])
+        discrimination = discriminator_store.classify(key, 1000*array([pg_I, pg_Q]), 1000*array([pe_I, pe_Q]))
+        pop_rec.append(discrimination["Thermal"])
+        efft_rec.append(p01_to_Teff(discrimination["Thermal"], transi_freq)*1000)
 
 
     return pop_rec, efft_rec
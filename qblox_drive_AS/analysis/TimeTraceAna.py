@@ -1,13 +1,14 @@
 import os, sys, json 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', ".."))
-from xarray import open_dataset
+from qblox_drive_AS.support.DataLayout import open_raw_dataset
 from qblox_drive_AS.support.QDmanager import QDmanager
 import matplotlib.pyplot as plt
-from numpy import ndarray, array, median, std, mean
+from numpy import ndarray, array, median, std, mean, argsort, around
 from datetime import datetime 
 from qblox_drive_AS.support.UserFriend import *
 from matplotlib.gridspec import GridSpec as GS
-from qblox_drive_AS.analysis.Multiplexing_analysis import Multiplex_analyzer
+from qblox_drive_AS.analysis.AnalysisPool import AnalysisJob, run_analysis_jobs
+from qblox_drive_AS.analysis.DiscriminatorStore import discriminator_key
 
 def time_label_sort(nc_file_name:str):
     return datetime.strptime(nc_file_name.split("_")[-1].split(".")[0],"H%HM%MS%S")
@@ -127,147 +128,204 @@ def plot_timeDepCohe(time_values:ndarray, y_values:ndarray, exp:str, fig_path:st
         plt.savefig(fig_path)
     plt.close()
 
-def time_monitor_data_ana(QD_agent:QDmanager,folder_path:str,save_every_fit_pic:bool=False):
-    files = [name for name in os.listdir(folder_path) if (os.path.isfile(os.path.join(folder_path,name)) and name.split(".")[-1] == "nc")]
+def monitor_refs(QD_agent:QDmanager, exp:str, qubits:list)->dict:
+    """ What the fit results of `exp` in a time-monitor file depend on besides the file, per qubit, in the JSON form. """
+    match exp:
+        case "ss":
+            refs = {q: [discriminator_key(QD_agent, q), QD_agent.quantum_device.get_element(q).clock_freqs.f01()] for q in qubits}
+        case _:
+            refs = {q: [list(QD_agent.rotate_angle.get(q, [])), list(QD_agent.refIQ.get(q, []))] for q in qubits}
+    return json.loads(json.dumps(refs, default=float))
+
+
+class MonitorResultStore():
+    """
+    Per-folder cache of the time-monitor fitting results, an append-only `monitor_results.jsonl` in the folder.\n
+    One line per analyzed file: its name, mtime, exp, the `monitor_refs` it used and the fit results [var, end_time, value, detune].
+    A later line of the same file replaces the earlier one, the file is compacted when it has more replaced lines than live ones.
+    A file is analyzed again only if its mtime or its refs changed. No raw data is kept.
+    """
+    file_name:str = "monitor_results.jsonl"
+
+    def __init__(self, folder_path:str=None):
+        self.path:str = os.path.join(folder_path, self.file_name) if folder_path is not None else None
+        self.files:dict = {}      # nc name -> {"mtime":float, "exp":str, "refs":{var:ref}, "rows":[[var, end_time, value, detune]]}
+        self.__pending:list = []  # lines to append
+        self.__lines:int = 0      # lines in the file
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path) as rec:
+                for line in rec:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        warning_print(f"Broken line in {self.file_name} was ignored.")
+                        continue
+                    self.__lines += 1
+                    if entry.get("dropped"):
+                        self.files.pop(entry["file"], None)
+                    else:
+                        self.files[entry["file"]] = entry
+
+    def is_fresh(self, file:str, mtime:float, QD_agent:QDmanager)->bool:
+        if file not in self.files or self.files[file]["mtime"] != mtime:
+            return False
+        return self.files[file]["refs"] == monitor_refs(QD_agent, self.files[file]["exp"], list(self.files[file]["refs"].keys()))
+
+    def drop(self, file:str):
+        """ Forget `file`, like a deleted one. """
+        if self.files.pop(file, None) is not None:
+            self.__pending.append({"file":file, "dropped":True})
+
+    def add(self, file:str, mtime:float, exp:str, refs:dict, rows:list):
+        """ rows: [(var, end_time, value, detune), ...] """
+        entry = {"file":file, "mtime":mtime, "exp":exp, "refs":refs, "rows":[[var, end_time, float(value), float(detune)] for var, end_time, value, detune in rows]}
+        self.files[file] = entry
+        self.__pending.append(entry)
+
+    def save(self):
+        if self.path is None or len(self.__pending) == 0:
+            return
+        if self.__lines+len(self.__pending) > 2*len(self.files)+10:
+            with open(self.path+".tmp", 'w') as rec:
+                for entry in self.files.values():
+                    rec.write(json.dumps(entry)+"\n")
+            os.replace(self.path+".tmp", self.path)
+            self.__lines = len(self.files)
+        else:
+            with open(self.path, 'a') as rec:
+                for entry in self.__pending:
+                    rec.write(json.dumps(entry)+"\n")
+            self.__lines += len(self.__pending)
+        self.__pending = []
 
-    T1, T2, SS = 0, 0 , 0
-    T1_rec, detu_rec, T2_rec, SS_rec = {}, {}, {}, {}
-    T1_raw, T2_raw = {}, {}
-    T1_evo_time, T2_evo_time = {}, {}
-    for idx, file in enumerate(files) :
-        slightly_print(f"Analysis for the {idx}-th files ...")
-        exp_type:str = file.split("_")[0]
-        path = os.path.join(folder_path,file)
-        ds = open_dataset(path)
+    def series(self, exp:str)->dict:
+        """ {var: (minutes past the earliest point, values, detunes, files)} sorted by end_time """
+        columns = {}
+        for file, entry in self.files.items():
+            if entry["exp"] != exp:
+                continue
+            for var, end_time, value, detune in entry["rows"]:
+                columns.setdefault(var, []).append((datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S").timestamp(), value, detune, file))
+        sorted_series = {}
+        for var, points in columns.items():
+            stamps = array([point[0] for point in points])
+            order = argsort(stamps, kind="stable")
+            time_diffs = around((stamps[order]-stamps[order][0])/60, 1)
+            sorted_series[var] = (time_diffs, array([points[i][1] for i in order]), array([points[i][2] for i in order]), [points[i][3] for i in order])
+        return sorted_series
+
+
+def monitor_file_jobs(QD_agent:QDmanager, folder_path:str, file:str, save_every_fit_pic:bool=False)->tuple[list, list, str, dict]:
+    """ Build the analysis jobs of one `.nc` of the time monitor, return (jobs, the row heads of the jobs, the exp, the `monitor_refs` they used). """
+    exp_type:str = file.split("_")[0]
+    path = os.path.join(folder_path,file)
+    jobs, heads, refs = [], [], {}
+    with open_raw_dataset(path) as ds:
         match exp_type.lower():
             case "t1":
-                T1 += 1
                 for var in [ var for var in ds.data_vars if var.split("_")[-1] != 'x']:
                     T1_picsave_folder = os.path.join(folder_path,f"{var}_T1_pics")
-                    if T1 == 1:
-                        T1_rec[var], T1_raw[var] = {}, {}
-                        if save_every_fit_pic:
-                            if not os.path.exists(T1_picsave_folder):
-                                os.mkdir(T1_picsave_folder)
-                    T1_evo_time[var] = array(ds[f"{var}_x"])[0][0]
-                    ANA = Multiplex_analyzer("m13")
+                    if save_every_fit_pic and not os.path.exists(T1_picsave_folder):
+                        os.mkdir(T1_picsave_folder)
                     if QD_agent.rotate_angle[var][0] != 0:
                         ref = QD_agent.rotate_angle[var]
                     else:
                         eyeson_print(f"{var} rotation angle is 0, use contrast to analyze.")
                         ref = QD_agent.refIQ[var]
-                    ANA._import_data(ds,var_dimension=2,refIQ=ref)
-                    ANA._start_analysis(var_name=var)
-                    if save_every_fit_pic:
-                        ANA._export_result(T1_picsave_folder)
-                    T1_raw[var][ds.attrs["end_time"]] = ANA.plot_item["data"]
-                    T1_rec[var][ds.attrs["end_time"]] = ANA.fit_packs["median_T1"]
+                    jobs.append(AnalysisJob("m13", path, 2, {"var_name":var}, refIQ=ref, pic_save_folder=T1_picsave_folder if save_every_fit_pic else None, tag=(file, var)))
+                    heads.append(("t1", var, ds.attrs["end_time"], array(ds[f"{var}_x"])[0][0]))
+                    refs.update(monitor_refs(QD_agent, "t1", [var]))
             case "singleshot":
-                SS += 1
-                for var in ds.data_vars:
+                for var in [ var for var in ds.data_vars if var.split("_")[-1] != 'rawIQ']:
                     SS_picsave_folder = os.path.join(folder_path,f"{var}_SingleShot_pics")
-                    if SS == 1:
-                        SS_rec[var] = {}
-                        if save_every_fit_pic:
-                            if not os.path.exists(SS_picsave_folder):
-                                os.mkdir(SS_picsave_folder)
-                    ANA = Multiplex_analyzer("m14")
-                    ANA._import_data(ds[var]*1000,var_dimension=0,fq_Hz=QD_agent.quantum_device.get_element(var).clock_freqs.f01())
-                    ANA._start_analysis()
-                    if save_every_fit_pic:
-                        pic_path = os.path.join(SS_picsave_folder,f"{var}_SingleShot_{ds.attrs['end_time'].replace(' ', '_').replace(':','_').replace(' ','_')}")
-                        ANA._export_result(pic_path)
-                    SS_rec[var][ds.attrs["end_time"]] = ANA.fit_packs["effT_mK"]
+                    if save_every_fit_pic and not os.path.exists(SS_picsave_folder):
+                        os.mkdir(SS_picsave_folder)
+                    pic_path = os.path.join(SS_picsave_folder,f"{var}_SingleShot_{ds.attrs['end_time'].replace(' ', '_').replace(':','_').replace(' ','_')}")
+                    jobs.append(AnalysisJob("m14", path, 0, {"discriminator_key":discriminator_key(QD_agent, var)}, fq_Hz=QD_agent.quantum_device.get_element(var).clock_freqs.f01(), data_var=var, scale=1000, pic_save_folder=pic_path if save_every_fit_pic else None, tag=(file, var)))
+                    heads.append(("ss", var, ds.attrs["end_time"], None))
+                    refs.update(monitor_refs(QD_agent, "ss", [var]))
             case _:
-                T2 += 1
                 for var in [ var for var in ds.data_vars if var.split("_")[-1] != 'x']:
                     # create raw data fitting folder
                     T2_picsave_folder = os.path.join(folder_path,f"{var}_T2_pics")
-                    if T2 == 1:
-                        T2_rec[var], detu_rec[var], T2_raw[var] = {}, {}, {}
-                        if save_every_fit_pic:
-                            if not os.path.exists(T2_picsave_folder):
-                                os.mkdir(T2_picsave_folder)
-                    # start analysis 
-                    T2_evo_time[var] = array(ds[f"{var}_x"])[0][0]
-                    ANA = Multiplex_analyzer("m12")
+                    if save_every_fit_pic and not os.path.exists(T2_picsave_folder):
+                        os.mkdir(T2_picsave_folder)
                     if QD_agent.rotate_angle[var][0] != 0:
                         ref = QD_agent.rotate_angle[var]
                     else:
                         eyeson_print(f"{var} rotation angle is 0, use contrast to analyze.")
                         ref = QD_agent.refIQ[var]
-                    ANA._import_data(ds,var_dimension=2,refIQ= ref)
-                    ANA._start_analysis(var_name=var)
-                    if save_every_fit_pic:
-                        ANA._export_result(T2_picsave_folder)
-                    # keep values
-                    T2_raw[var][ds.attrs["end_time"]] = ANA.plot_item["data"]
-                    detu_rec[var][ds.attrs["end_time"]] = ANA.fit_packs["freq"]*1e-6
-                    T2_rec[var][ds.attrs["end_time"]] = ANA.fit_packs["median_T2"]
+                    jobs.append(AnalysisJob("m12", path, 2, {"var_name":var}, refIQ=ref, pic_save_folder=T2_picsave_folder if save_every_fit_pic else None, tag=(file, var)))
+                    heads.append(("t2", var, ds.attrs["end_time"], array(ds[f"{var}_x"])[0][0]))
+                    refs.update(monitor_refs(QD_agent, "t2", [var]))
+    exp = {"t1":"t1", "singleshot":"ss"}.get(exp_type.lower(), "t2")
+    return jobs, heads, exp, refs
+
+
+def monitor_row(head:tuple, result:dict)->tuple:
+    """ Turn a job result into a `MonitorResultStore` row (var, end_time, value, detune). """
+    exp, var, end_time, _ = head
+    match exp:
+        case "t1":
+            return (var, end_time, result["fit_packs"]["median_T1"], 0)
+        case "ss":
+            return (var, end_time, result["fit_packs"]["effT_mK"], 0)
+        case _:
+            return (var, end_time, result["fit_packs"]["median_T2"], result["fit_packs"]["freq"]*1e-6)
+
+
+def time_monitor_data_ana(QD_agent:QDmanager,folder_path:str,save_every_fit_pic:bool=False,use_cache:bool=True,workers:int=None):
+    """
+    Analyze the `.nc` files made by `QubitMonitor` in `folder_path` and plot their time dependence.\n
+    With `use_cache`, only the new or changed files are analyzed, see `MonitorResultStore`. `save_every_fit_pic` analyzes all the files again to draw their fits,
+    the T1/T2 colormaps need the data of every file so they're drawn only then.\n
+    The files and qubits are analyzed on `workers` processes, see `run_analysis_jobs`.
+    """
+    files = [name for name in os.listdir(folder_path) if (os.path.isfile(os.path.join(folder_path,name)) and name.split(".")[-1] == "nc")]
+    store = MonitorResultStore(folder_path if use_cache else None)
+    for file in list(store.files.keys()):
+        if file not in files:
+            store.drop(file)
+
+    new_files = [file for file in files if save_every_fit_pic or not store.is_fresh(file, os.path.getmtime(os.path.join(folder_path,file)), QD_agent)]
+    slightly_print(f"{len(files)-len(new_files)} files are cached, {len(new_files)} files to analyze.")
+    jobs, heads, file_exps, file_refs = [], [], {}, {}
+    for file in new_files:
+        file_jobs, file_heads, file_exps[file], file_refs[file] = monitor_file_jobs(QD_agent, folder_path, file, save_every_fit_pic)
+        jobs += file_jobs
+        heads += file_heads
+    results = run_analysis_jobs(jobs, workers)
+
+    file_rows = {file: [] for file in new_files}
+    curves = {}   # (exp, var) -> {file: (evo_time, data)}, only for the colormaps
+    for head, result in zip(heads, results):
+        if "error" not in result:
+            file_rows[result["tag"][0]].append(monitor_row(head, result))
+            if head[0] in ["t1", "t2"]:
+                curves.setdefault((head[0], head[1]), {})[result["tag"][0]] = (head[3], result["plot_item"]["data"])
+    for file in new_files:
+        if len(file_rows[file]) == len([job for job in jobs if job.tag[0] == file]):
+            store.add(file, os.path.getmtime(os.path.join(folder_path,file)), file_exps[file], file_refs[file], file_rows[file])
+        else:
+            # a failed file is tried again next time
+            store.add(file, -1, file_exps[file], file_refs[file], file_rows[file])
+    store.save()
     
     pic_folder = os.path.join(folder_path, "Pics")
     if not os.path.exists(pic_folder):
         os.mkdir(pic_folder)
 
     slightly_print(f"\nPlotting... ")
-    if T1 != 0:
-        for q in T1_rec:
-            
-            sorted_item_ans = sorted(T1_rec[q].items(), key=lambda item: datetime.strptime(item[0], "%Y-%m-%d %H:%M:%S"))
-            sorted_item_raw = sorted(T1_raw[q].items(), key=lambda item: datetime.strptime(item[0], "%Y-%m-%d %H:%M:%S"))
-            earliest_time = datetime.strptime(sorted_item_ans[0][0], "%Y-%m-%d %H:%M:%S")
-            time_diffs = []
-            sorted_values_ans, sorted_values_raw = [], []
-            for idx, item in enumerate(sorted_item_ans):
-                key = item[0]
-                value = item[1]
-                current_time = datetime.strptime(key, "%Y-%m-%d %H:%M:%S")
-                time_diff = round((current_time - earliest_time).total_seconds()/60,1)
-                time_diffs.append(time_diff)
-                sorted_values_ans.append(value)
-                sorted_values_raw.append(sorted_item_raw[idx][1])
-
-            
-            colormap(array(time_diffs),array(T1_evo_time[q])*1e6,array(sorted_values_raw),array(sorted_values_ans),fig_path=os.path.join(pic_folder,f"{q}_T1_timeDep_colormap.png"))
-            plot_timeDepCohe(array(time_diffs), array(sorted_values_ans), "t1", units={"x":"min","y":"µs"}, fig_path=os.path.join(pic_folder,f"{q}_T1_timeDep.png"))
-    if T2 != 0:
-        for q in T2_rec:
-            sorted_item_ans = sorted(T2_rec[q].items(), key=lambda item: datetime.strptime(item[0], "%Y-%m-%d %H:%M:%S"))
-            sorted_item_detu = sorted(detu_rec[q].items(), key=lambda item: datetime.strptime(item[0], "%Y-%m-%d %H:%M:%S"))
-            sorted_item_raw = sorted(T2_raw[q].items(), key=lambda item: datetime.strptime(item[0], "%Y-%m-%d %H:%M:%S"))
-            earliest_time = datetime.strptime(sorted_item_ans[0][0], "%Y-%m-%d %H:%M:%S")
-            
-            time_diffs = []
-            sorted_values_ans, sorted_values_detu, sorted_values_raw = [], [], []
-            for idx, item in enumerate(sorted_item_ans):
-                key = item[0]
-                value = item[1]
-                current_time = datetime.strptime(key, "%Y-%m-%d %H:%M:%S")
-                time_diff = round((current_time - earliest_time).total_seconds()/60,1)
-                time_diffs.append(time_diff)
-                sorted_values_ans.append(value)
-                sorted_values_detu.append(sorted_item_detu[idx][1])
-                sorted_values_raw.append(sorted_item_raw[idx][1])
-
-            
-            colormap(array(time_diffs),array(T2_evo_time[q])*1e6,array(sorted_values_raw),array(sorted_values_ans),fig_path=os.path.join(pic_folder,f"{q}_T2_timeDep_colormap.png"))
-            plot_timeDepCohe(array(time_diffs), array(sorted_values_ans), "t2", units={"x":"min","y":"µs"}, fig_path=os.path.join(pic_folder,f"{q}_T2_timeDep.png"))
-            plot_timeDepCohe(array(time_diffs), array(sorted_values_detu)-array(sorted_values_detu)[0], "δf", units={"x":"min","y":"MHz"}, fig_path=os.path.join(pic_folder,f"{q}_Detune_timeDep.png"))
-    if SS != 0:
-        for q in SS_rec:
-            sorted_item_ans = sorted(SS_rec[q].items(), key=lambda item: datetime.strptime(item[0], "%Y-%m-%d %H:%M:%S"))
-            earliest_time = datetime.strptime(sorted_item_ans[0][0], "%Y-%m-%d %H:%M:%S")
-            
-            time_diffs = []
-            sorted_values_ans = []
-            for key, value in sorted_item_ans:
-                current_time = datetime.strptime(key, "%Y-%m-%d %H:%M:%S")
-                time_diff = round((current_time - earliest_time).total_seconds()/60,1)
-                time_diffs.append(time_diff)
-                sorted_values_ans.append(value)
-
-
-            plot_timeDepCohe(array(time_diffs), array(sorted_values_ans), "eff_Temp.", units={"x":"min","y":"mK"}, fig_path=os.path.join(pic_folder,f"{q}_effT_timeDep.png"))
+    for exp in ["t1", "t2"]:
+        for q, (time_diffs, values, detunes, point_files) in store.series(exp).items():
+            q_curves = curves.get((exp, q), {})
+            if save_every_fit_pic and all(file in q_curves for file in point_files):
+                colormap(time_diffs,array(q_curves[point_files[0]][0])*1e6,array([q_curves[file][1] for file in point_files]),values,fig_path=os.path.join(pic_folder,f"{q}_{exp.upper()}_timeDep_colormap.png"))
+            plot_timeDepCohe(time_diffs, values, exp, units={"x":"min","y":"µs"}, fig_path=os.path.join(pic_folder,f"{q}_{exp.upper()}_timeDep.png"))
+            if exp == "t2":
+                plot_timeDepCohe(time_diffs, detunes-detunes[0], "δf", units={"x":"min","y":"MHz"}, fig_path=os.path.join(pic_folder,f"{q}_Detune_timeDep.png"))
+    for q, (time_diffs, values, _, _) in store.series("ss").items():
+        plot_timeDepCohe(time_diffs, values, "eff_Temp.", units={"x":"min","y":"mK"}, fig_path=os.path.join(pic_folder,f"{q}_effT_timeDep.png"))
     
     eyeson_print(f"\nProcedures done ! ")
 
@@ -1,7 +1,11 @@
-import os, sys 
+import os, sys, json
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', ".."))
 from xarray import open_dataset, Dataset
 from numpy import array
+from qblox_drive_AS.support.AppendStore import AppendStore
+
+
+folded_record_name:str = "ZgateT1_folded.json"
 
 class MultiplexingDataReducer():
     def __init__(self, nc:str|Dataset):
@@ -20,43 +24,63 @@ class MultiplexingDataReducer():
 
 
 
-def ZgateT1_dataReducer(raw_data_folder:str)->dict:
-    
-    datasets = []
-    # Iterate directory
-    for path in os.listdir(raw_data_folder):
-        # check if current path is a file
-        if os.path.isfile(os.path.join(raw_data_folder, path)):
-            file_path = os.path.join(raw_data_folder,path)
-            if file_path.split(".")[-1] == 'nc':
-                datasets.append(open_dataset(file_path))
-                print(datasets[-1].attrs)
-    # make VIP folder for each qubit
-    vip_folders:dict = {}
-    for q in [var for var in datasets[0].data_vars if var.split("_")[-1] != "time"]:
-        vip_folders[q] = os.path.join(raw_data_folder, f"{q}_ZgateT1")
-        if not os.path.exists(vip_folders[q]): os.mkdir(vip_folders[q])
-
-    # make a new dataset with a new dimension with the attrs["end_time"] of each dataset.
+def ZgateT1_store_path(raw_data_folder:str, q:str)->str:
+    """ The summarized zgate-T1 file of `q` in `raw_data_folder`, every run appends one `end_time` slice to it. """
+    return os.path.join(raw_data_folder, f"{q}_ZgateT1", f"{q}_Summaized_zT1.nc")
+
+
+def ZgateT1_slices(dataset:Dataset)->dict:
+    """ Split one zgate-T1 run into a dataset per qubit with dims (end_time, mixer, z_voltage, time), `end_time` has only this run. """
+    slices = {}
+    for var in [var for var in dataset.data_vars if var.split("_")[-1] != "time"]:
+        dict_ = {var:(["end_time","mixer","z_voltage","time"],array(dataset[var])[None]),f"{var}_time":(["end_time","mixer","z_voltage","time"],array(dataset[f"{var}_time"])[None])}
+        zT1_ds = Dataset(dict_,coords={"end_time":array([dataset.attrs["end_time"]]),"mixer":array(["I","Q"]),"z_voltage":array(dataset.coords["z_voltage"]),"time":array(dataset.coords["time"])})
+        zT1_ds.attrs["z_offset"] = [float(dataset.attrs[f"{var}_ref_bias"])]
+        zT1_ds.attrs["prepare_excited"] = dataset.attrs["prepare_excited"]
+        slices[var] = zT1_ds
+    return slices
+
+
+def ZgateT1_stores(raw_data_folder:str)->dict:
+    """ The summarized zgate-T1 files already in `raw_data_folder`, {q_name: nc_path}. """
     summarized_nc_paths = {}
-    for var in vip_folders:
-        end_times = []
-        data = []
-        for dataset in datasets:
-            end_times.append(dataset.attrs["end_time"])
-            data.append(array(dataset[var]).tolist()) # shape in (mixer, bias, evo-time)
-            time_data = [list(dataset[f"{var}_time"])]*len(datasets)
-            
-
-        dict_ = {var:(["end_time","mixer","z_voltage","time"],array(data)),f"{var}_time":(["end_time","mixer","z_voltage","time"],array(time_data))}
-        zT1_ds = Dataset(dict_,coords={"end_time":array(end_times),"mixer":array(["I","Q"]),"z_voltage":array(dataset.coords["z_voltage"]),"time":array(dataset.coords["time"])})
-        zT1_ds.attrs["z_offset"] = [float(datasets[0].attrs[f"{var}_ref_bias"])]
-        zT1_ds.attrs["prepare_excited"] = datasets[0].attrs["prepare_excited"]
-        summarized_nc_paths[var] = os.path.join(vip_folders[var],f"{var}_Summaized_zT1.nc")
-        zT1_ds.to_netcdf(summarized_nc_paths[var])
+    for path in os.listdir(raw_data_folder):
+        if os.path.isdir(os.path.join(raw_data_folder, path)) and path.endswith("_ZgateT1"):
+            q = path[:-len("_ZgateT1")]
+            if os.path.isfile(ZgateT1_store_path(raw_data_folder, q)):
+                summarized_nc_paths[q] = ZgateT1_store_path(raw_data_folder, q)
+    return summarized_nc_paths
+
+
+def ZgateT1_dataReducer(raw_data_folder:str)->dict:
+    """
+    Fold the zgate-T1 files (one per run, measured before `ZgateT1_stores`) in `raw_data_folder` into the summarized files.\n
+    The folded file names are remembered in `ZgateT1_folded.json`, only the new files are opened (one by one) and appended as new `end_time` slices.
+    A summarized file made by the former non-incremental reducer is rebuilt once.
+    """
+    record_path = os.path.join(raw_data_folder, folded_record_name)
+    folded:list = []
+    if os.path.exists(record_path):
+        with open(record_path) as rec:
+            folded = json.load(rec)
+    else:
+        for q, nc_path in ZgateT1_stores(raw_data_folder).items():
+            if not AppendStore(nc_path, "end_time").growable:
+                os.remove(nc_path)
+
+    new_files = [path for path in sorted(os.listdir(raw_data_folder)) if path.split(".")[-1] == 'nc' and path not in folded and os.path.isfile(os.path.join(raw_data_folder, path))]
+    for path in new_files:
+        with open_dataset(os.path.join(raw_data_folder, path)) as ds:
+            for q, zT1_slice in ZgateT1_slices(ds).items():
+                store_path = ZgateT1_store_path(raw_data_folder, q)
+                os.makedirs(os.path.split(store_path)[0], exist_ok=True)
+                AppendStore(store_path, "end_time").append(zT1_slice)
+        folded.append(path)
+        with open(record_path, 'w') as rec:
+            json.dump(folded, rec)
     
     # return dict contains nc_path with the q_name as its key 
-    return summarized_nc_paths
+    return ZgateT1_stores(raw_data_folder)
 
 
 
@@ -2,13 +2,20 @@ import os, sys, time
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from xarray import Dataset
 from qblox_drive_AS.support.UserFriend import *
-from numpy import array, moveaxis, arange
+from numpy import array, moveaxis, arange, uint8, ndarray, concatenate
 from quantify_scheduler.gettables import ScheduleGettable
 from qblox_drive_AS.support import QDmanager, Data_manager, compose_para_for_multiplexing
 from qblox_drive_AS.support.Pulse_schedule_library import Gate_Test_SS_sche, pulse_preview
 from qblox_drive_AS.support.WaveformCtrl import GateGenesis
+from qblox_drive_AS.analysis.DiscriminatorStore import discriminator_store, discriminator_key, acq_threshold_for
 
-def XGateError_single_shot(QD_agent:QDmanager,ro_elements:list, max_gate_num:int,shots:int=1000, untrained:bool=False,run:bool=True):
+def XGateError_single_shot(QD_agent:QDmanager,ro_elements:list, max_gate_num:int,shots:int=1000, untrained:bool=False,run:bool=True,thresholded:bool=False,raw_subsample:int=0,single_schedule:bool=True):
+    """
+    ### Args:\n
+    * thresholded: discriminate the shots on the instrument with `acq_threshold_for`, the dataset keeps the state bits (uint8) instead of I/Q.\n
+    * raw_subsample: with `thresholded`, also take this many raw-IQ shots with 0 and 1 pi-pulse, kept as `{q}_rawIQ` and used to refresh the stored discriminators.\n
+    * single_schedule: all the pulse numbers are in one schedule (one block per number in a shot, told apart by acq_index). False runs one schedule per pulse number.
+    """
     sche_func = Gate_Test_SS_sche 
     sample_pts = 25 # fix
 
@@ -32,7 +39,7 @@ def XGateError_single_shot(QD_agent:QDmanager,ro_elements:list, max_gate_num:int
         eyeson_print(f"{q} Integration time: {round(qubit_info.measure.integration_time()*1e6,1)} µs")
 
     
-    folder = []
+    acq_thresholds = {q: acq_threshold_for(QD_agent,q) for q in ro_elements} if thresholded else {}
     if untrained:
         slightly_print("Use default pi-pulse !")
         wf_packs = GateGenesis(q_num=len(list(QD_agent.quantum_device.elements())),c_num=0)
@@ -40,10 +47,11 @@ def XGateError_single_shot(QD_agent:QDmanager,ro_elements:list, max_gate_num:int
         wf_packs = QD_agent.Waveformer
 
 
-    def repeat_dep_sched(seq_num:int):
-        slightly_print(f"Shotting for {seq_num} pi-pulses")
+    def repeat_dep_sched(seq_nums:list, thresholds:dict, shot_num:int)->ndarray:
+        """ One schedule for all the pulse numbers in `seq_nums`, returns (ro_q, IQ, pulse_num, shots), or (ro_q, pulse_num, shots) with `thresholds`. """
+        slightly_print(f"Shotting for {list(seq_nums)} pi-pulses")
         sched_kwargs = dict(   
-            pulse_num=seq_num,
+            pulse_num=[int(seq_num) for seq_num in seq_nums],
             waveformer = wf_packs,
             pi_amp=compose_para_for_multiplexing(QD_agent,ro_elements,'d1'),
             pi_dura=compose_para_for_multiplexing(QD_agent,ro_elements,'d3'),
@@ -51,6 +59,7 @@ def XGateError_single_shot(QD_agent:QDmanager,ro_elements:list, max_gate_num:int
             R_duration=compose_para_for_multiplexing(QD_agent,ro_elements,'r3'),
             R_integration=compose_para_for_multiplexing(QD_agent,ro_elements,'r4'),
             R_inte_delay=compose_para_for_multiplexing(QD_agent,ro_elements,'r2'),
+            acq_thresholds=thresholds,
         )
         
         if run:
@@ -62,23 +71,43 @@ def XGateError_single_shot(QD_agent:QDmanager,ro_elements:list, max_gate_num:int
                 batched=True,
                 num_channels=len(ro_elements),
             )
-            QD_agent.quantum_device.cfg_sched_repetitions(shots)
-            ss_da= gettable.get() # DataArray (2*ro_q, shots)
-            reshaped_data = list(array(ss_da).reshape(len(ro_elements),2,shots)) # (ro_q, IQ, shots)
-            folder.append(reshaped_data) # (state, ro_q, IQ, shots)
+            QD_agent.quantum_device.cfg_sched_repetitions(shot_num)
+            ss_da= gettable.get() # DataArray (2*ro_q, shots*len(seq_nums)), the acq_index of a shot are adjacent
+            if thresholds:
+                # state bits, only the real part means something
+                return moveaxis(array(ss_da).reshape(len(ro_elements),-1,shot_num,len(seq_nums))[:,0].round().astype(uint8),-1,1) # (ro_q, shots, pulse_num) -> (ro_q, pulse_num, shots)
+            else:
+                return moveaxis(array(ss_da).reshape(len(ro_elements),2,shot_num,len(seq_nums)),-1,2) # (ro_q, IQ, shots, pulse_num) -> (ro_q, IQ, pulse_num, shots)
 
         else:
             pulse_preview(QD_agent.quantum_device,sche_func,sched_kwargs)
+            return None
 
-    for i in pulse_repeats:        
-        repeat_dep_sched(i)
+    if single_schedule:
+        folder = repeat_dep_sched(pulse_repeats, acq_thresholds, shots)
+    else:
+        folder = [repeat_dep_sched([i], acq_thresholds, shots) for i in pulse_repeats]
+        folder = None if folder[0] is None else concatenate(folder, axis=-2)
+    raw_folder = repeat_dep_sched([0, 1], {}, raw_subsample) if (thresholded and raw_subsample > 0) else None
+    if folder is None:
+        return None
     
-    folder = moveaxis(array(folder),0,2) # (state,ro_q,IQ,shots) -> (ro_q, IQ, state, shots)
     output_dict = {}
-    for q_idx, q_name in enumerate(ro_elements):
-        output_dict[q_name] = (["mixer","pulse_num","index"],folder[q_idx])
+    if not thresholded:
+        for q_idx, q_name in enumerate(ro_elements):
+            output_dict[q_name] = (["mixer","pulse_num","index"],folder[q_idx])
+    else:
+        for q_idx, q_name in enumerate(ro_elements):
+            output_dict[q_name] = (["pulse_num","index"],folder[q_idx],{"acq_rotation":acq_thresholds[q_name][0],"acq_threshold":acq_thresholds[q_name][1]})
+        if raw_folder is not None:
+            for q_idx, q_name in enumerate(ro_elements):
+                output_dict[f"{q_name}_rawIQ"] = (["mixer","prepared_state","raw_index"],raw_folder[q_idx])
+                discriminator_store.classify(discriminator_key(QD_agent,q_name),raw_folder[q_idx][:,0]*1000,raw_folder[q_idx][:,1]*1000)
 
-    SS_ds = Dataset(output_dict, coords= {"mixer":array(["I","Q"]), "pulse_num":pulse_repeats,"index":arange(shots)})
+    coords = {"mixer":array(["I","Q"]), "pulse_num":pulse_repeats,"index":arange(shots)}
+    if raw_folder is not None:
+        coords["prepared_state"], coords["raw_index"] = array([0,1]), arange(raw_subsample)
+    SS_ds = Dataset(output_dict, coords=coords)
     SS_ds.attrs["end_time"] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
     SS_ds.attrs["execution_time"] = Data_manager().get_time_now()
     
@@ -0,0 +1,105 @@
+""" NetCDF4/HDF5 files growing along an unlimited dimension, the while-loop experiments append one slice per loop instead of writing a file per loop. """
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import h5netcdf
+from numpy import arange, array_equal, allclose
+from xarray import Dataset, open_dataset
+from qblox_drive_AS.support.PhaseTracer import traced
+
+
+class AppendStore():
+    """
+    One `.nc` file whose dimension `append_dim` is unlimited, chunked by one slice along it so an append only writes the new chunks.\n
+    #### Args:\n
+    * file_path: the file, made by the first `append`.\n
+    * append_dim: the dimension the slices are stacked along, like 'repeat' or 'end_time'.\n
+    * running_index: the coordinate of `append_dim` is a counter (like `repeat`), renumber the appended slices after the stored ones.
+    """
+    def __init__(self, file_path:str, append_dim:str, running_index:bool=False):
+        self.file_path:str = file_path
+        self.append_dim:str = append_dim
+        self.running_index:bool = running_index
+
+    @property
+    def size(self)->int:
+        """ The stored length along `append_dim`, 0 if there's no file yet. """
+        if not os.path.exists(self.file_path):
+            return 0
+        with h5netcdf.File(self.file_path, 'r') as nc:
+            return nc.dimensions[self.append_dim].size
+
+    @property
+    def growable(self)->bool:
+        """ The file is there and `append_dim` is unlimited, False for a file written by a plain `to_netcdf`. """
+        if not os.path.exists(self.file_path):
+            return False
+        with h5netcdf.File(self.file_path, 'r') as nc:
+            return self.append_dim in nc.dimensions and nc.dimensions[self.append_dim].isunlimited()
+
+    @traced("append_store")
+    def append(self, dataset:Dataset)->int:
+        """
+        Append `dataset` along `append_dim`, returns the new length.\n
+        The variables, the other dimensions and their coordinates must be the same as the stored ones, or a `ValueError` is raised before anything is written.
+        The stored attrs are kept, only the new attrs of `dataset` are added, so the file keeps the values of its first run (like a z_offset).
+        """
+        if self.append_dim not in dataset.dims:
+            raise KeyError(f"The dataset to append has no dimension '{self.append_dim}', it has {list(dataset.dims)}")
+        if not os.path.exists(self.file_path):
+            return self.__create(dataset)
+
+        with h5netcdf.File(self.file_path, 'a') as nc:
+            start = nc.dimensions[self.append_dim].size
+            stop = start+dataset.sizes[self.append_dim]
+            stacked_vars = [name for name in dataset.variables if self.append_dim in dataset[name].dims]
+            for name in stacked_vars:
+                if name not in nc.variables:
+                    raise KeyError(f"'{name}' isn't in the store {self.file_path}, can't append it !")
+            for dim, length in dataset.sizes.items():
+                if dim != self.append_dim and (dim not in nc.dimensions or nc.dimensions[dim].size != length):
+                    raise ValueError(f"Dimension '{dim}' of the dataset doesn't match the store {self.file_path}, can't append it !")
+            for name in dataset.coords:
+                if self.append_dim in dataset[name].dims:
+                    continue
+                if name not in nc.variables or not self.__same(nc.variables[name][...], dataset[name].values):
+                    raise ValueError(f"Coordinate '{name}' of the dataset doesn't match the store {self.file_path}, can't append it !")
+            nc.resize_dimension(self.append_dim, stop)
+            for name in stacked_vars:
+                variable = nc.variables[name]
+                if name == self.append_dim and self.running_index:
+                    values = arange(start, stop)
+                else:
+                    values = dataset[name].transpose(*variable.dimensions).values
+                if values.dtype.kind == 'U':
+                    values = values.astype(object)  # h5py writes variable-length strings from objects only
+                index = tuple(slice(start, stop) if dim == self.append_dim else slice(None) for dim in variable.dimensions)
+                variable[index] = values
+            for key, value in dataset.attrs.items():
+                if key not in nc.attrs:
+                    nc.attrs[key] = value
+        return stop
+
+    @staticmethod
+    def __same(stored, given)->bool:
+        if stored.shape != given.shape:
+            return False
+        if given.dtype.kind in "fc":
+            return allclose(stored, given, equal_nan=True)
+        if given.dtype.kind == 'U':
+            given = given.astype(object)
+        return array_equal(stored, given)
+
+    def __create(self, dataset:Dataset)->int:
+        dataset = dataset.copy()
+        if self.running_index and self.append_dim in dataset.coords:
+            dataset = dataset.assign_coords({self.append_dim:arange(dataset.sizes[self.append_dim])})
+        for name, variable in dataset.variables.items():
+            dims = variable.dims
+            if self.append_dim in dims:
+                variable.encoding["chunksizes"] = tuple(1 if dim == self.append_dim else dataset.sizes[dim] for dim in dims)
+        dataset.to_netcdf(self.file_path, engine="h5netcdf", unlimited_dims=[self.append_dim])
+        return dataset.sizes[self.append_dim]
+
+    def open(self, **kwargs)->Dataset:
+        """ Open the store lazily, the data are read from the file only when they're used. Close it before the next `append`. """
+        return open_dataset(self.file_path, engine="h5netcdf", **kwargs)
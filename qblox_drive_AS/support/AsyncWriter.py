@@ -0,0 +1,109 @@
+""" Save the raw datasets on a background thread, so the encoding and the disk I/O overlap with the next acquisition. """
+import os, sys, queue, atexit, threading
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from contextlib import contextmanager
+from xarray import Dataset
+from qblox_drive_AS.support.UserFriend import *
+
+
+class BackgroundWriter():
+    """
+    One writer thread saves the submitted tasks in order, at most `max_pending` tasks wait in the queue, `submit` blocks when it's full.\n
+    A failed save is warned at once and raised (RuntimeError) by the next `submit`, `flush` or `ready` in the submitting thread.
+    The pending saves are flushed when python exits.\n
+    #### Args:\n
+    * max_pending: int, how many datasets can wait in the memory for saving.
+    """
+    def __init__(self, max_pending:int=4):
+        self.max_pending:int = max_pending
+        self.enabled:bool = True   # False saves in the calling thread
+        self.__queue:queue.Queue = None
+        self.__thread:threading.Thread = None
+        self.__errors:list = []
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        atexit.register(self.__flush_at_exit)
+
+    @property
+    def pending(self)->int:
+        return 0 if self.__queue is None else self.__queue.unfinished_tasks
+
+    def __in_writer(self)->bool:
+        return getattr(self.__local, "in_writer", False)
+
+    def __start(self):
+        with self.__lock:
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__queue = queue.Queue(maxsize=self.max_pending)
+                self.__thread = threading.Thread(target=self.__work, name="raw_data_writer", daemon=True)
+                self.__thread.start()
+
+    def __work(self):
+        self.__local.in_writer = True
+        while True:
+            func, args, kwargs, description = self.__queue.get()
+            try:
+                func(*args, **kwargs)
+            except BaseException as err:
+                with self.__lock:
+                    self.__errors.append((description, err))
+                warning_print(f"Background save of {description} failed: {err!r}")
+            finally:
+                self.__queue.task_done()
+
+    def submit(self, func:callable, *args, description:str="", **kwargs):
+        """ Run `func(*args, **kwargs)` on the writer thread after the tasks submitted before. """
+        if not self.enabled or self.__in_writer():
+            func(*args, **kwargs)
+            return
+        self.raise_errors()
+        self.__start()
+        self.__queue.put((func, args, kwargs, description))
+
+    def save_netcdf(self, dataset:Dataset, path:str, compact:bool=False):
+        """ `dataset.to_netcdf(path)` on the writer thread, in the layout of `compact_dataset` if `compact`. Don't change `dataset` after it's submitted. """
+        if compact:
+            from qblox_drive_AS.support.DataLayout import compact_dataset
+            self.submit(lambda: compact_dataset(dataset).to_netcdf(path), description=path)
+        else:
+            self.submit(dataset.to_netcdf, path, description=path)
+
+    def flush(self):
+        """ Wait until all the submitted tasks are done, raise if any of them failed. Nothing to wait on the writer thread, the tasks before are done. """
+        if self.__in_writer():
+            return
+        if self.__queue is not None:
+            self.__queue.join()
+        self.raise_errors()
+
+    def ready(self, path:str)->str:
+        """ `path` after the pending saves are done, for the `RawDataPath` of the experiments. Returns at once in `no_wait`. """
+        if not getattr(self.__local, "no_wait", False):
+            self.flush()
+        return path
+
+    @contextmanager
+    def no_wait(self):
+        """ `ready` doesn't wait in this block, for the ones who only need the path string. """
+        self.__local.no_wait = True
+        try:
+            yield
+        finally:
+            self.__local.no_wait = False
+
+    def raise_errors(self):
+        with self.__lock:
+            errors, self.__errors = self.__errors, []
+        if errors:
+            raise RuntimeError(f"Background save failed for {', '.join(description for description, _ in errors)}") from errors[0][1]
+
+    def __flush_at_exit(self):
+        if self.pending != 0:
+            slightly_print(f"Waiting for {self.pending} raw data saves ...")
+        try:
+            self.flush()
+        except RuntimeError as err:
+            warning_print(str(err))
+
+
+raw_writer = BackgroundWriter()
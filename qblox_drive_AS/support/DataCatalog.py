@@ -0,0 +1,227 @@
+""" SQLite catalog of the saved raw data, the analysis tools query it for files instead of walking the folders and parsing the file names. """
+import os, re, sys, json, time, sqlite3
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from datetime import datetime
+from numpy import generic
+from xarray import Dataset, open_dataset
+from qblox_drive_AS.support.UserFriend import *
+from qblox_drive_AS.support.Path_Book import meas_raw_dir
+
+
+catalog_file_name:str = "data_catalog.sqlite"
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    path TEXT PRIMARY KEY, exp_type TEXT, JOBID TEXT, end_time TEXT, dr TEXT, qd_hash TEXT, attrs TEXT, recorded_at REAL
+);
+CREATE TABLE IF NOT EXISTS run_qubits (path TEXT, qubit TEXT, PRIMARY KEY (path, qubit));
+CREATE INDEX IF NOT EXISTS runs_exp_time ON runs (exp_type, end_time);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (end_time);
+CREATE INDEX IF NOT EXISTS run_qubits_qubit ON run_qubits (qubit);
+"""
+
+
+# `Data_manager.save_raw_data` names: {dr}{qubits}_{exp}({label})_H%HM%MS%S.nc, the exp part -> the exp_type given to it
+data_manager_name = re.compile(r"^.+?(?:q|c)\d+_?(?P<exp>[A-Za-z0-9]+?)(?:\(.*\))?_?H\d{2}M\d{2}S\d{2}\.nc$")
+data_manager_exp_types:dict = {
+    "CavitySpectro":"CS", "PowerCavity":"PD", "FluxCavity":"FD", "SingleShot":"ss", "2tone":"2tone", "Flux2tone":"F2tone",
+    "powerRabi":"powerRabi", "timeRabi":"timeRabi", "Rabi":"Rabi", "ramsey":"ramsey", "T1":"T1", "T2":"T2", "RofCali":"RofCali",
+    "zT1":"zT1", "XYLCali":"XYLCali", "HalfPiCali":"xyl05cali", "RabiChevron":"Chevron", "RamseyFringe":"fringe", "iSwap":"iswap",
+}
+# `ExpGovernment` names: {prefix}_{%Y%m%d%H%M%S or JOBID}.nc, the prefix -> the class name
+exp_frames_name = re.compile(r"^(?P<exp>[A-Za-z0-9]+)_[^_]+\.nc$")
+exp_frames_exp_types:dict = {
+    "BroadBandCS":"BroadBand_CavitySearching", "zoomCS":"Zoom_CavitySearching", "PowerCavity":"PowerCavity", "dressedCS":"Dressed_CavitySearching",
+    "FluxCoupler":"FluxCoupler", "FluxCavity":"FluxCavity", "IQref":"IQ_references", "PowerCnti2tone":"PowerConti2tone", "FluxQubit":"FluxQubit",
+    "PowerRabi":"PowerRabiOsci", "TimeRabi":"TimeRabiOsci", "SingleShot":"SingleShot", "Ramsey":"Ramsey", "SpinEcho":"SpinEcho", "CPMG":"CPMG",
+    "T1":"EnergyRelaxation", "XYFcali":"XYFcali", "ROFcali":"ROFcali", "PIampcali":"PiAcali", "halfPIampcali":"hPiAcali", "ROLcali":"ROLcali",
+    "DragCali":"DragCali", "XGateErrorTest":"XGateErrorTest",
+}
+
+
+def exp_type_from_name(name:str)->str:
+    """ The exp type of a raw data file by its name, as the `Data_manager` or `ExpGovernment` which saved it would record. None if the name is neither. """
+    named = data_manager_name.match(name)
+    if named is not None:
+        exp = named.group("exp")
+        if exp.startswith("CryoScope"):
+            return f"cryo{exp[len('CryoScope'):]}"
+        if exp in data_manager_exp_types:
+            return data_manager_exp_types[exp]
+    if name.endswith("_Summaized_zT1.nc"):
+        return "ZgateEnergyRelaxation"  # `ZgateT1_store_path`
+    named = exp_frames_name.match(name)
+    if named is not None:
+        return exp_frames_exp_types.get(named.group("exp"))
+    return None
+
+
+def dataset_qubits(ds:Dataset)->list:
+    """ The qubits (or couplers) in a raw dataset, `q0`, `q0_x` and `q0_rawIQ` are all `q0`. """
+    return sorted(set(str(var).split("_")[0] for var in ds.data_vars))
+
+
+def key_attrs(ds:Dataset)->dict:
+    """ The plain (str, number or bool) attrs of the dataset and of its variables, the latter are keyed by `var.attr`. """
+    plain = lambda value: isinstance(value, (str, int, float, bool, generic))
+    attrs = {key: value for key, value in ds.attrs.items() if plain(value)}
+    for var in ds.data_vars:
+        attrs.update({f"{var}.{key}": value for key, value in ds[var].attrs.items() if plain(value)})
+    return {key: (value.item() if isinstance(value, generic) else value) for key, value in attrs.items()}
+
+
+def device_identity(QD_agent)->tuple[str, str]:
+    """ (DR identity, `device_fingerprint` of its quantum device) of `QD_agent`, take it before the device changes for the next run. """
+    from qblox_drive_AS.support.ScheduleCache import device_fingerprint
+    try:
+        return QD_agent.Identity, device_fingerprint(QD_agent.quantum_device)
+    except Exception as err:
+        warning_print(f"Device hash isn't available for the catalog: {err}")
+        return getattr(QD_agent, "Identity", None), None
+
+
+def _as_time_label(moment)->str:
+    """ datetime or str -> '%Y-%m-%d %H:%M:%S', same as the `end_time` attr of the datasets (UTC). """
+    if moment is None or isinstance(moment, str):
+        return moment
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class DataCatalog():
+    """
+    One row per raw data file: path, exp type, qubits, JOBID, `end_time` (UTC, like the dataset attr), DR identity,
+    hash of the quantum device (`device_fingerprint`) and the key attrs of the dataset.\n
+    Cataloging never stops a measurement, a failed record is only warned.
+    """
+    def __init__(self, db_path:str):
+        self.db_path:str = db_path
+        self.enabled:bool = True
+        self.__ready:bool = False
+
+    def __connect(self)->sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        if not self.__ready:
+            connection.execute("PRAGMA journal_mode=WAL")  # the analysis processes can read while a measurement records
+            connection.executescript(_schema)
+            self.__ready = True
+        return connection
+
+    def record(self, path:str, exp_type:str, qubits:list, JOBID:str=None, end_time:str=None, dr:str=None, qd_hash:str=None, attrs:dict={}):
+        """ Add or update the row of `path`, `end_time` is the file modified time (UTC) if not given. """
+        if not self.enabled:
+            return
+        path = os.path.abspath(path)
+        if end_time is None:
+            end_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(os.path.getmtime(path) if os.path.exists(path) else time.time()))
+        try:
+            with self.__connect() as connection:
+                connection.execute("INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?,?,?)",
+                                   (path, exp_type, None if JOBID is None else str(JOBID), end_time, dr, qd_hash, json.dumps(attrs, default=str), time.time()))
+                connection.execute("DELETE FROM run_qubits WHERE path = ?", (path,))
+                connection.executemany("INSERT INTO run_qubits VALUES (?,?)", [(path, q) for q in qubits])
+            connection.close()
+        except sqlite3.Error as err:
+            warning_print(f"{path} can't be cataloged: {err}")
+
+    def record_dataset(self, path:str, ds:Dataset, exp_type:str, QD_agent=None, JOBID:str=None, qubits:list=None, dr:str=None, qd_hash:str=None):
+        """ Record the file `path` of `ds`, the qubits, `end_time` and the key attrs come from the dataset, the DR and device hash from `QD_agent` (or `device_identity`). """
+        if not self.enabled:
+            return
+        if QD_agent is not None:
+            dr, qd_hash = device_identity(QD_agent)
+        end_time = ds.attrs.get("end_time")
+        self.record(path, exp_type, dataset_qubits(ds) if qubits is None else qubits, JOBID, end_time if isinstance(end_time, str) else None, dr, qd_hash, key_attrs(ds))
+
+    def record_file(self, path:str, exp_type:str, QD_agent=None, JOBID:str=None, dr:str=None, qd_hash:str=None):
+        """ Same as `record_dataset` with the saved file, only its metadata are read. A None `exp_type` is taken from the `exp_type` attr of the file if it has one. """
+        if not self.enabled:
+            return
+        try:
+            with open_dataset(path) as ds:
+                if exp_type is None and isinstance(ds.attrs.get("exp_type"), str):
+                    exp_type = ds.attrs["exp_type"]
+                self.record_dataset(path, ds, exp_type, QD_agent, JOBID, dr=dr, qd_hash=qd_hash)
+        except (OSError, ValueError) as err:
+            warning_print(f"{path} can't be cataloged: {err}")
+
+    def entries(self, exp_type:str|list=None, since:str|datetime=None, until:str|datetime=None, qubit:str=None, dr:str=None, JOBID:str=None, folder:str=None, existing_only:bool=True)->list:
+        """
+        The cataloged files sorted by `end_time`, as dicts with the columns of the catalog and "qubits".\n
+        #### Args:\n
+        * exp_type: like 'Ramsey' (`ExpGovernment` class names) or 'T1' (`Data_manager.save_raw_data` exp_type), or a list of them, case-insensitive.\n
+        * since, until: `end_time` range (UTC), datetime or '%Y-%m-%d %H:%M:%S'.\n
+        * qubit, dr, JOBID: exact matches, dr is the DR identity like 'DR2#171'.\n
+        * folder: only the files in this folder (and its sub-folders).\n
+        * existing_only: skip the files which were deleted or moved after cataloged.
+        """
+        conditions, values = [], []
+        if exp_type is not None:
+            exp_types = [exp_type] if isinstance(exp_type, str) else list(exp_type)
+            conditions.append(f"runs.exp_type COLLATE NOCASE IN ({','.join('?'*len(exp_types))})")
+            values += exp_types
+        for column, value in [("end_time >= ?", _as_time_label(since)), ("end_time <= ?", _as_time_label(until)), ("dr = ?", dr), ("JOBID = ?", None if JOBID is None else str(JOBID))]:
+            if value is not None:
+                conditions.append(column)
+                values.append(value)
+        if qubit is not None:
+            conditions.append("runs.path IN (SELECT path FROM run_qubits WHERE qubit = ?)")
+            values.append(qubit)
+        if folder is not None:
+            conditions.append("runs.path LIKE ?")
+            values.append(os.path.join(os.path.abspath(folder), "%"))
+        query = "SELECT runs.*, group_concat(run_qubits.qubit) FROM runs LEFT JOIN run_qubits ON runs.path = run_qubits.path"
+        if conditions:
+            query += " WHERE "+" AND ".join(conditions)
+        query += " GROUP BY runs.path ORDER BY end_time"
+
+        if not os.path.exists(self.db_path):
+            return []
+        try:
+            connection = self.__connect()
+            rows = connection.execute(query, values).fetchall()
+            connection.close()
+        except sqlite3.Error as err:
+            warning_print(f"Catalog query failed: {err}")
+            return []
+        columns = ["path", "exp_type", "JOBID", "end_time", "dr", "qd_hash", "attrs", "recorded_at", "qubits"]
+        found = []
+        for row in rows:
+            entry = dict(zip(columns, row))
+            entry["attrs"] = json.loads(entry["attrs"]) if entry["attrs"] else {}
+            entry["qubits"] = sorted(entry["qubits"].split(",")) if entry["qubits"] else []
+            if existing_only and not os.path.exists(entry["path"]):
+                continue
+            found.append(entry)
+        return found
+
+    def find(self, *args, **kwargs)->list:
+        """ Paths of the `entries` with the same args, sorted by `end_time`. """
+        return [entry["path"] for entry in self.entries(*args, **kwargs)]
+
+    def forget_missing(self)->int:
+        """ Remove the rows of the files which don't exist anymore, returns how many were removed. """
+        missing = [entry["path"] for entry in self.entries(existing_only=False) if not os.path.exists(entry["path"])]
+        if missing:
+            with self.__connect() as connection:
+                connection.executemany("DELETE FROM runs WHERE path = ?", [(path,) for path in missing])
+                connection.executemany("DELETE FROM run_qubits WHERE path = ?", [(path,) for path in missing])
+            connection.close()
+        return len(missing)
+
+    def index_folder(self, folder:str, exp_type:str=None)->int:
+        """
+        Catalog the `.nc` files in `folder` (and its sub-folders) saved before the catalog existed.\n
+        If `exp_type` isn't given, it's parsed from the file name by `exp_type_from_name`, or the `exp_type` attr of the file, or left NULL.
+        """
+        known = set(self.find(folder=folder, existing_only=False))
+        count = 0
+        for parent, _, files in os.walk(folder):
+            for name in sorted(files):
+                path = os.path.abspath(os.path.join(parent, name))
+                if name.split(".")[-1] == 'nc' and path not in known:
+                    self.record_file(path, exp_type_from_name(name) if exp_type is None else exp_type)
+                    count += 1
+        return count
+
+
+data_catalog = DataCatalog(os.path.join(meas_raw_dir, catalog_file_name))
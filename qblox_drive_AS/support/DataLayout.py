@@ -0,0 +1,69 @@
+""" Compact layout of the raw datasets: the sweep values are stored once as coordinates and the measured data as compressed float32. """
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from numpy import float32, float64
+from xarray import Dataset, open_dataset
+
+
+compact_layout_name:str = "compact"
+
+
+def _constant_dims(values, dims:tuple)->list:
+    """ The dims `values` doesn't change along. """
+    return [dim for axis, dim in enumerate(dims) if (values == values.take([0], axis=axis)).all()]
+
+
+def compact_dataset(ds:Dataset, complevel:int=4)->Dataset:
+    """
+    The compact layout of a raw dataset in the legacy one.\n
+    A sweep variable `{q}_{name}` (like `q0_x` in (mixer, repeat, idx)) becomes a coordinate without the dims it repeats along (`q0_x` in (idx,)),
+    the dims to broadcast it back are kept in its attr `expand_dims`. The float data are saved as float32 with zlib and chunking.
+    `expand_dataset` gives the legacy layout back.
+    """
+    if ds.attrs.get("layout") == compact_layout_name:
+        return ds
+    compact = ds.copy()
+    measured = [var for var in ds.data_vars if "_" not in str(var)]
+    for var in ds.data_vars:
+        if var in measured or str(var).split("_")[0] not in measured:
+            continue
+        values = ds[var].values
+        repeated = _constant_dims(values, ds[var].dims) if values.size != 0 else []
+        if len(repeated) == 0:
+            continue
+        reduced = values[tuple(0 if dim in repeated else slice(None) for dim in ds[var].dims)]
+        compact = compact.drop_vars(var).assign_coords({var:([dim for dim in ds[var].dims if dim not in repeated], reduced, {**ds[var].attrs, "expand_dims":" ".join(ds[var].dims)})})
+
+    for var in compact.data_vars:
+        if compact[var].dtype.kind == 'f':
+            encoding = dict(compact[var].encoding)
+            compact[var] = compact[var].astype(float32)
+            compact[var].encoding = {**encoding, "zlib":True, "complevel":complevel}
+    compact.attrs["layout"] = compact_layout_name
+    return compact
+
+
+def expand_dataset(ds:Dataset)->Dataset:
+    """ The legacy layout of a dataset in the compact layout (float64 data and full-shaped sweep variables), a legacy dataset is returned as it is. """
+    if ds.attrs.get("layout") != compact_layout_name:
+        return ds
+    expanded = ds.copy()
+    for name in [name for name in ds.coords if "expand_dims" in ds[name].attrs]:
+        dims = ds[name].attrs["expand_dims"].split(" ")
+        variable = ds[name].variable.set_dims({dim: ds.sizes[dim] for dim in dims})
+        attrs = {key: value for key, value in ds[name].attrs.items() if key != "expand_dims"}
+        expanded = expanded.drop_vars(name).assign({name:(dims, variable.values, attrs)})
+    for var in expanded.data_vars:
+        if expanded[var].dtype == float32:
+            expanded[var] = expanded[var].astype(float64)
+    expanded.attrs.pop("layout")
+    return expanded
+
+
+def open_raw_dataset(path:str, **kwargs)->Dataset:
+    """ `open_dataset` for the raw data files in both layouts, the returned dataset is always in the legacy layout. """
+    ds = open_dataset(path, **kwargs)
+    expanded = expand_dataset(ds)
+    if expanded is not ds:
+        expanded.set_close(ds.close)
+    return expanded
@@ -1,24 +1,77 @@
 from numpy import ndarray
 from abc import ABC
-import os
+from functools import wraps
+import os, time
 from datetime import datetime
 from xarray import Dataset
 from qblox_drive_AS.support.QDmanager import QDmanager, Data_manager
 from qblox_drive_AS.analysis.Multiplexing_analysis import Multiplex_analyzer, sort_timeLabel
 from qblox_drive_AS.support.UserFriend import *
-from xarray import open_dataset
+from qblox_drive_AS.support.DataLayout import open_raw_dataset, compact_dataset
 from numpy import array, linspace, arange, logspace, mean, median, std, sort
 from abc import abstractmethod
-from qblox_drive_AS.support import init_meas, init_system_atte, shut_down, coupler_zctrl, advise_where_fq
+from qblox_drive_AS.support import init_meas, init_system_atte, shut_down, coupler_zctrl, advise_where_fq, cluster_sessions
 from qblox_drive_AS.support.Pulse_schedule_library import set_LO_frequency, QS_fit_analysis
+from qblox_drive_AS.support.ScheduleCache import schedule_cache, precompiler
+from qblox_drive_AS.support.PhaseTracer import tracer, traced_step
+from qblox_drive_AS.support.DataCatalog import data_catalog, device_identity
+from qblox_drive_AS.support.AsyncWriter import raw_writer
 from quantify_scheduler.helpers.collections import find_port_clock_path
-from qblox_drive_AS.analysis.raw_data_demolisher import ZgateT1_dataReducer
+from qblox_drive_AS.analysis.raw_data_demolisher import ZgateT1_dataReducer, ZgateT1_slices, ZgateT1_store_path
+from qblox_drive_AS.support.AppendStore import AppendStore
 from qblox_drive_AS.analysis.TimeTraceAna import time_monitor_data_ana
+from qblox_drive_AS.analysis.AnalysisPool import AnalysisJob, run_analysis_jobs
+from qblox_drive_AS.analysis.DiscriminatorStore import discriminator_key
+
+
+def cataloged_measurement(func):
+    """ Wrap `RunMeasurement`, record the files at `RawDataPaths` (or `RawDataPath`) into `data_catalog` if the measurement saved them, after `raw_writer` saved them. """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        result = func(self, *args, **kwargs)
+        if not (getattr(self, "execution", True) and hasattr(type(self), "RawDataPath")):
+            return result
+        with raw_writer.no_wait():
+            raw_data_paths = [path for path in (self.RawDataPaths if hasattr(type(self), "RawDataPaths") else [self.RawDataPath]) if path]
+        if len(raw_data_paths) == 0:
+            return result
+        dr, qd_hash = device_identity(self.QD_agent) if hasattr(self, "QD_agent") else (None, None)
+        JOBID = getattr(self, "JOBID", None)
+        def record():
+            for raw_data_path in raw_data_paths:
+                if os.path.isfile(raw_data_path):
+                    data_catalog.record_file(raw_data_path, type(self).__name__, JOBID=JOBID, dr=dr, qd_hash=qd_hash)
+        raw_writer.submit(record, description=f"catalog of {type(self).__name__}")
+        return result
+    return wrapper
 
 
 class ExpGovernment(ABC):
     def __init__(self):
         self.QD_path:str = ""
+
+    def __init_subclass__(cls, **kwargs):
+        """ Time the steps of every experiment, see `PhaseTracer`, and catalog the raw data every `RunMeasurement` saved, see `DataCatalog`. """
+        super().__init_subclass__(**kwargs)
+        if "RunMeasurement" in cls.__dict__:
+            setattr(cls, "RunMeasurement", cataloged_measurement(cls.__dict__["RunMeasurement"]))
+        for step_name in ["PrepareHardware", "RunMeasurement", "CloseMeasurement", "RunAnalysis"]:
+            if step_name in cls.__dict__:
+                setattr(cls, step_name, traced_step(cls.__dict__[step_name], step_name))
+    
+    def _save_or_append(self, dataset:Dataset, prefix:str, raw_data_location:str)->str:
+        """
+        Save the raw `dataset` of `RunMeasurement` as `{prefix}_{time or JOBID}.nc` in `save_dir`, returns its path.\n
+        In the while loop (`want_while`) the loops after the first one append to `raw_data_location` as one more `repeat`, see `AppendStore`.
+        """
+        if not (self.want_while and raw_data_location != ""):
+            self.save_path = os.path.join(self.save_dir,f"{prefix}_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
+            raw_data_location = self.save_path + ".nc"
+        if self.want_while:
+            raw_writer.submit(AppendStore(raw_data_location, "repeat", running_index=True).append, compact_dataset(dataset), description=raw_data_location)
+        else:
+            raw_writer.save_netcdf(dataset, raw_data_location, compact=True)
+        return raw_data_location
     
     @abstractmethod
     def SetParameters(self,*args,**kwargs):
@@ -45,6 +98,40 @@ class ExpGovernment(ABC):
         pass
 
 
+class PipelinedExecutor():
+    """
+    Run ExpGovernment jobs back-to-back on one kept cluster session. While job N is acquiring, the schedules which job N+1 compiled last time are compiled
+    again on a background thread (from the config snapshots recorded then), so job N+1 picks them up from the compiled-schedule cache if its settings didn't change.\n
+    `duty_cycle` is measured by `CachedScheduleGettable`, the jobs not using it count as no acquisition time.\n
+    #### Args:\n
+    * cyclic: bool, the job after the last one is the first one, like the cycles in `QubitMonitor`.
+    """
+    def __init__(self, cyclic:bool=False):
+        self.cyclic = cyclic
+        self.wall_seconds:float = 0
+        self.hardware_seconds:float = 0
+
+    @property
+    def duty_cycle(self)->float:
+        """ acquisition time over wall time """
+        return self.hardware_seconds/self.wall_seconds if self.wall_seconds != 0 else 0
+
+    def run(self, jobs:list):
+        """ jobs: [exp, (exp, workflow_kwargs), ...], each `exp` had been given its `SetParameters`. """
+        jobs = [job if isinstance(job, tuple) else (job, {}) for job in jobs]
+        with cluster_sessions.hold():
+            for idx, (exp, workflow_kwargs) in enumerate(jobs):
+                precompiler.current_tag = type(exp).__name__
+                if idx+1 < len(jobs) or self.cyclic:
+                    precompiler.arm(type(jobs[(idx+1)%len(jobs)][0]).__name__)
+                start, hardware_before = time.time(), schedule_cache.hardware_seconds
+                exp.WorkFlow(**workflow_kwargs)
+                self.wall_seconds += time.time()-start
+                self.hardware_seconds += schedule_cache.hardware_seconds-hardware_before
+        precompiler.current_tag = None
+        slightly_print(f"Hardware duty cycle = {round(self.duty_cycle*100,1)} % ({round(self.hardware_seconds,1)} s acquiring in {round(self.wall_seconds,1)} s)")
+
+
 
 class BroadBand_CavitySearching(ExpGovernment):
     def __init__(self,QD_path:str,data_folder:str=None,JOBID:str=None):
@@ -56,7 +143,7 @@ class BroadBand_CavitySearching(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, target_qs:list,freq_start:float, freq_end:float, freq_pts:int):
         self.counter:int = len(target_qs)
@@ -79,7 +166,7 @@ class BroadBand_CavitySearching(ExpGovernment):
         if self.save_dir is not None:
             self.save_path = os.path.join(self.save_dir,f"BroadBandCS_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
             self.__raw_data_location = self.save_path + ".nc"
-            dataset.to_netcdf(self.__raw_data_location)
+            raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
             self.save_fig_path = self.save_path+".png"
         else:
             self.save_fig_path = None
@@ -98,7 +185,7 @@ class BroadBand_CavitySearching(ExpGovernment):
             QD_file = new_QD_path
 
         if new_file_path is None:
-            file_path = self.__raw_data_location
+            file_path = self.RawDataPath
             fig_path = self.save_fig_path
         else:
             file_path = new_file_path
@@ -107,7 +194,7 @@ class BroadBand_CavitySearching(ExpGovernment):
         QD_savior = QDmanager(QD_file)
         QD_savior.QD_loader()
 
-        ds = open_dataset(file_path)
+        ds = open_raw_dataset(file_path)
 
         plot_S21(ds,fig_path)
         ds.close()
@@ -133,7 +220,7 @@ class Zoom_CavitySearching(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, freq_range:dict, freq_pts:int=100, avg_n:int=100, execution:bool=True):
         """ freq_range: {"q0":[freq_start, freq_end], ...}, sampling function use linspace """
@@ -170,7 +257,7 @@ class Zoom_CavitySearching(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"zoomCS_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -189,7 +276,7 @@ class Zoom_CavitySearching(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -198,7 +285,7 @@ class Zoom_CavitySearching(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
 
             CS_ana(QD_savior,ds,fig_path)
             ds.close()
@@ -223,14 +310,16 @@ class PowerCavity(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
-    def SetParameters(self, freq_span_range:dict, roamp_range:list, roamp_sampling_func:str, freq_pts:int=100, avg_n:int=100, execution:bool=True):
+    def SetParameters(self, freq_span_range:dict, roamp_range:list, roamp_sampling_func:str, freq_pts:int=100, avg_n:int=100, execution:bool=True, outer_batch:int=0):
         """ ### Args:
             * freq_span_range: {"q0":[freq_span_start, freq_span_end], ...}, sampling function use linspace\n
             * roamp_range: [amp_start, amp_end, pts]\n
-            * roamp_sampling_func (str): 'linspace', 'arange', 'logspace'
+            * roamp_sampling_func (str): 'linspace', 'arange', 'logspace'\n
+            * outer_batch: int, how many ro-amp points are swept in one compiled schedule. 0 compiles once per ro-amp.
         """
+        self.outer_batch = outer_batch
         self.freq_range = {}
         self.tempor_freq:list = [freq_span_range,freq_pts] # After QD loaded, use it to set self.freq_range
 
@@ -257,12 +346,12 @@ class PowerCavity(ExpGovernment):
             rof = self.QD_agent.quantum_device.get_element(q).clock_freqs.readout()
             self.freq_range[q] = linspace(rof+self.tempor_freq[0][q][0],rof+self.tempor_freq[0][q][1],self.tempor_freq[1])
         QD_RO_init(self.QD_agent,self.freq_range)
-        dataset = PowerDep_spec(self.QD_agent,self.meas_ctrl,self.freq_range,self.roamp_samples,self.avg_n,self.execution)
+        dataset = PowerDep_spec(self.QD_agent,self.meas_ctrl,self.freq_range,self.roamp_samples,self.avg_n,self.execution,self.outer_batch)
         if self.execution:
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"PowerCavity_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -281,7 +370,7 @@ class PowerCavity(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -290,7 +379,7 @@ class PowerCavity(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
 
             plot_powerCavity_S21(ds,QD_savior,fig_path)
             ds.close()
@@ -316,7 +405,7 @@ class Dressed_CavitySearching(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, freq_range:dict, ro_amp:dict, freq_pts:int=100, avg_n:int=100, execution:bool=True):
         """ 
@@ -349,7 +438,7 @@ class Dressed_CavitySearching(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"dressedCS_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -368,7 +457,7 @@ class Dressed_CavitySearching(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -377,7 +466,7 @@ class Dressed_CavitySearching(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             for q in self.ro_amp:
                 QD_savior.quantum_device.get_element(q).measure.pulse_amp(self.ro_amp[q])
             CS_ana(QD_savior,ds,fig_path,keep_bare=False)
@@ -403,7 +492,7 @@ class FluxCoupler(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, freq_span_range:dict, bias_elements:list, flux_range:list, flux_sampling_func:str, freq_pts:int=100, avg_n:int=100, execution:bool=True):
         """ ### Args:
@@ -443,7 +532,7 @@ class FluxCoupler(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"FluxCoupler_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -461,7 +550,7 @@ class FluxCoupler(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -470,7 +559,7 @@ class FluxCoupler(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             for var in ds.data_vars:
                 ANA = Multiplex_analyzer("m5")
                 if var.split("_")[-1] != 'freq':
@@ -499,14 +588,16 @@ class FluxCavity(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
-    def SetParameters(self, freq_span_range:dict, flux_range:list, flux_sampling_func:str, freq_pts:int=100, avg_n:int=100, execution:bool=True):
+    def SetParameters(self, freq_span_range:dict, flux_range:list, flux_sampling_func:str, freq_pts:int=100, avg_n:int=100, execution:bool=True, outer_batch:int=0):
         """ ### Args:
             * freq_span_range: {"q0":[freq_span_start, freq_span_end], ...}, sampling function use linspace\n
             * flux_range: [amp_start, amp_end, pts]\n
-            * flux_sampling_func (str): 'linspace', 'arange', 'logspace'
+            * flux_sampling_func (str): 'linspace', 'arange', 'logspace'\n
+            * outer_batch: int, how many flux points are swept in one compiled schedule. 0 compiles once per flux.
         """
+        self.outer_batch = outer_batch
         self.freq_range = {}
         self.tempor_freq:list = [freq_span_range,freq_pts] # After QD loaded, use it to set self.freq_range
         self.avg_n = avg_n
@@ -534,12 +625,12 @@ class FluxCavity(ExpGovernment):
             self.freq_range[q] = linspace(rof+self.tempor_freq[0][q][0],rof+self.tempor_freq[0][q][1],self.tempor_freq[1])
             
         QD_RO_init(self.QD_agent,self.freq_range)
-        dataset = FluxCav_spec(self.QD_agent,self.meas_ctrl,self.Fctrl,self.freq_range,self.flux_samples,self.avg_n,self.execution)
+        dataset = FluxCav_spec(self.QD_agent,self.meas_ctrl,self.Fctrl,self.freq_range,self.flux_samples,self.avg_n,self.execution,self.outer_batch)
         if self.execution:
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"FluxCavity_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -559,7 +650,7 @@ class FluxCavity(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -568,7 +659,7 @@ class FluxCavity(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             answer = {}
             for var in ds.data_vars:
                 if str(var).split("_")[-1] != 'freq':
@@ -610,7 +701,7 @@ class IQ_references(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, ro_amp_factor:dict, shots:int=100, execution:bool=True):
         """ 
@@ -642,7 +733,7 @@ class IQ_references(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"IQref_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
             else:
                 self.save_fig_path = None
         
@@ -660,7 +751,7 @@ class IQ_references(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -669,7 +760,7 @@ class IQ_references(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             
             answer = {}
             for q in ds.data_vars:
@@ -698,7 +789,7 @@ class PowerConti2tone(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, freq_range:dict, xyl_range:list, xyl_sampling_func:str, freq_pts:int=100, avg_n:int=100, ro_xy_overlap:bool=False, execution:bool=True):
         """ ### Args:
@@ -759,7 +850,7 @@ class PowerConti2tone(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"PowerCnti2tone_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -777,7 +868,7 @@ class PowerConti2tone(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -786,7 +877,7 @@ class PowerConti2tone(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             for var in ds.data_vars:
                 if str(var).split("_")[-1] != 'freq':
                     ANA = Multiplex_analyzer("m8")     
@@ -817,15 +908,17 @@ class FluxQubit(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
-    def SetParameters(self, freq_span_range:dict, bias_targets:list,z_amp_range:list, z_amp_sampling_func:str, freq_pts:int=100, avg_n:int=100, execution:bool=True):
+    def SetParameters(self, freq_span_range:dict, bias_targets:list,z_amp_range:list, z_amp_sampling_func:str, freq_pts:int=100, avg_n:int=100, execution:bool=True, outer_batch:int=0):
         """ ### Args:
             * freq_span_range: {"q0":[freq_span_start, freq_span_end], ...}, sampling function use linspace\n
             * bias_targets: list, what qubit need to be bias, like ['q0', 'q1', ...]\n
             * z_amp_range: [amp_start, amp_end, pts]\n
-            * z_amp_sampling_func (str): 'linspace', 'arange', 'logspace'
+            * z_amp_sampling_func (str): 'linspace', 'arange', 'logspace'\n
+            * outer_batch: int, how many z points are swept in one compiled schedule. 0 compiles once per z point.
         """
+        self.outer_batch = outer_batch
         self.freq_range = {}
         self.bias_elements = bias_targets
         self.tempor_freq:list = [freq_span_range,freq_pts] # After QD loaded, use it to set self.freq_range
@@ -861,14 +954,14 @@ class FluxQubit(ExpGovernment):
             self.freq_range[q] = linspace(xyf+self.tempor_freq[0][q][0],xyf+self.tempor_freq[0][q][1],self.tempor_freq[1])
             set_LO_frequency(self.QD_agent.quantum_device,q=q,module_type='drive',LO_frequency=max(self.freq_range[q]))
             
-        dataset = Zgate_two_tone_spec(self.QD_agent,self.meas_ctrl,self.freq_range,self.bias_elements,self.z_amp_samples,self.avg_n,self.execution)
+        dataset = Zgate_two_tone_spec(self.QD_agent,self.meas_ctrl,self.freq_range,self.bias_elements,self.z_amp_samples,self.avg_n,self.execution,self.outer_batch)
         if self.execution:
             for q in self.z_ref:
                 dataset.attrs[f"{q}_z_ref"] = self.z_ref[q]
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"FluxQubit_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -887,7 +980,7 @@ class FluxQubit(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -896,7 +989,7 @@ class FluxQubit(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             answer = {}
             for var in ds.data_vars:
                 if str(var).split("_")[-1] != 'freq':
@@ -937,7 +1030,7 @@ class PowerRabiOsci(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, pi_amp:dict, pi_amp_sampling_func:str, pi_amp_pts_or_step:float=100, avg_n:int=100, execution:bool=True, OSmode:bool=False):
         """ ### Args:
@@ -983,7 +1076,7 @@ class PowerRabiOsci(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"PowerRabi_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -1002,7 +1095,7 @@ class PowerRabiOsci(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -1011,7 +1104,7 @@ class PowerRabiOsci(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             for var in ds.data_vars:
                 if str(var).split("_")[-1] != 'piamp':
                     ANA = Multiplex_analyzer("m11")      
@@ -1044,7 +1137,7 @@ class TimeRabiOsci(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, pi_dura:dict, pi_dura_sampling_func:str, pi_dura_pts_or_step:float=100, avg_n:int=100, execution:bool=True, OSmode:bool=False):
         """ ### Args:
@@ -1091,7 +1184,7 @@ class TimeRabiOsci(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"TimeRabi_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -1110,7 +1203,7 @@ class TimeRabiOsci(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -1119,7 +1212,7 @@ class TimeRabiOsci(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             for var in ds.data_vars:
                 if str(var).split("_")[-1] != 'pidura':
                     ANA = Multiplex_analyzer("m11")      
@@ -1153,19 +1246,23 @@ class SingleShot(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
     
     @RawDataPath.setter
     def RawDataPath(self,path:str):
         self.__raw_data_location = path
 
-    def SetParameters(self, target_qs:list, histo_counts:int=1, shots:int=10000, execution:bool=True):
+    def SetParameters(self, target_qs:list, histo_counts:int=1, shots:int=10000, execution:bool=True, thresholded:bool=False, raw_subsample:int=0):
         """ 
         ### Args:\n
         * target_qs: list, like ["q0", "q1", ...]
+        * thresholded: discriminate the shots on the instrument, only the state bits are saved. It needs a stored discriminator, see `DiscriminatorStore`.
+        * raw_subsample: with `thresholded`, also save this many raw-IQ shots per state to refresh the discriminators.
         """
         self.use_time_label:bool = False
         self.avg_n = shots
+        self.thresholded = thresholded
+        self.raw_subsample = raw_subsample
         self.execution = execution
         self.target_qs = target_qs
         self.histos = histo_counts
@@ -1192,12 +1289,12 @@ class SingleShot(ExpGovernment):
         from qblox_drive_AS.SOP.SingleShot import Qubit_state_single_shot
        
 
-        dataset = Qubit_state_single_shot(self.QD_agent,self.target_qs,self.avg_n,self.execution)
+        dataset = Qubit_state_single_shot(self.QD_agent,self.target_qs,self.avg_n,self.execution,self.thresholded,self.raw_subsample)
         if self.execution:
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"SingleShot_{datetime.now().strftime('%Y%m%d%H%M%S') if (self.JOBID is None or self.use_time_label) else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
             else:
                 self.save_fig_path = None
         
@@ -1215,7 +1312,7 @@ class SingleShot(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -1225,15 +1322,16 @@ class SingleShot(ExpGovernment):
             QD_savior.QD_loader()
 
             if not histo_ana:
-                ds = open_dataset(file_path)
-                for var in ds.data_vars:
+                ds = open_raw_dataset(file_path)
+                for var in [var for var in ds.data_vars if var.split("_")[-1] != 'rawIQ']:
                     ANA = Multiplex_analyzer("m14")
                     ANA._import_data(ds[var]*1000,var_dimension=0,fq_Hz=QD_savior.quantum_device.get_element(var).clock_freqs.f01())
                     ANA._start_analysis()
                     pic_path = os.path.join(fig_path,f"{var}_SingleShot_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                     ANA._export_result(pic_path)
-                    highlight_print(f"{var} rotate angle = {round(ANA.fit_packs['RO_rotation_angle'],2)} in degree.")
-                    QD_savior.rotate_angle[var] = [ANA.fit_packs["RO_rotation_angle"]]
+                    if ANA.fit_packs["RO_rotation_angle"] is not None: # thresholded data keeps the angle it was taken with
+                        highlight_print(f"{var} rotate angle = {round(ANA.fit_packs['RO_rotation_angle'],2)} in degree.")
+                        QD_savior.rotate_angle[var] = [ANA.fit_packs["RO_rotation_angle"]]
                 ds.close()
                 
                 QD_savior.QD_keeper()
@@ -1242,12 +1340,12 @@ class SingleShot(ExpGovernment):
                 eff_T, thermal_pop = {}, {}
                 files = sort_timeLabel([os.path.join(fig_path,name) for name in os.listdir(fig_path) if (os.path.isfile(os.path.join(fig_path,name)) and name.split(".")[-1]=='nc')])
                 for nc_idx, nc_file in enumerate(files):
-                    ds = open_dataset(nc_file)
-                    for var in ds.data_vars:
+                    ds = open_raw_dataset(nc_file)
+                    for var in [var for var in ds.data_vars if var.split("_")[-1] != 'rawIQ']:
                         if nc_idx == 0: eff_T[var], thermal_pop[var] = [], []
                         ANA = Multiplex_analyzer("m14")
                         ANA._import_data(ds[var]*1000,var_dimension=0,fq_Hz=QD_savior.quantum_device.get_element(var).clock_freqs.f01())
-                        ANA._start_analysis()
+                        ANA._start_analysis(discriminator_key=discriminator_key(QD_savior,var))
                         eff_T[var].append(ANA.fit_packs["effT_mK"])
                         thermal_pop[var].append(ANA.fit_packs["thermal_population"]*100)
                 
@@ -1276,7 +1374,7 @@ class Ramsey(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, time_range:dict, time_sampling_func:str, time_pts_or_step:int|float=100,histo_counts:int=1, avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -1334,9 +1432,7 @@ class Ramsey(ExpGovernment):
         dataset = Ramsey(self.QD_agent,self.meas_ctrl,self.time_samples,self.spin_num,self.histos,self.avg_n,self.execution)
         if self.execution:
             if self.save_dir is not None:
-                self.save_path = os.path.join(self.save_dir,f"Ramsey_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
-                self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                self.__raw_data_location = self._save_or_append(dataset, "Ramsey", self.__raw_data_location)
                 
             else:
                 self.save_fig_path = None
@@ -1355,7 +1451,7 @@ class Ramsey(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -1364,7 +1460,7 @@ class Ramsey(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
         
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'x':
@@ -1379,7 +1475,7 @@ class Ramsey(ExpGovernment):
                     ANA._export_result(fig_path)
 
                     """ Storing """
-                    if self.histos >= 50:
+                    if ds.sizes["repeat"] >= 50:
                         QD_savior.Notewriter.save_T2_for(ANA.fit_packs["median_T2"],var)
                    
             ds.close()
@@ -1387,18 +1483,19 @@ class Ramsey(ExpGovernment):
             
 
     def WorkFlow(self,freq_detune_Hz:float=None):
-        while True:
-            self.PrepareHardware()
+        with cluster_sessions.hold():
+            while True:
+                self.PrepareHardware()
 
-            if freq_detune_Hz is not None:
-                for q in self.target_qs:
-                    self.QD_agent.quantum_device.get_element(q).clock_freqs.f01(self.QD_agent.quantum_device.get_element(q).clock_freqs.f01()+freq_detune_Hz)
+                if freq_detune_Hz is not None:
+                    for q in self.target_qs:
+                        self.QD_agent.quantum_device.get_element(q).clock_freqs.f01(self.QD_agent.quantum_device.get_element(q).clock_freqs.f01()+freq_detune_Hz)
 
-            self.RunMeasurement()
+                self.RunMeasurement()
 
-            self.CloseMeasurement()   
-            if not self.want_while:
-                break
+                self.CloseMeasurement()   
+                if not self.want_while:
+                    break
 
 class SpinEcho(ExpGovernment):
     def __init__(self,QD_path:str,data_folder:str=None,JOBID:str=None):
@@ -1410,7 +1507,7 @@ class SpinEcho(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, time_range:dict, time_sampling_func:str, time_pts_or_step:int|float=100,histo_counts:int=1, avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -1468,9 +1565,7 @@ class SpinEcho(ExpGovernment):
         dataset = Ramsey(self.QD_agent,self.meas_ctrl,self.time_samples,self.spin_num,self.histos,self.avg_n,self.execution)
         if self.execution:
             if self.save_dir is not None:
-                self.save_path = os.path.join(self.save_dir,f"SpinEcho_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
-                self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                self.__raw_data_location = self._save_or_append(dataset, "SpinEcho", self.__raw_data_location)
                 
             else:
                 self.save_fig_path = None
@@ -1489,7 +1584,7 @@ class SpinEcho(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -1498,7 +1593,7 @@ class SpinEcho(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
         
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'x':
@@ -1513,7 +1608,7 @@ class SpinEcho(ExpGovernment):
                     ANA._export_result(fig_path)
 
                     """ Storing """
-                    if self.histos >= 50:
+                    if ds.sizes["repeat"] >= 50:
                         QD_savior.Notewriter.save_echoT2_for(ANA.fit_packs["median_T2"],var)
                    
             ds.close()
@@ -1521,14 +1616,15 @@ class SpinEcho(ExpGovernment):
             
 
     def WorkFlow(self):
-        while True:
-            self.PrepareHardware()
+        with cluster_sessions.hold():
+            while True:
+                self.PrepareHardware()
 
-            self.RunMeasurement()
+                self.RunMeasurement()
 
-            self.CloseMeasurement()   
-            if not self.want_while:
-                break
+                self.CloseMeasurement()   
+                if not self.want_while:
+                    break
 
 class CPMG(ExpGovernment):
     def __init__(self,QD_path:str,data_folder:str=None,JOBID:str=None):
@@ -1540,7 +1636,7 @@ class CPMG(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, time_range:dict, pi_num:dict, time_sampling_func:str, time_pts_or_step:int|float=100,histo_counts:int=1, avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -1598,9 +1694,7 @@ class CPMG(ExpGovernment):
         dataset = Ramsey(self.QD_agent,self.meas_ctrl,self.time_samples,self.spin_num,self.histos,self.avg_n,self.execution)
         if self.execution:
             if self.save_dir is not None:
-                self.save_path = os.path.join(self.save_dir,f"CPMG_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
-                self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                self.__raw_data_location = self._save_or_append(dataset, "CPMG", self.__raw_data_location)
                 
             else:
                 self.save_fig_path = None
@@ -1619,7 +1713,7 @@ class CPMG(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -1628,7 +1722,7 @@ class CPMG(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
         
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'x':
@@ -1643,7 +1737,7 @@ class CPMG(ExpGovernment):
                     ANA._export_result(fig_path)
 
                     """ Storing """
-                    if self.histos >= 50:
+                    if ds.sizes["repeat"] >= 50:
                         QD_savior.Notewriter.save_echoT2_for(ANA.fit_packs["median_T2"],var)
                    
             ds.close()
@@ -1651,18 +1745,19 @@ class CPMG(ExpGovernment):
             
 
     def WorkFlow(self, freq_detune_Hz:float=None):
-        while True:
-            self.PrepareHardware()
+        with cluster_sessions.hold():
+            while True:
+                self.PrepareHardware()
             
-            if freq_detune_Hz is not None:
-                for q in self.target_qs:
-                    self.QD_agent.quantum_device.get_element(q).clock_freqs.f01(self.QD_agent.quantum_device.get_element(q).clock_freqs.f01()+freq_detune_Hz)
+                if freq_detune_Hz is not None:
+                    for q in self.target_qs:
+                        self.QD_agent.quantum_device.get_element(q).clock_freqs.f01(self.QD_agent.quantum_device.get_element(q).clock_freqs.f01()+freq_detune_Hz)
 
-            self.RunMeasurement()
+                self.RunMeasurement()
 
-            self.CloseMeasurement()   
-            if not self.want_while:
-                break
+                self.CloseMeasurement()   
+                if not self.want_while:
+                    break
 
 class EnergyRelaxation(ExpGovernment):
     def __init__(self,QD_path:str,data_folder:str=None,JOBID:str=None):
@@ -1674,7 +1769,7 @@ class EnergyRelaxation(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, time_range:dict, time_sampling_func:str, time_pts_or_step:int|float=100,histo_counts:int=1, avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -1729,9 +1824,7 @@ class EnergyRelaxation(ExpGovernment):
         dataset = T1(self.QD_agent,self.meas_ctrl,self.time_samples,self.histos,self.avg_n,self.execution)
         if self.execution:
             if self.save_dir is not None:
-                self.save_path = os.path.join(self.save_dir,f"T1_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
-                self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                self.__raw_data_location = self._save_or_append(dataset, "T1", self.__raw_data_location)
                 
             else:
                 self.save_fig_path = None
@@ -1750,7 +1843,7 @@ class EnergyRelaxation(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -1759,7 +1852,7 @@ class EnergyRelaxation(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
         
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'x':
@@ -1774,7 +1867,7 @@ class EnergyRelaxation(ExpGovernment):
                     ANA._export_result(fig_path)
 
                     """ Storing """
-                    if self.histos >= 50:
+                    if ds.sizes["repeat"] >= 50:
                         QD_savior.Notewriter.save_T1_for(ANA.fit_packs["median_T1"],var)
 
             ds.close()
@@ -1782,14 +1875,15 @@ class EnergyRelaxation(ExpGovernment):
             
 
     def WorkFlow(self):
-        while True:
-            self.PrepareHardware()
+        with cluster_sessions.hold():
+            while True:
+                self.PrepareHardware()
 
-            self.RunMeasurement()
+                self.RunMeasurement()
 
-            self.CloseMeasurement()   
-            if not self.want_while:
-                break
+                self.CloseMeasurement()   
+                if not self.want_while:
+                    break
 
 class XYFcali(ExpGovernment):
     def __init__(self,QD_path:str,data_folder:str=None,JOBID:str=None):
@@ -1801,7 +1895,7 @@ class XYFcali(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, target_qs:list, evo_time:float=0.5e-6, detu:float=0, avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -1841,7 +1935,7 @@ class XYFcali(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"XYFcali_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -1860,7 +1954,7 @@ class XYFcali(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -1869,7 +1963,7 @@ class XYFcali(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             answer = {}
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'x':
@@ -1922,7 +2016,7 @@ class ROFcali(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, freq_span_range:dict, freq_pts:int=100, avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -1960,7 +2054,7 @@ class ROFcali(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"ROFcali_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -1979,7 +2073,7 @@ class ROFcali(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -1988,7 +2082,7 @@ class ROFcali(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             answer = {}
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'rof':
@@ -2029,7 +2123,7 @@ class PiAcali(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, piamp_coef_range:dict, amp_sampling_funct:str, coef_ptsORstep:int=100, pi_pair_num:list=[2,3], avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -2073,7 +2167,7 @@ class PiAcali(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"PIampcali_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -2092,7 +2186,7 @@ class PiAcali(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -2101,7 +2195,7 @@ class PiAcali(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             answer = {}
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'PIcoef':
@@ -2146,7 +2240,7 @@ class hPiAcali(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, piamp_coef_range:dict, amp_sampling_funct:str, coef_ptsORstep:int=100, halfPi_pair_num:list=[3,5], avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -2190,7 +2284,7 @@ class hPiAcali(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"halfPIampcali_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -2209,7 +2303,7 @@ class hPiAcali(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -2218,7 +2312,7 @@ class hPiAcali(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             answer = {}
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'HalfPIcoef':
@@ -2262,7 +2356,7 @@ class ROLcali(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, roamp_coef_range:dict, coef_sampling_func:str, ro_coef_ptsORstep:int=100, avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -2305,7 +2399,7 @@ class ROLcali(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"ROLcali_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -2324,7 +2418,7 @@ class ROLcali(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -2333,7 +2427,7 @@ class ROLcali(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'rol':
@@ -2358,12 +2452,18 @@ class ZgateEnergyRelaxation(ExpGovernment):
         super().__init__()
         self.QD_path = QD_path
         self.save_dir = data_folder
-        self.__raw_data_location:str = ""
+        self.__raw_data_locations:list = []
         self.JOBID = JOBID
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        """ The summarized file of the first qubit, see `RawDataPaths` for all of them. """
+        return raw_writer.ready(self.__raw_data_locations[0] if len(self.__raw_data_locations) != 0 else "")
+
+    @property
+    def RawDataPaths(self)->list:
+        """ The summarized file of every qubit the last run appended to. """
+        return [raw_writer.ready(path) for path in self.__raw_data_locations]
 
     def SetParameters(self, time_range:dict, time_sampling_func:str, bias_range:list, prepare_excited:bool=True, bias_sample_func:str='linspace', time_pts_or_step:int|float=100,Whileloop:bool=False, avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -2418,11 +2518,13 @@ class ZgateEnergyRelaxation(ExpGovernment):
         dataset = Zgate_T1(self.QD_agent,self.meas_ctrl,self.time_samples,self.bias_samples,self.avg_n,self.execution,no_pi_pulse= not self.prepare_1)
         if self.execution:
             if self.save_dir is not None:
-                if self.want_while:
-                    self.JOBID = None
-                self.save_path = os.path.join(self.save_dir,f"zgateT1_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
-                self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                # every run is one `end_time` slice appended to the summarized file of each qubit, no file per run
+                self.__raw_data_locations = []
+                for q, zT1_slice in ZgateT1_slices(dataset).items():
+                    store_path = ZgateT1_store_path(self.save_dir, q)
+                    os.makedirs(os.path.split(store_path)[0], exist_ok=True)
+                    raw_writer.submit(AppendStore(store_path, "end_time").append, zT1_slice, description=store_path)
+                    self.__raw_data_locations.append(store_path)
                 
             else:
                 self.save_fig_path = None
@@ -2431,8 +2533,8 @@ class ZgateEnergyRelaxation(ExpGovernment):
         shut_down(self.cluster,self.Fctrl)
 
 
-    def RunAnalysis(self, new_QD_path:str=None,new_file_path:str=None, time_dep_plot:bool=False):
-        """ If new file path was given, check all the data in that folder. """
+    def RunAnalysis(self, new_QD_path:str=None,new_file_path:str=None, time_dep_plot:bool=False, workers:int=None):
+        """ If new file path was given, check all the data in that folder (its summarized files, or the files of every run in an older folder). The qubits are analyzed on `workers` processes (see `run_analysis_jobs`), default is in this process. """
         
         if self.execution:
             if new_QD_path is None:
@@ -2441,7 +2543,7 @@ class ZgateEnergyRelaxation(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -2451,7 +2553,11 @@ class ZgateEnergyRelaxation(ExpGovernment):
             QD_savior.QD_loader()
 
 
-            nc_paths = ZgateT1_dataReducer(fig_path)
+            if new_file_path is not None and os.path.split(fig_path)[-1].endswith("_ZgateT1"):
+                fig_path = os.path.split(fig_path)[0]  # a summarized file was given
+            raw_writer.flush()  # the appended slices of the last runs
+            nc_paths = ZgateT1_dataReducer(fig_path)  # only folds the files of older runs which aren't in the summarized files yet
+            jobs = []
             for q in nc_paths:
                 if QD_savior.rotate_angle[q][0] != 0:
                     ref = QD_savior.rotate_angle[q]
@@ -2459,38 +2565,35 @@ class ZgateEnergyRelaxation(ExpGovernment):
                     eyeson_print(f"{q} rotation angle is 0, use contrast to analyze.")
                     ref = QD_savior.refIQ[q]
 
-                ds = open_dataset(nc_paths[q])
-                ANA = Multiplex_analyzer("auxA")
-                ANA._import_data(ds,var_dimension=2,refIQ=ref)
-                ANA._start_analysis(time_sort=time_dep_plot)
-                ANA._export_result(nc_paths[q])
-                ds.close()
+                jobs.append(AnalysisJob("auxA", nc_paths[q], 2, {"time_sort":time_dep_plot}, refIQ=ref, pic_save_folder=nc_paths[q], tag=q))
+            run_analysis_jobs(jobs, workers)
             
 
     def WorkFlow(self, histo_counts:int=None):
         idx = 1
         start_time = datetime.now()
-        while True:
-            self.PrepareHardware()
+        with cluster_sessions.hold():
+            while True:
+                self.PrepareHardware()
 
-            self.RunMeasurement()
+                self.RunMeasurement()
 
-            self.CloseMeasurement()  
+                self.CloseMeasurement()  
 
-            slightly_print(f"It's the {idx}-th measurement, about {round((datetime.now() - start_time).total_seconds()/60,1)} mins recorded.")
+                slightly_print(f"It's the {idx}-th measurement, about {round((datetime.now() - start_time).total_seconds()/60,1)} mins recorded.")
             
-            if histo_counts is not None:
-                # ensure the histo_counts you set is truly a number
-                try: 
-                    a = int(histo_counts)/100
-                    self.want_while = True
-                except:
-                    raise TypeError(f"The arg `histo_counts` you set is not a number! We see it's {type(histo_counts)}...")
-                if histo_counts == idx:
+                if histo_counts is not None:
+                    # ensure the histo_counts you set is truly a number
+                    try: 
+                        a = int(histo_counts)/100
+                        self.want_while = True
+                    except:
+                        raise TypeError(f"The arg `histo_counts` you set is not a number! We see it's {type(histo_counts)}...")
+                    if histo_counts == idx:
+                        break
+                idx += 1
+                if not self.want_while:
                     break
-            idx += 1
-            if not self.want_while:
-                break
             
                 
 class QubitMonitor():
@@ -2508,37 +2611,45 @@ class QubitMonitor():
         self.OS_shots:int = 10000
         self.AVG:int = 300
         self.idx = 0
+        self.schedule_cache_folder:str = None # if given, compiled schedules are kept on disk and reused across sessions
 
     def StartMonitoring(self):
         start_time = datetime.now()
+        if self.schedule_cache_folder is not None:
+            schedule_cache.set_persist_folder(self.schedule_cache_folder)
+        self.executor = PipelinedExecutor(cyclic=True)
         pi_num_dict = {}
         if self.T2_time_range is not None:
             for q in self.T2_time_range:
                 pi_num_dict[q] = self.echo_pi_num
-        while True:
-            if self.T1_time_range is not None:
-                if len(list(self.T1_time_range.keys())) != 0:
-                    EXP = EnergyRelaxation(QD_path=self.QD_path,data_folder=self.save_dir)
-                    EXP.SetParameters(self.T1_time_range,self.time_sampling_func,self.time_ptsORstep,1,self.AVG,self.Execution)
-                    EXP.WorkFlow()
-
-            if self.T2_time_range is not None:
-                if len(list(self.T2_time_range.keys())) != 0:
-                    EXP = CPMG(QD_path=self.QD_path,data_folder=self.save_dir)
-                    EXP.SetParameters(self.T2_time_range,pi_num_dict,self.time_sampling_func,self.time_ptsORstep,1,self.AVG,self.Execution)
-                    EXP.WorkFlow(freq_detune_Hz=self.a_little_detune_Hz)
-
-            if self.OS_target_qs is not None:
-                if  self.OS_shots != 0:
-                    if len(self.OS_target_qs) == 0:
-                        self.OS_target_qs = list(set(list(self.T1_time_range.keys())+list(self.T2_time_range.keys())))
-                    EXP = SingleShot(QD_path=self.QD_path,data_folder=self.save_dir)
-                    EXP.SetParameters(self.OS_target_qs,1,self.OS_shots,self.Execution)
-                    EXP.WorkFlow()
-            slightly_print(f"It's the {self.idx}-th measurement, about {round((datetime.now() - start_time).total_seconds()/3600,2)} hrs recorded.")
-            self.idx += 1
-
-    def TimeMonitor_analysis(self,New_QD_path:str=None,New_data_file:str=None,save_all_fit_fig:bool=False):
+        with cluster_sessions.hold():
+            while True:
+                jobs = []
+                if self.T1_time_range is not None:
+                    if len(list(self.T1_time_range.keys())) != 0:
+                        EXP = EnergyRelaxation(QD_path=self.QD_path,data_folder=self.save_dir)
+                        EXP.SetParameters(self.T1_time_range,self.time_sampling_func,self.time_ptsORstep,1,self.AVG,self.Execution)
+                        jobs.append(EXP)
+
+                if self.T2_time_range is not None:
+                    if len(list(self.T2_time_range.keys())) != 0:
+                        EXP = CPMG(QD_path=self.QD_path,data_folder=self.save_dir)
+                        EXP.SetParameters(self.T2_time_range,pi_num_dict,self.time_sampling_func,self.time_ptsORstep,1,self.AVG,self.Execution)
+                        jobs.append((EXP,{"freq_detune_Hz":self.a_little_detune_Hz}))
+
+                if self.OS_target_qs is not None:
+                    if  self.OS_shots != 0:
+                        if len(self.OS_target_qs) == 0:
+                            self.OS_target_qs = list(set(list(self.T1_time_range.keys())+list(self.T2_time_range.keys())))
+                        EXP = SingleShot(QD_path=self.QD_path,data_folder=self.save_dir)
+                        EXP.SetParameters(self.OS_target_qs,1,self.OS_shots,self.Execution)
+                        jobs.append(EXP)
+
+                self.executor.run(jobs)
+                slightly_print(f"It's the {self.idx}-th measurement, about {round((datetime.now() - start_time).total_seconds()/3600,2)} hrs recorded.")
+                self.idx += 1
+
+    def TimeMonitor_analysis(self,New_QD_path:str=None,New_data_file:str=None,save_all_fit_fig:bool=False,workers:int=None):
         if New_QD_path is not None:
             self.QD_path = New_QD_path
         if New_data_file is not None:
@@ -2546,7 +2657,8 @@ class QubitMonitor():
 
         QD_agent = QDmanager(self.QD_path)
         QD_agent.QD_loader()
-        time_monitor_data_ana(QD_agent,self.save_dir,save_all_fit_fig)
+        raw_writer.flush()
+        time_monitor_data_ana(QD_agent,self.save_dir,save_all_fit_fig,workers=workers)
 
 
 class DragCali(ExpGovernment):
@@ -2559,7 +2671,7 @@ class DragCali(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
 
     def SetParameters(self, drag_coef_range:dict, coef_sampling_funct:str, coef_ptsORstep:int=100, avg_n:int=100, execution:bool=True, OSmode:bool=False)->None:
         """ ### Args:
@@ -2602,7 +2714,7 @@ class DragCali(ExpGovernment):
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"DragCali_{datetime.now().strftime('%Y%m%d%H%M%S') if self.JOBID is None else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
                 
             else:
                 self.save_fig_path = None
@@ -2621,7 +2733,7 @@ class DragCali(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -2630,7 +2742,7 @@ class DragCali(ExpGovernment):
             QD_savior = QDmanager(QD_file)
             QD_savior.QD_loader()
 
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             answer = {}
             for var in ds.data_vars:
                 if var.split("_")[-1] != 'dragcoef':
@@ -2678,17 +2790,21 @@ class XGateErrorTest(ExpGovernment):
 
     @property
     def RawDataPath(self):
-        return self.__raw_data_location
+        return raw_writer.ready(self.__raw_data_location)
     
     @RawDataPath.setter
     def RawDataPath(self,path:str):
         self.__raw_data_location = path
 
-    def SetParameters(self, target_qs:list, shots:int=10000, MaxGate_num:int=300, execution:bool=True, use_untrained_wf:bool=False):
+    def SetParameters(self, target_qs:list, shots:int=10000, MaxGate_num:int=300, execution:bool=True, use_untrained_wf:bool=False, thresholded:bool=False, raw_subsample:int=0):
         """ 
         ### Args:\n
         * target_qs: list, like ["q0", "q1", ...]
+        * thresholded: discriminate the shots on the instrument, only the state bits are saved. It needs a stored discriminator, see `DiscriminatorStore`.
+        * raw_subsample: with `thresholded`, also save this many raw-IQ shots with 0 and 1 pi-pulse to refresh the discriminators.
         """
+        self.thresholded = thresholded
+        self.raw_subsample = raw_subsample
         self.use_time_label:bool = False
         self.avg_n = shots
         self.Max_Gate_num = MaxGate_num
@@ -2716,12 +2832,12 @@ class XGateErrorTest(ExpGovernment):
         from qblox_drive_AS.aux_measurement.GateErrorTest import XGateError_single_shot
        
 
-        dataset = XGateError_single_shot(self.QD_agent,self.target_qs,self.Max_Gate_num,self.avg_n,self.use_de4t_wf,self.execution)
+        dataset = XGateError_single_shot(self.QD_agent,self.target_qs,self.Max_Gate_num,self.avg_n,self.use_de4t_wf,self.execution,self.thresholded,self.raw_subsample)
         if self.execution:
             if self.save_dir is not None:
                 self.save_path = os.path.join(self.save_dir,f"XGateErrorTest_{datetime.now().strftime('%Y%m%d%H%M%S') if (self.JOBID is None or self.use_time_label) else self.JOBID}")
                 self.__raw_data_location = self.save_path + ".nc"
-                dataset.to_netcdf(self.__raw_data_location)
+                raw_writer.save_netcdf(dataset, self.__raw_data_location, compact=True)
             else:
                 self.save_fig_path = None
         
@@ -2739,7 +2855,7 @@ class XGateErrorTest(ExpGovernment):
                 QD_file = new_QD_path
 
             if new_file_path is None:
-                file_path = self.__raw_data_location
+                file_path = self.RawDataPath
                 fig_path = self.save_dir
             else:
                 file_path = new_file_path
@@ -2749,9 +2865,9 @@ class XGateErrorTest(ExpGovernment):
             QD_savior.QD_loader()
 
             
-            ds = open_dataset(file_path)
+            ds = open_raw_dataset(file_path)
             answer = {}
-            for var in ds.data_vars:
+            for var in [var for var in ds.data_vars if var.split("_")[-1] != 'rawIQ']:
                 ANA = Multiplex_analyzer("t1")
                 ANA._import_data(ds,var_dimension=0,fq_Hz=QD_savior.quantum_device.get_element(var).clock_freqs.f01())
                 ANA._start_analysis(var_name=var)
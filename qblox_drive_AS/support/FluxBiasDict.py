@@ -1,4 +1,4 @@
-from numpy import array, ndarray, sin, sqrt, cos, pi, real
+from numpy import array, ndarray, sin, sqrt, cos, pi, real, arcsin, clip, where, nan, isnan, around, atleast_1d, errstate
 from qblox_drive_AS.support.UserFriend import *
 
 # TODO: Test this class to store the bias info
@@ -186,29 +186,46 @@ class FluxBiasDict():
         """
         After we fit the tarnsition freq vs bias, we can get the bias according to the given `target_fq_Hz` for the `target_q`.\n
         ### The given `target_fq_Hz` should unit in Hz.\n
-        Return the bias unit in V.
+        Return the bias unit in V, the one closest to 0 V. It's `flux_guard` if that bias is out of ±`flux_guard`, and 'n' if no bias reaches `target_fq_Hz`.
         """
-        import sympy as sp
-        from qblox_drive_AS.support import find_nearest
-        z = sp.Symbol('z',real=True)
-        if self.__bias_dict[target_q]["qubFitParas"] == []:
-            raise ValueError("You have NOT fit the transition frequency with bias!")
-
-        a,b,Ec,Ej_sum,d = self.__bias_dict[target_q]["qubFitParas"][0], self.__bias_dict[target_q]["qubFitParas"][1], self.__bias_dict[target_q]["qubFitParas"][2], self.__bias_dict[target_q]["qubFitParas"][3], self.__bias_dict[target_q]["qubFitParas"][4]
-        to_solve = sp.sqrt(8*Ej_sum*Ec*sp.sqrt(sp.cos(a*(z-b))**2+d**2*sp.sin(a*(z-b))**2))-Ec - target_fq_Hz*1e-9
-
-        candidators = array(sp.solvers.solve(to_solve, z))
-        
-        if candidators.shape[0] == 0:
+        answer = self.get_biasesWithFq_from({target_q:target_fq_Hz}, flux_guard)[target_q][0]
+        if isnan(answer):
             answer = 'n'
             fq_max = self.fqEqn_for_qub(target_q,array([self.get_sweetBiasFor(target_q)]))[0]
             warning_print(f"Can NOT find a bias makes the fq @ {target_fq_Hz*1e-9} GHz !")
             warning_print(f"The max fq about this qubit = {fq_max} GHz")
         else:
-            answer = find_nearest(candidators, 0) if abs(find_nearest(candidators, 0)) < flux_guard else flux_guard
+            answer = float(answer)
 
         return answer
 
+    def get_biasesWithFq_from(self,target_fqs_Hz:dict, flux_guard:float=0.4)->dict:
+        """
+        Batched `get_biasWithFq_from`, inverts `fqEqn_for_qub` in closed form for all the given frequencies.\n
+        ### Args:\n
+        * target_fqs_Hz: {"q0":fq_Hz or array of fq_Hz, ...}\n
+        ### Returns:\n
+        {"q0":array of bias in V, ...}, NaN where no bias reaches the frequency.
+        """
+        biases = {}
+        for target_q in target_fqs_Hz:
+            if len(self.__bias_dict[target_q]["qubFitParas"]) == 0:
+                raise ValueError(f"You have NOT fit the transition frequency with bias for {target_q}!")
+            a,b,Ec,Ej_sum,d = self.__bias_dict[target_q]["qubFitParas"]
+            fq_GHz = atleast_1d(array(target_fqs_Hz[target_q], dtype=float))*1e-9
+            # fq = sqrt(8*Ej_sum*Ec*sqrt(g))-Ec with g = cos(u)**2+d**2*sin(u)**2 = 1+(d**2-1)*sin(u)**2, u = a*(z-b)
+            g = ((fq_GHz+Ec)**2/(8*Ej_sum*Ec))**2
+            with errstate(divide='ignore', invalid='ignore'):
+                sin2 = (g-1)/(d**2-1)
+                u = where((fq_GHz+Ec >= 0)&(sin2 >= 0)&(sin2 <= 1), arcsin(sqrt(clip(sin2,0,1))), nan)
+            # the solutions are b ± u/|a| + k*pi/|a|, take the closest one to 0 V
+            period = pi/abs(a)
+            candidates = array([b+u/abs(a), b-u/abs(a)])
+            candidates = candidates-period*around(candidates/period)
+            answer = where(abs(candidates[0]) <= abs(candidates[1]), candidates[0], candidates[1])
+            biases[target_q] = where(abs(answer) < flux_guard, answer, where(isnan(answer), nan, flux_guard))
+        return biases
+
     def get_proper_zbiasFor(self,target_q:str)->float:
         """
         According to the `offsweetspot_button`, it returns the z-bias for the given target_q.\n
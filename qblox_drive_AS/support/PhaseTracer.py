@@ -0,0 +1,166 @@
+""" Phase timing of the experiment runs, every run leaves one JSON line in `phase_timing.jsonl` next to its raw data. """
+import os, sys, time, json, threading
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from functools import wraps
+from contextlib import contextmanager
+from datetime import datetime
+from qblox_drive_AS.support.UserFriend import *
+
+
+timing_file_name:str = "phase_timing.jsonl"
+
+
+class PhaseTracer():
+    """
+    Accumulate the time spent in the named phases of the run in progress.\n
+    A phase nested in another one is also counted in its parent's inclusive time `s`, while `self_s` excludes the nested phases.
+    The hardware time of a run is the `self_s` of `acquisition` (`CachedScheduleGettable.get` without its build/compile/upload).\n
+    Only the thread which began the run records, the background precompiler doesn't disturb the numbers.
+    """
+    def __init__(self):
+        self.enabled:bool = True
+        self.records:list = []          # finished run records in this python session
+        self.max_records:int = 1000
+        self.__run:dict = None
+        self.__stack:list = []
+        self.__thread:int = None
+
+    @property
+    def running(self)->bool:
+        return self.__run is not None
+
+    def begin_run(self, exp_name:str, kind:str, JOBID:str=None):
+        if not self.enabled:
+            return
+        if self.__run is not None:
+            self.end_run(error="not closed")
+        self.__run = {"exp":exp_name, "kind":kind, "JOBID":JOBID, "start":datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "t0":time.time(), "phases":{}}
+        self.__stack = []
+        self.__thread = threading.get_ident()
+
+    @contextmanager
+    def phase(self, name:str):
+        if self.__run is None or threading.get_ident() != self.__thread:
+            yield
+            return
+        self.__stack.append(0.)  # time spent in the nested phases
+        start = time.time()
+        try:
+            yield
+        finally:
+            spent = time.time()-start
+            nested = self.__stack.pop()
+            if self.__stack:
+                self.__stack[-1] += spent
+            if self.__run is not None:
+                record = self.__run["phases"].setdefault(name, {"s":0., "self_s":0., "n":0})
+                record["s"] += spent
+                record["self_s"] += spent-nested
+                record["n"] += 1
+
+    def end_run(self, raw_data_path:str|list=None, error:str=None)->dict:
+        """ Close the run in progress, its record goes to the folder of `raw_data_path` (every folder if it's a list of files). """
+        if self.__run is None:
+            return None
+        raw_data_paths = [path for path in (raw_data_path if isinstance(raw_data_path, list) else [raw_data_path]) if path]
+        nc_names = [os.path.split(path)[-1] for path in raw_data_paths]
+        run, self.__run = self.__run, None
+        wall = time.time()-run.pop("t0")
+        hardware = run["phases"].get("acquisition", {}).get("self_s", 0.)
+        run.update({"nc":nc_names[0] if len(nc_names) == 1 else (nc_names or None), "wall_s":round(wall, 4), "hardware_s":round(hardware, 4), "duty_cycle":round(hardware/wall, 4) if wall != 0 else 0})
+        for name in run["phases"]:
+            run["phases"][name]["s"] = round(run["phases"][name]["s"], 4)
+            run["phases"][name]["self_s"] = round(run["phases"][name]["self_s"], 4)
+        if error is not None:
+            run["error"] = error
+
+        self.records.append(run)
+        if len(self.records) > self.max_records:
+            self.records.pop(0)
+        for folder in dict.fromkeys(os.path.split(path)[0] for path in raw_data_paths):
+            if not os.path.isdir(folder):
+                continue
+            try:
+                with open(os.path.join(folder, timing_file_name), 'a') as rec:
+                    rec.write(json.dumps(run)+"\n")
+            except OSError as err:
+                warning_print(f"Phase timing can't be written: {err}")
+        if run["kind"] == "measurement":
+            slightly_print(f"{run['exp']} took {round(wall,1)} s, hardware duty cycle = {round(run['duty_cycle']*100,1)} %")
+        return run
+
+    def summary(self, exp_name:str=None)->dict:
+        """ Sum up the phases of the finished runs (of `exp_name` if given): {phase: seconds}, with the total `wall_s`, `hardware_s` and `duty_cycle`. """
+        total = {"wall_s":0., "hardware_s":0.}
+        for run in self.records:
+            if exp_name is not None and run["exp"] != exp_name:
+                continue
+            total["wall_s"] += run["wall_s"]
+            total["hardware_s"] += run["hardware_s"]
+            for name in run["phases"]:
+                total[name] = total.get(name, 0.)+run["phases"][name]["self_s"]
+        total["duty_cycle"] = total["hardware_s"]/total["wall_s"] if total["wall_s"] != 0 else 0
+        return total
+
+
+tracer = PhaseTracer()
+
+
+def traced(phase_name:str):
+    """ Decorator, time the function as the phase `phase_name` of the run in progress. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.phase(phase_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_step(func, step_name:str):
+    """ Wrap an `ExpGovernment` step, `PrepareHardware` opens a measurement run and `CloseMeasurement` closes it, `RunAnalysis` is a run by itself. """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if step_name == "PrepareHardware":
+            tracer.begin_run(type(self).__name__, "measurement", getattr(self, "JOBID", None))
+        elif step_name == "RunAnalysis":
+            tracer.begin_run(type(self).__name__, "analysis", getattr(self, "JOBID", None))
+        try:
+            with tracer.phase(step_name):
+                result = func(self, *args, **kwargs)
+        except BaseException as err:
+            tracer.end_run(_raw_data_path(self, kwargs), error=repr(err))
+            raise
+        if step_name in ["CloseMeasurement", "RunAnalysis"]:
+            tracer.end_run(_raw_data_path(self, kwargs))
+        return result
+    return wrapper
+
+
+def _raw_data_path(exp, kwargs:dict)->str|list:
+    from qblox_drive_AS.support.AsyncWriter import raw_writer
+    if kwargs.get("new_file_path"):
+        return kwargs["new_file_path"]
+    try:
+        with raw_writer.no_wait():  # only the folder is needed, the save can go on
+            return exp.RawDataPaths if hasattr(type(exp), "RawDataPaths") else exp.RawDataPath
+    except AttributeError:
+        return None
+
+
+_installed:bool = False
+def install_tracing():
+    """
+    Opt-in, time `meas_ctrl.run` and `Dataset.to_netcdf` as phases too. They're patched for the whole python session (also for the code
+    which isn't an experiment), so call it only in the sessions you profile. The schedule build/compile/upload and the acquisition
+    are always timed by `CachedScheduleGettable`.
+    """
+    global _installed
+    if _installed:
+        return
+    from xarray import Dataset
+    from quantify_core.measurement.control import MeasurementControl
+    for cls, method_name, phase_name in [(MeasurementControl, "run", "meas_ctrl.run"), (Dataset, "to_netcdf", "to_netcdf")]:
+        if hasattr(cls, method_name):
+            setattr(cls, method_name, traced(phase_name)(getattr(cls, method_name)))
+    _installed = True
@@ -6,13 +6,12 @@ from matplotlib.patches import Ellipse
 import numpy as np
 import xarray as xr
 from scipy import special
-from scipy.integrate import quad
 from scipy.signal import butter,sosfiltfilt
 from lmfit import Model,Parameter 
 from quantify_scheduler.enums import BinMode
 from quantify_scheduler.backends.graph_compilation import SerialCompiler
 from quantify_scheduler.schedules.schedule import Schedule
-from quantify_scheduler.operations.acquisition_library import SSBIntegrationComplex,Trace
+from quantify_scheduler.operations.acquisition_library import SSBIntegrationComplex,Trace,ThresholdedAcquisition
 from quantify_scheduler.operations.pulse_library import (IdlePulse,SetClockFrequency,SquarePulse,DRAGPulse,GaussPulse,SoftSquarePulse,NumericalPulse)
 from quantify_scheduler.device_under_test.quantum_device import QuantumDevice
 from quantify_scheduler.operations.gate_library import Reset, Measure
@@ -112,6 +111,63 @@ Loren_func_model = Model(Loren_func)
 gauss2d_func_model = Model(gauss2d_func, independent_vars=['I', 'Q'])
 bigauss2d_func_model = Model(bigauss2d_func, independent_vars=['I', 'Q'])
 
+class FitResult():
+    """
+    Result of the `*_fit_analysis` helpers, keeps the best values, the covariance and the attrs. The dense fitting curve is made only when it's asked.\n
+    `to_dataset()` gives the former xr.Dataset (made once), the Dataset attributes like `coords`, `data_vars` and `["fitting"]` also work on it for the plots.\n
+    #### Args:\n
+    * data, x: the fitted data and its x samples, `x_name` is the dim name of x in the Dataset, like 'freeDu'.\n
+    * model: callable(x, *paras), the fitted function.\n
+    * best_values: dict, the fitted parameters in the order of `model`.\n
+    * covar: the covariance matrix from lmfit, None if it's not estimated.\n
+    * attrs: the attrs of the Dataset, like {"exper":"T1", "T1_fit":20e-6}.
+    """
+    oversampling:int = 50
+    def __init__(self, data:np.ndarray, x:np.ndarray, x_name:str, model:callable, best_values:dict, covar:np.ndarray, attrs:dict):
+        self.data = data
+        self.x = x
+        self.x_name:str = x_name
+        self.model:callable = model
+        self.best_values:dict = dict(best_values)
+        self.covar = covar
+        self.attrs:dict = attrs
+        self._para_fit:np.ndarray = None
+        self._fitting:np.ndarray = None
+        self._dataset:xr.Dataset = None
+
+    @property
+    def paras(self)->list:
+        return list(self.best_values.values())
+
+    @property
+    def para_fit(self)->np.ndarray:
+        """ The dense x of `fitting`, `oversampling` points per data point. """
+        if self._para_fit is None:
+            self._para_fit = np.linspace(self.x.min(),self.x.max(),self.oversampling*len(self.data))
+        return self._para_fit
+
+    @property
+    def fitting(self)->np.ndarray:
+        """ The model on `para_fit` with the best values. """
+        if self._fitting is None:
+            self._fitting = self.model(self.para_fit,*self.paras)
+        return self._fitting
+
+    def to_dataset(self)->xr.Dataset:
+        if self._dataset is None:
+            self._dataset = xr.Dataset(data_vars=dict(data=([self.x_name],self.data),fitting=(['para_fit'],self.fitting)),coords={self.x_name:([self.x_name],self.x),"para_fit":(['para_fit'],self.para_fit)},attrs=self.attrs)
+        return self._dataset
+
+    def __getattr__(self, name:str):
+        # only called for the names not found, which are the Dataset ones
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.to_dataset(), name)
+
+    def __getitem__(self, key):
+        return self.to_dataset()[key]
+
+
 def cos_fit_analysis(data:np.ndarray,freeDu:np.ndarray):
     f_guess,phase_guess= fft_oscillation_guess(data,freeDu)
     f_guess_=Parameter(name='f', value=f_guess , min=0, max=f_guess*10)
@@ -121,11 +177,8 @@ def cos_fit_analysis(data:np.ndarray,freeDu:np.ndarray):
     f_fit= result.best_values['f']
     phase_fit= result.best_values['phase']
     offset_fit= result.best_values['offset']
-    para_fit= np.linspace(freeDu.min(),freeDu.max(),50*len(data))
-
-    fitting= Cosine_func(para_fit,A_fit,f_fit,phase_fit,offset_fit)
     paras = [A_fit,f_fit,phase_fit,offset_fit]
-    return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],freeDu),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="xyfcali",f=f_fit,phase=phase_fit,coefs=paras))
+    return FitResult(data,freeDu,'freeDu',Cosine_func,result.best_values,result.covar,attrs=dict(exper="xyfcali",f=f_fit,phase=phase_fit,coefs=paras))
 
 
 
@@ -134,16 +187,13 @@ def T1_fit_analysis(data:np.ndarray,freeDu:np.ndarray,T1_guess:float=10*1e-6,ret
     a_guess = np.max(data)-offset_guess if data[-1] > offset_guess else np.min(data)-offset_guess
     result = T1_func_model.fit(data,D=freeDu,A=np.max(data)-offset_guess,T1=T1_guess,offset=offset_guess)
     
-    A_fit= result.best_values['A']
     T1_fit= result.best_values['T1']
-    offset_fit= result.best_values['offset']
-    para_fit= np.linspace(freeDu.min(),freeDu.max(),50*len(data))
-    fitting= T1_func(para_fit,A_fit,T1_fit,offset_fit)
+    fit_result = FitResult(data,freeDu,'freeDu',T1_func,result.best_values,result.covar,attrs=dict(exper="T1",T1_fit=T1_fit))
     if not return_error:
-        return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],freeDu),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="T1",T1_fit=T1_fit))
+        return fit_result
     else:
         fit_error = float(result.covar[1][1])*1e6
-        return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],freeDu),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="T1",T1_fit=T1_fit)), fit_error
+        return fit_result, fit_error
 def T2_fit_analysis(data:np.ndarray,freeDu:np.ndarray,return_error:bool=False):
     T2_guess = mean(freeDu)
     f_guess,phase_guess= fft_oscillation_guess(data,freeDu)
@@ -153,18 +203,15 @@ def T2_fit_analysis(data:np.ndarray,freeDu:np.ndarray,return_error:bool=False):
     result = Ramsey_func_model.fit(data,D=freeDu,A=abs(min(data)+max(data))/2,T2=T2,f=f_guess_,phase=phase_guess, offset=np.mean(data))
     if return_error:
         fit_error = float(result.covar[1][1])*1e6
-    A_fit= result.best_values['A']
     f_fit= result.best_values['f']
     phase_fit= result.best_values['phase']
     
     T2_fit= result.best_values['T2']
-    offset_fit= result.best_values['offset']
-    para_fit= np.linspace(freeDu.min(),freeDu.max(),50*len(data))
-    fitting= Ramsey_func(para_fit,A_fit,T2_fit,f_fit,phase_fit,offset_fit)
+    fit_result = FitResult(data,freeDu,'freeDu',Ramsey_func,result.best_values,result.covar,attrs=dict(exper="T2",T2_fit=T2_fit,f=f_fit,phase=phase_fit))
     if not return_error:
-        return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],freeDu),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="T2",T2_fit=T2_fit,f=f_fit,phase=phase_fit))
+        return fit_result
     else:
-        return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],freeDu),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="T2",T2_fit=T2_fit,f=f_fit,phase=phase_fit)), fit_error
+        return fit_result, fit_error
 
 def gate_phase_fit_analysis(data:np.ndarray,gate_num:np.ndarray):
     f_guess,phase_guess= fft_oscillation_guess(data,gate_num)
@@ -174,16 +221,11 @@ def gate_phase_fit_analysis(data:np.ndarray,gate_num:np.ndarray):
     f_guess_=Parameter(name='f', value=f_guess , min=0, max=up_lim_f)
     result = Ramsey_func_model.fit(data,D=gate_num,A=abs(min(data)+max(data))/2,T2=T2,f=f_guess_,phase=phase_guess, offset=np.mean(data))
     
-    A_fit= result.best_values['A']
     f_fit= result.best_values['f']
     phase_fit= result.best_values['phase']
     
     T2_fit= result.best_values['T2']
-    offset_fit= result.best_values['offset']
-    para_fit= np.linspace(gate_num.min(),gate_num.max(),50*len(data))
-    fitting= Ramsey_func(para_fit,A_fit,T2_fit,f_fit,phase_fit,offset_fit)
-    
-    return xr.Dataset(data_vars=dict(data=(['freeDu'],data),fitting=(['para_fit'],fitting)),coords=dict(freeDu=(['freeDu'],gate_num),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="T2",T2_fit=T2_fit,f=f_fit,phase=phase_fit))
+    return FitResult(data,gate_num,'freeDu',Ramsey_func,result.best_values,result.covar,attrs=dict(exper="T2",T2_fit=T2_fit,f=f_fit,phase=phase_fit))
 
 
 
@@ -199,22 +241,14 @@ def QS_fit_analysis(data:np.ndarray,f:np.ndarray):
     result = Loren_func_model.fit(data,x=f,x0= f[np.argmax(data)],gamma=width_guess,A=A,base=np.mean(data))
     f01_fit= result.best_values['x0']
     bw= result.best_values['gamma']
-    A_fit= result.best_values['A']
-    base_fit= result.best_values['base']
-    para_fit= np.linspace(fmin,fmax,50*len(data))
-    fitting= Loren_func(para_fit,f01_fit,bw,A_fit,base_fit)
-    return xr.Dataset(data_vars=dict(data=(['f'],data),fitting=(['para_fit'],fitting)),coords=dict(f=(['f'],f),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="QS",f01_fit=f01_fit,bandwidth=bw))
+    return FitResult(data,f,'f',Loren_func,result.best_values,result.covar,attrs=dict(exper="QS",f01_fit=f01_fit,bandwidth=bw))
 
 def Rabi_fit_analysis(data:np.ndarray,samples:np.ndarray, Rabi_type:str):
     f_guess,phase_guess= fft_oscillation_guess(data,samples)
     result = Rabi_model.fit(data,x=samples,A=abs(min(data)+max(data))/2,f=f_guess, offset=np.mean(data))
-    A_fit= result.best_values['A'] 
     f_fit= result.best_values['f']
-    offset_fit= result.best_values['offset']
     pi_2= 1/(2*f_fit)
-    para_fit= np.linspace(samples.min(),samples.max(),50*len(data))
-    fitting= Rabi_func(para_fit,A_fit,f_fit,offset_fit)
-    return xr.Dataset(data_vars=dict(data=(['samples'],data),fitting=(['para_fit'],fitting)),coords=dict(samples=(['samples'],samples),para_fit=(['para_fit'],para_fit)),attrs=dict(exper="Rabi",Rabi_type=Rabi_type,pi_2=pi_2))
+    return FitResult(data,samples,'samples',Rabi_func,result.best_values,result.covar,attrs=dict(exper="Rabi",Rabi_type=Rabi_type,pi_2=pi_2))
 
 def Single_shot_ref_fit_analysis(data:tuple):
     I,Q= np.array(data[0]),np.array(data[1]) 
@@ -237,86 +271,83 @@ def Single_shot_ref_fit_analysis(data:tuple):
     #print ('Total prob. =',np.sum(hist)*((max(xedges)-min(xedges))/bins*(max(yedges)-min(yedges))/bins))
     return dict(data=[I,Q],data_hist=hist,coords=[X,Y],fitting=fitting,fit_pack=fit_pack)
 
+def two_gaussian_EM(g_IQ:np.ndarray, e_IQ:np.ndarray, max_iter:int=300, tol:float=1e-10, init:dict=None, fixed_gaussians:bool=False)->dict:
+    """
+    EM fit of two isotropic 2D Gaussians with a shared sigma on the raw shots of both preparations.
+    The centers and sigma are shared by the g- and e-prepared shots, each preparation has its own mixing weight.\n
+    #### Args:\n
+    * g_IQ, e_IQ: (2, shots) I/Q of the shots prepared in |g> and |e>.\n
+    * init: {"cg", "ce", "sigma"} to start from, like a former result. Default starts from the medians of the shots.\n
+    * fixed_gaussians: only the weights are fitted, the Gaussians stay as `init`.\n
+    #### Returns:\n
+    {"cg":[I,Q], "ce":[I,Q], "sigma", "Thermal": |e> weight in the g-prepared shots, "Relax_frac": |g> weight in the e-prepared shots, "iterations"}
+    """
+    g_IQ, e_IQ = np.asarray(g_IQ, dtype=float).T, np.asarray(e_IQ, dtype=float).T
+    shots = np.vstack([g_IQ, e_IQ])
+    is_g_prep = np.arange(shots.shape[0]) < g_IQ.shape[0]
+    if init is None:
+        cg, ce = np.median(g_IQ, axis=0), np.median(e_IQ, axis=0)
+        var = np.mean(np.var(g_IQ, axis=0))
+    else:
+        cg, ce, var = np.asarray(init['cg'], dtype=float), np.asarray(init['ce'], dtype=float), float(init['sigma'])**2
+    w_e = np.where(is_g_prep, 0.05, 0.9)   # prior of being |e>, per shot
+    last_ll = -np.inf
+    for iteration in range(max_iter):
+        # E-step, the probability of each shot to be |e>
+        d2_g = np.sum((shots-cg)**2, axis=1)
+        d2_e = np.sum((shots-ce)**2, axis=1)
+        logit = np.log(w_e)-np.log1p(-w_e)+(d2_g-d2_e)/(2*var)
+        r_e = special.expit(logit)
+        ll = np.sum(np.logaddexp(np.log1p(-w_e)-d2_g/(2*var), np.log(w_e)-d2_e/(2*var)))-shots.shape[0]*np.log(2*np.pi*var)
+        # M-step
+        if not fixed_gaussians:
+            cg = np.sum((1-r_e)[:,None]*shots, axis=0)/np.sum(1-r_e)
+            ce = np.sum(r_e[:,None]*shots, axis=0)/np.sum(r_e)
+            var = (np.sum((1-r_e)*np.sum((shots-cg)**2, axis=1))+np.sum(r_e*np.sum((shots-ce)**2, axis=1)))/(2*shots.shape[0])
+        thermal, relax_frac = np.mean(r_e[is_g_prep]), 1-np.mean(r_e[~is_g_prep])
+        w_e = np.clip(np.where(is_g_prep, thermal, 1-relax_frac), 1e-9, 1-1e-9)
+        if abs(ll-last_ll) <= tol*abs(ll):
+            break
+        last_ll = ll
+    return dict(cg=cg, ce=ce, sigma=np.sqrt(var), Thermal=thermal, Relax_frac=relax_frac, iterations=iteration+1)
+
 def Qubit_state_single_shot_fit_analysis(data:dict, T1:float,tau:float):
+    """
+    Discriminate the single shots by `two_gaussian_EM` on the raw I/Q, the overlaps are the closed-form erf of the fitted Gaussians.\n
+    Returns the same `fit_pack` and `error_pack` as the former histogram fitting.
+    """
     Ig_data,Qg_data,Ie_data,Qe_data= np.array(data['g'][0]), np.array(data['g'][1]) ,np.array(data['e'][0]), np.array(data['e'][1]) 
     bins=401
-    g_predict= Single_shot_ref_fit_analysis(data['g'])['fit_pack']
-    Ig_guess, Qg_guess, sig_guess= g_predict[0],g_predict[1],g_predict[2]
-    I_mixdata, Q_mixdata= np.hstack([Ig_data,Ie_data]), np.hstack([Qg_data,Qe_data])
-    I_=np.linspace(I_mixdata.min(),I_mixdata.max(),bins)  
-    Q_=np.linspace(Q_mixdata.min(),Q_mixdata.max(),bins)
-    X,Y= np.meshgrid(I_,Q_)
-    hist_Ie, edges_Ie= np.histogram(Ie_data, bins=bins, density=True)
-    hist_Qe, edges_Qe= np.histogram(Qe_data, bins=bins, density=True)
-    hist, xedges, yedges = np.histogram2d(I_mixdata, Q_mixdata, bins=(bins,bins), density=True)
-    Ie_guess_idx, Qe_guess_idx=find_nearest(hist_Ie,np.max(hist_Ie)),find_nearest(hist_Qe,np.max(hist_Qe))
-    Ie_guess, Qe_guess= edges_Ie[Ie_guess_idx],edges_Qe[Qe_guess_idx]
-    #Parameter ini-guess
-    cg_I=Parameter(name='cg_I', value= Ig_guess, min=0.9*Ig_guess, max=1.5*Ig_guess) 
-    cg_Q=Parameter(name='cg_Q', value= Qg_guess, min=0.9*Qg_guess, max=1.5*Qg_guess)
-    ce_I=Parameter(name='ce_I', value= Ie_guess, min=0.3*Ie_guess, max=3*Ie_guess) 
-    ce_Q=Parameter(name='ce_Q', value= Qe_guess, min=0.3*Qe_guess, max=3*Qe_guess)
-    sigma=Parameter(name='sigma', value= sig_guess, min=0.1*sig_guess, max=3*sig_guess)
-    Ag=Parameter(name='Ag',value=np.max(hist), min=0.1*np.max(hist)) 
-    Ae=Parameter(name='Ae',value=np.max(hist), min=0.1*np.max(hist)) 
-    # mixed data fit
-    result= bigauss2d_func_model.fit(hist.transpose(),I=X,Q=Y,cg_I=cg_I,cg_Q=cg_Q,sigma=sigma,Ag=Ag,ce_I=ce_I,ce_Q=ce_Q,Ae=Ae)
-    cg_I_fit=result.best_values['cg_I']
-    cg_Q_fit=result.best_values['cg_Q']
-    ce_I_fit=result.best_values['ce_I']
-    ce_Q_fit=result.best_values['ce_Q']
-    sigma_fit=result.best_values['sigma']
+    EM= two_gaussian_EM([Ig_data,Qg_data],[Ie_data,Qe_data])
+    cg_I_fit, cg_Q_fit= EM['cg']
+    ce_I_fit, ce_Q_fit= EM['ce']
+    sigma_fit= EM['sigma']
     # displace + rotate
     angle= np.angle(ce_I_fit-cg_I_fit+(ce_Q_fit-cg_Q_fit)*1j)
     rot_e_center= rot(ce_I_fit-cg_I_fit,ce_Q_fit-cg_Q_fit,angle)
     rot_g_IQ= rot(Ig_data-cg_I_fit,Qg_data-cg_Q_fit,angle)
     rot_e_IQ= rot(Ie_data-cg_I_fit,Qe_data-cg_Q_fit,angle)
-    Ig_data_new, Qg_data_new, Ie_data_new, Qe_data_new= rot_g_IQ[0],rot_g_IQ[1],rot_e_IQ[0],rot_e_IQ[1]
-    # along single quadrature fit
+    # projected PDFs along the g-e axis, only for plotting
     R= 10*sigma_fit #range_factor
     xmin, xmax = np.minimum(0,rot_e_center[0])-R,np.maximum(0,rot_e_center[0])+R
-    ymin, ymax = np.minimum(0,rot_e_center[1])-R,np.maximum(0,rot_e_center[1])+R
-    hist_r_g, xedges, yedges = np.histogram2d(Ig_data_new, Qg_data_new, bins=(bins,bins),range=[[xmin, xmax], [ymin, ymax]], density=True)
-    hist_r_e, xedges, yedges = np.histogram2d(Ie_data_new, Qe_data_new, bins=(bins,bins),range=[[xmin, xmax], [ymin, ymax]], density=True)
-    New_axe_g_hist= np.sum(hist_r_g.transpose(), axis=0)
-    New_axe_e_hist= np.sum(hist_r_e.transpose(), axis=0)
+    New_axe_g_hist, _= np.histogram(rot_g_IQ[0], bins=bins, range=(xmin, xmax), density=True)
+    New_axe_e_hist, _= np.histogram(rot_e_IQ[0], bins=bins, range=(xmin, xmax), density=True)
     I_ro = np.linspace(xmin, xmax,bins)
     I_fit= np.linspace(xmin, xmax,bins*5)
-    def Reduced_bimodal_func(x,Ag,Ae):
-        return gauss_func(x,0,sigma_fit,Ag)+gauss_func(x,rot_e_center[0],sigma_fit,Ae)
-    bimodal_func_model = Model(Reduced_bimodal_func)
-    result_g= bimodal_func_model.fit(New_axe_g_hist,x=I_ro,Ag=Parameter(name='Ag',value=np.max(New_axe_g_hist), min=0.5*np.max(New_axe_g_hist)) ,Ae=Parameter(name='Ae',value=0.01*np.max(New_axe_g_hist), min=0))
-    result_e= bimodal_func_model.fit(New_axe_e_hist,x=I_ro,Ag=Parameter(name='Ag',value=0.01*np.max(New_axe_e_hist), min=0),Ae=Parameter(name='Ae',value=np.max(New_axe_e_hist), min=0.5*np.max(New_axe_e_hist)))
-    Agg_fit=result_g.best_values['Ag']
-    Aeg_fit=result_g.best_values['Ae']
-    Age_fit=result_e.best_values['Ag']
-    Aee_fit=result_e.best_values['Ae']
-    inter_point = rot_e_center[0]/2
-    def G_gg(I):
-        return Agg_fit*np.exp(-I**2/(2*sigma_fit**2))
-    def G_eg(I):
-        return Aeg_fit*np.exp(-(I-rot_e_center[0])**2/(2*sigma_fit**2))
-    def G_ge(I):
-        return Age_fit*np.exp(-I**2/(2*sigma_fit**2))
-    def G_ee(I):
-        return Aee_fit*np.exp(-(I-rot_e_center[0])**2/(2*sigma_fit**2))
-    Ggg= quad(G_gg,-np.inf,np.inf)
-    Geg= quad(G_eg,-np.inf,np.inf)
-    Gge= quad(G_ge,-np.inf,np.inf)
-    Gee= quad(G_ee,-np.inf,np.inf)
-    overlap_gg= quad(G_gg,inter_point,np.inf)
-    transi_eg= quad(G_eg,inter_point,np.inf)
-    transi_ge= quad(G_ge,-np.inf,inter_point)
-    overlap_ee= quad(G_ee,-np.inf,inter_point)
-    overlap= ((overlap_gg[0]-overlap_gg[1])/(Ggg[0]-Ggg[1])+(overlap_ee[0]-overlap_ee[1])/(Gee[0]-Gee[1]))/2
-    Peg= (transi_eg[0]-transi_eg[1])/(Ggg[0]-Ggg[1]+Geg[0]-Geg[1])+(overlap_gg[0]-overlap_gg[1])/(Ggg[0]-Ggg[1])
-    Pge= (transi_ge[0]-transi_ge[1])/(Gee[0]-Gee[1]+Gge[0]-Gge[1])+(overlap_ee[0]-overlap_ee[1])/(Gee[0]-Gee[1])
-    Thermal= (Geg[0]-Geg[1])/(Geg[0]-Geg[1]+Ggg[0]-Ggg[1])
-    Relax= (Gge[0]-Gge[1])/(Gee[0]-Gee[1]+Gge[0]-Gge[1])-Thermal
-    Relax_predict= Relax_cal(0,tau,T1)
-    Pre_decay= Relax-Relax_predict
+    Thermal= EM['Thermal']
+    Relax_frac= EM['Relax_frac']
+    norm= 1/(np.sqrt(2*np.pi)*sigma_fit)
+    Agg_fit, Aeg_fit= (1-Thermal)*norm, Thermal*norm
+    Age_fit, Aee_fit= Relax_frac*norm, (1-Relax_frac)*norm
+    # the threshold is in the middle, a Gaussian crosses it with the probability erfc(D/2/(sqrt(2)*sigma))/2
     D= rot_e_center[0]
     SNR= D/sigma_fit
+    overlap= (1/2)*special.erfc(D/(2*np.sqrt(2)*sigma_fit))
+    Peg= Thermal*(1-overlap)+overlap
+    Pge= Relax_frac*(1-overlap)+overlap
+    Relax= Relax_frac-Thermal
+    Relax_predict= Relax_cal(0,tau,T1)
+    Pre_decay= Relax-Relax_predict
     overlap_predict= (1/2)*(1-special.erf(np.sqrt(SNR**2/8)))
     F_s= 1-overlap
     F_g= 1-Peg
@@ -416,6 +447,16 @@ def Readout(sche,q,R_amp,R_duration,powerDep=False):
     # return sche.add(NumericalPulse(samples=env_sample,t_samples=tim_sample,port="q:res",clock=q+".ro",t0=0e-9),)
     return sche.add(SquarePulse(duration=Du,amp=amp,port="q:res",clock=q+".ro",t0=4e-9))
 
+def fold_outer_axis(outer_values:any, inner_pts:int)->list:
+    """ A batched outer settable arrives as the flatten 2D setpoints (inner axis runs fastest), return its samples. A scalar is one outer point. """
+    if np.ndim(outer_values) == 0:
+        return [outer_values]
+    return list(np.asarray(outer_values)[::inner_pts])
+
+def Multi_Reset(sche,qubits:list):
+    """ One multiplexed reset for all the `qubits` in a sweep point, it replaces the per-qubit `Reset(q)` to keep the operation count of a point small. """
+    return sche.add(Reset(*qubits))
+
 def Multi_Readout(sche,q,ref_pulse_sche,R_amp,R_duration,powerDep=False,):
     if powerDep is True:
         amp= R_amp
@@ -456,6 +497,20 @@ def Integration(sche,q,R_inte_delay:float,R_inte_duration,ref_pulse_sche,acq_ind
                 ),rel_time=R_inte_delay
                 ,ref_op=ref_pulse_sche,ref_pt="start")
     
+def Thresholded_Integration(sche,q,R_inte_delay:float,R_inte_duration,ref_pulse_sche,acq_index,acq_threshold:tuple,acq_channel:int=0):
+    """ Single-shot integration discriminated on the instrument, each shot returns the state bit. `acq_threshold` is (rotation in degree, threshold in V). """
+    return sche.add(ThresholdedAcquisition(
+            duration=R_inte_duration[q],
+            port="q:res",
+            clock=q+".ro",
+            acq_index=acq_index,
+            acq_channel=acq_channel,
+            bin_mode=BinMode.APPEND,
+            acq_rotation=acq_threshold[0],
+            acq_threshold=acq_threshold[1],
+            ),rel_time=R_inte_delay
+            ,ref_op=ref_pulse_sche,ref_pt="start")
+
 def pulse_preview(quantum_device:QuantumDevice,sche_func:Schedule, sche_kwargs:dict, **kwargs):
     import plotly.io as pio
     pio.renderers.default='browser'
@@ -506,33 +561,40 @@ def One_tone_multi_sche(
     bias_dura:float=0,
     repetitions:int=1,    
 ) -> Schedule:
-    
+    """ If the outer settable (`R_amp` when powerDep, otherwise `bias`) is batched, all the outer points are swept inside this schedule with acq_index = outer_idx*freq_pts+freq_idx. """
     qubits2read = list(frequencies.keys())
     sameple_idx = array(frequencies[qubits2read[0]]).shape[0]
     sched = Schedule("One tone multi-spectroscopy (NCO sweep)",repetitions=repetitions)
 
+    if powerDep:
+        outer_amps = fold_outer_axis(R_amp,sameple_idx)
+        outer_bias = [bias]*len(outer_amps)
+    else:
+        outer_bias = fold_outer_axis(bias,sameple_idx)
+        outer_amps = [R_amp]*len(outer_bias)
+
+    for outer_idx, (amp, z) in enumerate(zip(outer_amps,outer_bias)):
+        for freq_idx in range(sameple_idx):    
+            acq_idx = outer_idx*sameple_idx+freq_idx
+            Multi_Reset(sched,qubits2read)
+            for qubit_idx, q in enumerate(qubits2read):
+                freq = frequencies[q][freq_idx]
+                if acq_idx == 0:
+                    sched.add_resource(ClockResource(name=q+ ".ro", freq=array(frequencies[q]).flat[0]))
+                
+                sched.add(SetClockFrequency(clock=q+ ".ro", clock_freq_new=freq))
+                sched.add(IdlePulse(duration=4e-9), label=f"buffer {qubit_idx} {acq_idx}")
 
-    for acq_idx in range(sameple_idx):    
-
-        for qubit_idx, q in enumerate(qubits2read):
-            freq = frequencies[q][acq_idx]
-            if acq_idx == 0:
-                sched.add_resource(ClockResource(name=q+ ".ro", freq=array(frequencies[q]).flat[0]))
-            
-            sched.add(Reset(q))
-            sched.add(SetClockFrequency(clock=q+ ".ro", clock_freq_new=freq))
-            sched.add(IdlePulse(duration=4e-9), label=f"buffer {qubit_idx} {acq_idx}")
-
-            
-            if qubit_idx == 0:
-                spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=powerDep)
-            else:
-                Multi_Readout(sched,q,spec_pulse,R_amp,R_duration,powerDep=powerDep)
-            
-            if bias != 0 and bias_dura != 0: 
-                Z(sched,bias,bias_dura,q,spec_pulse,0,ref_position='end')
+                
+                if qubit_idx == 0:
+                    spec_pulse = Readout(sched,q,amp,R_duration,powerDep=powerDep)
+                else:
+                    Multi_Readout(sched,q,spec_pulse,amp,R_duration,powerDep=powerDep)
+                
+                if z != 0 and bias_dura != 0: 
+                    Z(sched,z,bias_dura,q,spec_pulse,0,ref_position='end')
 
-            Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_channel=qubit_idx,single_shot=False,get_trace=False,trace_recordlength=0)
+                Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_channel=qubit_idx,single_shot=False,get_trace=False,trace_recordlength=0)
           
     return sched
 
@@ -556,12 +618,12 @@ def RabiSplitting_multi_sche(
 
     for acq_idx in range(sameple_idx):    
 
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             freq = frequencies[q][acq_idx]
             if acq_idx == 0:
                 sched.add_resource(ClockResource(name=q+ ".ro", freq=array(frequencies[q]).flat[0]))
             
-            sched.add(Reset(q))
             sched.add(SetClockFrequency(clock=q+ ".ro", clock_freq_new=freq))
             sched.add(IdlePulse(duration=4e-9), label=f"buffer {qubit_idx} {acq_idx}")
 
@@ -622,13 +684,13 @@ def multi_Two_tone_sche(
     sameple_idx = array(frequencies[qubits2read[0]]).shape[0]
 
     for acq_idx in range(sameple_idx):    
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             freq = frequencies[q][acq_idx]
             if acq_idx == 0:
                 sched.add_resource(ClockResource(name=q+ ".01", freq=array(frequencies[q]).flat[0]))
         
             sched.add(SetClockFrequency(clock= q+".01", clock_freq_new=freq))
-            sched.add(Reset(q))
             if qubit_idx == 0:
                 spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
             else:
@@ -684,31 +746,33 @@ def multi_Z_gate_two_tone_sche(
     R_inte_delay:dict,
     repetitions:int=1,     
 ) -> Schedule:
-    
+    """ If `Z_amp` is batched, all the z points are swept inside this schedule with acq_index = z_idx*freq_pts+freq_idx. """
     sched = Schedule("Zgate_two_tone spectroscopy (NCO sweep)",repetitions=repetitions)
 
     qubits2read = list(frequencies.keys())
     sameple_idx = array(frequencies[qubits2read[0]]).shape[0]
 
-    for acq_idx in range(sameple_idx):    
-        for qubit_idx, q in enumerate(qubits2read):
-            freq = frequencies[q][acq_idx]
-            if acq_idx == 0:
-                sched.add_resource(ClockResource(name=q+".01", freq=array(frequencies[q]).flat[0]))
-   
-            sched.add(SetClockFrequency(clock= q+ ".01", clock_freq_new=freq))
-            sched.add(Reset(q))
-            
-            if qubit_idx == 0:
-                spec_pulse = Readout(sched,q,R_amp,R_duration)
-                for qb in bias_qs:
-                    Z(sched,Z_amp,spec_Du,qb,spec_pulse,electrical_delay)
-            else:
-                Multi_Readout(sched,q,spec_pulse,R_amp,R_duration)
-            
-            Spec_pulse(sched,spec_amp,spec_Du,q,spec_pulse,electrical_delay)
+    for z_idx, z in enumerate(fold_outer_axis(Z_amp,sameple_idx)):
+        for freq_idx in range(sameple_idx):    
+            acq_idx = z_idx*sameple_idx+freq_idx
+            Multi_Reset(sched,qubits2read)
+            for qubit_idx, q in enumerate(qubits2read):
+                freq = frequencies[q][freq_idx]
+                if acq_idx == 0:
+                    sched.add_resource(ClockResource(name=q+".01", freq=array(frequencies[q]).flat[0]))
+       
+                sched.add(SetClockFrequency(clock= q+ ".01", clock_freq_new=freq))
+                
+                if qubit_idx == 0:
+                    spec_pulse = Readout(sched,q,R_amp,R_duration)
+                    for qb in bias_qs:
+                        Z(sched,z,spec_Du,qb,spec_pulse,electrical_delay)
+                else:
+                    Multi_Readout(sched,q,spec_pulse,R_amp,R_duration)
+                
+                Spec_pulse(sched,spec_amp,spec_Du,q,spec_pulse,electrical_delay)
 
-            Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_idx,acq_channel=qubit_idx,single_shot=False,get_trace=False,trace_recordlength=0)
+                Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_idx,acq_channel=qubit_idx,single_shot=False,get_trace=False,trace_recordlength=0)
      
     return sched
 
@@ -815,8 +879,8 @@ def multi_PowerRabi_sche(
 
     
     for acq_idx in range(sample_len):    
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
-            sched.add(Reset(q))
             if qubit_idx == 0:
                 spec_pulse = Readout(sched,q,R_amp,R_duration)
             else:
@@ -854,8 +918,8 @@ def multi_TimeRabi_sche(
 
     
     for acq_idx in range(sample_len):    
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
-            sched.add(Reset(q))
             if qubit_idx == 0:
                 spec_pulse = Readout(sched,q,R_amp,R_duration)
             else:
@@ -1018,9 +1082,9 @@ def multi_T1_sche(
     sched = Schedule("T1", repetitions=repetitions)
     
     for acq_idx in range(sameple_idx):
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             freeDu = freeduration[q][acq_idx]
-            sched.add(Reset(q))
         
             if qubit_idx == 0:
                 spec_pulse = Readout(sched,q,R_amp,R_duration)
@@ -1142,9 +1206,9 @@ def multi_Zgate_T1_sche(
     sched = Schedule("Zgate-T1", repetitions=repetitions)
 
     for acq_idx in range(sameple_idx):
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             freeDu = freeduration[q][acq_idx]
-            sched.add(Reset(q))
         
             if qubit_idx == 0:
                 spec_pulse = Readout(sched,q,R_amp,R_duration)
@@ -1228,9 +1292,9 @@ def multi_ramsey_sche(
     print(f"Second phase: {second_pulse_phase}")
 
     for acq_idx in range(sameple_idx):   
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             freeDu = freeduration[q][acq_idx]
-            sched.add(Reset(q))
 
             if qubit_idx == 0:
                 spec_pulse = Readout(sched,q,R_amp,R_duration)
@@ -1407,18 +1471,20 @@ def Qubit_SS_sche(
 
     sched = Schedule("Single shot", repetitions=repetitions)
     
-    sched.add(Reset(q))
-    
-    sched.add(IdlePulse(duration=5000*1e-9))
-    
-    spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
-    
-    if ini_state=='e': 
-        X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse,freeDu=electrical_delay)
+    # ini_state='ge' interleaves both preparations in one shot, the acq_index is the position in `ini_state`
+    for acq_idx, state in enumerate(ini_state):
+        sched.add(Reset(q))
         
-    else: None
-    
-    Integration(sched,q,R_inte_delay,R_integration,spec_pulse,0,single_shot=True,get_trace=False,trace_recordlength=0)
+        sched.add(IdlePulse(duration=5000*1e-9))
+        
+        spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
+        
+        if state=='e': 
+            X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse,freeDu=electrical_delay)
+            
+        else: None
+        
+        Integration(sched,q,R_inte_delay,R_integration,spec_pulse,acq_idx,single_shot=True,get_trace=False,trace_recordlength=0)
 
     return sched
 
@@ -1431,29 +1497,34 @@ def multi_Qubit_SS_sche(
     R_duration: dict,
     R_integration:dict,
     R_inte_delay:dict,
+    acq_thresholds:dict={},
     repetitions:int=1,
 ) -> Schedule:
 
     sched = Schedule("Single shot", repetitions=repetitions)
 
-    for qubit_idx, q in enumerate(R_integration):
-
-        sched.add(Reset(q))
-        if qubit_idx == 0:
-            spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
-        else:
-            Multi_Readout(sched,q,spec_pulse,R_amp,R_duration,powerDep=False)
-    
-        if ini_state=='e': 
-            waveformer.X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse,freeDu=electrical_delay)
+    # ini_state='ge' interleaves both preparations in one shot, the acq_index is the position in `ini_state`
+    for acq_idx, state in enumerate(ini_state):
+        Multi_Reset(sched,list(R_integration))
+        for qubit_idx, q in enumerate(R_integration):
+            if qubit_idx == 0:
+                spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
+            else:
+                Multi_Readout(sched,q,spec_pulse,R_amp,R_duration,powerDep=False)
         
-    
-        Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=0,acq_channel=qubit_idx,single_shot=True,get_trace=False,trace_recordlength=0)
+            if state=='e': 
+                waveformer.X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse,freeDu=electrical_delay)
+            
+        
+            if q in acq_thresholds:
+                Thresholded_Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_threshold=acq_thresholds[q],acq_channel=qubit_idx)
+            else:
+                Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_channel=qubit_idx,single_shot=True,get_trace=False,trace_recordlength=0)
 
     return sched
 
 def Gate_Test_SS_sche(
-    pulse_num:int,
+    pulse_num:int|list,
     waveformer:GateGenesis,
     pi_amp: dict,
     pi_dura:dict,
@@ -1461,25 +1532,30 @@ def Gate_Test_SS_sche(
     R_duration: dict,
     R_integration:dict,
     R_inte_delay:dict,
+    acq_thresholds:dict={},
     repetitions:int=1,
 ) -> Schedule:
 
     sched = Schedule("Single shot", repetitions=repetitions)
 
-    for qubit_idx, q in enumerate(R_integration):
-
-        sched.add(Reset(q))
-        if qubit_idx == 0:
-            spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
-        else:
-            Multi_Readout(sched,q,spec_pulse,R_amp,R_duration,powerDep=False)
-    
+    # a list of pulse numbers makes one block per number in a shot, the acq_index is the position in the list
+    for acq_idx, seq_num in enumerate([pulse_num] if isinstance(pulse_num, (int, np.integer)) else pulse_num):
+        Multi_Reset(sched,list(R_integration))
+        for qubit_idx, q in enumerate(R_integration):
+            if qubit_idx == 0:
+                spec_pulse = Readout(sched,q,R_amp,R_duration,powerDep=False)
+            else:
+                Multi_Readout(sched,q,spec_pulse,R_amp,R_duration,powerDep=False)
         
-        for i in range(pulse_num):
-            pi_pulse = waveformer.X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse if i==0 else pi_pulse, freeDu=electrical_delay if i==0 else 0)
-    
-    
-        Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=0,acq_channel=qubit_idx,single_shot=True,get_trace=False,trace_recordlength=0)
+            
+            for i in range(int(seq_num)):
+                pi_pulse = waveformer.X_pi_p(sched,pi_amp,q,pi_dura[q],spec_pulse if i==0 else pi_pulse, freeDu=electrical_delay if i==0 else 0)
+        
+        
+            if q in acq_thresholds:
+                Thresholded_Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_threshold=acq_thresholds[q],acq_channel=qubit_idx)
+            else:
+                Integration(sched,q,R_inte_delay[q],R_integration,spec_pulse,acq_index=acq_idx,acq_channel=qubit_idx,single_shot=True,get_trace=False,trace_recordlength=0)
 
     return sched
 
@@ -1527,13 +1603,13 @@ def multi_ROF_Cali_sche(
     sched = Schedule("ROF calibration", repetitions=repetitions)
     for acq_idx in range(sameple_idx):    
 
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             freq = ro_freq[q][acq_idx]
             if acq_idx == 0:
                 sched.add_resource(ClockResource(name=q+ ".ro", freq=array(ro_freq[q]).flat[0]))
 
             sched.add(SetClockFrequency(clock= q+ ".ro", clock_freq_new=freq))
-            sched.add(Reset(q))
             sched.add(IdlePulse(duration=4e-9), label=f"buffer {qubit_idx} {acq_idx}")
 
             if qubit_idx == 0:
@@ -1565,10 +1641,10 @@ def multi_ROL_Cali_sche(
     
     for acq_idx in range(sameple_idx):    
 
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             rol_coef = R_amp_coefs[q][acq_idx]
             
-            sched.add(Reset(q))
     
             if qubit_idx == 0:
                 spec_pulse = Readout(sched,q,{q:R_amp[q]*rol_coef},R_duration)
@@ -1630,11 +1706,11 @@ def multi_PI_amp_cali_sche(
     sched = Schedule("Pi amp modification", repetitions=repetitions)
 
     for acq_idx in range(sameple_idx):
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             amp_coef = pi_amp_coefs[q][acq_idx]
             
             
-            sched.add(Reset(q))
             
             if qubit_idx == 0:
                 read_pulse = Readout(sched,q,R_amp,R_duration)
@@ -1670,9 +1746,9 @@ def multi_hPI_amp_cali_sche(
         
     
     for acq_idx in range(sameple_idx):
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             waveformer.set_halfPIratio_for(q, ori_falf_ratio[q]*pi_amp_coefs[q][acq_idx])
-            sched.add(Reset(q))
             
             if qubit_idx == 0:
                 read_pulse = Readout(sched,q,R_amp,R_duration)
@@ -1742,9 +1818,9 @@ def drag_coef_cali(
         
 
     for acq_idx in range(sameple_idx):
+        Multi_Reset(sched,qubits2read)
         for qubit_idx, q in enumerate(qubits2read):
             waveformer.set_dragRatio_for(q, drag_ratios[q][acq_idx])
-            sched.add(Reset(q))
             if qubit_idx == 0:
                 read_pulse = Readout(sched,q,R_amp,R_duration)
             else:
@@ -3,6 +3,9 @@ from xarray import Dataset
 from qblox_drive_AS.support.FluxBiasDict import FluxBiasDict
 from qblox_drive_AS.support.Notebook import Notebook
 from qblox_drive_AS.support.WaveformCtrl import GateGenesis
+from qblox_drive_AS.support.PhaseTracer import traced
+from qblox_drive_AS.support.DataCatalog import data_catalog, device_identity
+from qblox_drive_AS.support.AsyncWriter import raw_writer
 from qblox_instruments import Cluster
 from quantify_scheduler.device_under_test.quantum_device import QuantumDevice
 from quantify_scheduler.device_under_test.transmon_element import BasicTransmonElement
@@ -179,6 +182,7 @@ class QDmanager():
         """
         self.Log = message
 
+    @traced("QD_load")
     def QD_loader(self, new_Hcfg:dict=None):
         """
         Load the QuantumDevice, Bias config, hardware config and Flux control callable dict from a given json file path contain the serialized QD.
@@ -424,9 +428,11 @@ class Data_manager:
 
 
 
+    @traced("save")
     def save_raw_data(self,QD_agent:QDmanager,ds:Dataset,qb:str='q0',label:str=0,exp_type:str='CS', specific_dataFolder:str='', get_data_loc:bool=False):
         """
-        If the arg `specific_dataFolder` was given, the raw nc will be saved into that given path. 
+        If the arg `specific_dataFolder` was given, the raw nc will be saved into that given path.\n
+        The file is written by `raw_writer` in the background, if `get_data_loc` the path is returned after it's written. 
         """
         exp_timeLabel = self.get_time_now()
         self.build_folder_today(self.raw_data_dir)
@@ -493,10 +499,11 @@ class Data_manager:
             path = os.path.join(parent_dir,"Unknown.nc")
             raise KeyError("Wrong experience type!")
         
-        ds.to_netcdf(path)
+        dr, qd_hash = device_identity(QD_agent)
+        raw_writer.submit(self.__save_and_catalog, ds, path, exp_type, [qb], dr, qd_hash, description=path)
 
         if get_data_loc:
-            return path
+            return raw_writer.ready(path)
     
     def save_2Qraw_data(self,QD_agent:QDmanager,ds:Dataset,qubits:list,label:str=0,exp_type:str='iswap', specific_dataFolder:str='', get_data_loc:bool=False):
         exp_timeLabel = self.get_time_now()
@@ -510,17 +517,26 @@ class Data_manager:
 
         if exp_type.lower() == 'iswap':
             path = os.path.join(parent_dir,f"{dr_loc}{operators}_iSwap_{exp_timeLabel}.nc")
-            ds.to_netcdf(path)
+            dr, qd_hash = device_identity(QD_agent)
+            raw_writer.submit(self.__save_and_catalog, ds, path, exp_type, list(qubits), dr, qd_hash, description=path)
         else:
             path = None
             raise KeyError(f"irrecognizable 2Q gate exp = {exp_type}")
         
         if get_data_loc:
-            return path
+            return raw_writer.ready(path)
+
+    @staticmethod
+    def __save_and_catalog(ds:Dataset, path:str, exp_type:str, qubits:list, dr:str, qd_hash:str):
+        ds.to_netcdf(path)
+        data_catalog.record_dataset(path, ds, exp_type, qubits=qubits, dr=dr, qd_hash=qd_hash)
         
     
     def save_histo_pic(self,QD_agent:QDmanager,hist_dict:dict,qb:str='q0',mode:str="t1", show_fig:bool=False, save_fig:bool=True,pic_folder:str=''):
         from qblox_drive_AS.support.Pulse_schedule_library import hist_plot
+        from qblox_drive_AS.analysis.FigureRender import figure_renderer
+        if not figure_renderer.enabled:
+            return
         if QD_agent is not None:
             dr_loc = QD_agent.Identity.split("#")[0]
         else:
@@ -5,6 +5,7 @@ import quantify_core.data.handling as dh
 import matplotlib.pyplot as plt
 from typing import Callable
 from numpy import flip, pi, linspace, array, sqrt, std, median, mean, sort, diag, sign, absolute, where, argmax
+from numpy import arange, full, inf, isfinite, floor, errstate, column_stack, lexsort, unique
 from qblox_drive_AS.support import QDmanager, Data_manager
 from qblox_drive_AS.support.Pulse_schedule_library import IQ_data_dis
 from numpy import ndarray, cos, sin, deg2rad, real, imag, transpose, abs, convolve, ones
@@ -218,68 +219,52 @@ def plot_HeatScat(mag,x_heat_ary,y_heat_ary,x_scat_ary,y_scat_ary,fit_scat_ary:n
     fig = go.Figure(data=data, layout=layout)
     fig.show()
 
-def filter_2D(raw_mag:ndarray,threshold:float=3.0):
-    filtered_f_idx = []
-    filtered_z_idx = []
-    filtered_mag   = []
-    mu = mean(raw_mag.reshape(-1))
-    sigma = std(raw_mag.reshape(-1))
-    for i_z in range(raw_mag.shape[1]):
-        sofar_max = min(raw_mag.reshape(-1))# the maximum signal in the same bias
-        z_idx_champion = 0
-        f_idx_champion = 0
-        for i_f in range(raw_mag.shape[0]):
-            if raw_mag[i_f][i_z] > mu + threshold*sigma:
-                if raw_mag[i_f][i_z] > sofar_max:
-                    f_idx_champion = i_f
-                    z_idx_champion = i_z 
-                    sofar_max = raw_mag[i_f][i_z]
-        if z_idx_champion != 0 or f_idx_champion != 0:
-            filtered_z_idx.append(z_idx_champion)
-            filtered_f_idx.append(f_idx_champion)
-            filtered_mag.append(sofar_max)
-    
-    return filtered_f_idx, filtered_z_idx, filtered_mag
-
+def column_peaks(raw_mag:ndarray)->tuple[ndarray, ndarray, ndarray]:
+    """
+    The strongest point of every bias column in `raw_mag` (freq, bias) and its height in the unit of the global std over the global mean.\n
+    Returns (f_idx, peak_mag, peak_score) per column, a column joins the threshold `t` selection when its score > `t`.
+    """
+    raw_mag = array(raw_mag, dtype=float)
+    f_idx = argmax(raw_mag, axis=0)
+    peak_mag = raw_mag[f_idx, arange(raw_mag.shape[1])]
+    sigma = std(raw_mag)
+    with errstate(divide='ignore', invalid='ignore'):
+        peak_score = (peak_mag-mean(raw_mag))/sigma if sigma != 0 else full(peak_mag.shape, -inf)
+    # same as the former scan: the peak must beat the global minimum and the point (f_idx=0, z_idx=0) isn't taken
+    peak_score = where(peak_mag > raw_mag.min(), peak_score, -inf)
+    if peak_score.shape[0] != 0 and f_idx[0] == 0:
+        peak_score[0] = -inf
+    return f_idx, peak_mag, peak_score
 
-def sortAndDecora(raw_z:ndarray,raw_XYF:ndarray,raw_mag:ndarray,threshold:float=3):
-    def takeLast(elem):
-        return elem[-1]
 
-    # filter peaks idx by a threshold satisfies that peak > mean + threshold*std
-    while True:
-        f_idx, z_idx, XL_mag = filter_2D(raw_mag,threshold)
-        if len(f_idx)==0 and len(z_idx)==0:
-            if threshold != 0:
-                threshold-=0.5
-            else:
-                print(f"This interval can't find the trend : XYF={raw_XYF[0]}~{raw_XYF[-1]}")
-        else:
-            break
-    
-    # extract the values by the filtered idx
-    extracted = [] # [z, xyf, mag]
-    for i in range(len(f_idx)):
-        extracted.append([raw_z[z_idx[i]],raw_XYF[f_idx[i]],XL_mag[i]])
-    # filter out the freq when it's under the same bias
-    filtered = []
-    for point_i in range(len(extracted)):
-        same_bias = []
-        picked_z = extracted[point_i][0]
-        same_bias.append(extracted[point_i])
-        for point_j in range(point_i,len(extracted)):
-            if extracted[point_j][0] == picked_z:
-                same_bias.append(extracted[point_j])
-        same_bias.sort(key=takeLast)
-        if filtered != []:
-            if filtered[-1][0] != same_bias[-1][0]:
-                filtered.append(same_bias[-1])
-        else:
-            filtered.append(same_bias[-1])
+def filter_2D(raw_mag:ndarray,threshold:float=3.0):
+    """ The peak (f_idx, z_idx, mag) of every bias column in `raw_mag` (freq, bias) which is higher than mean + `threshold`*std of the whole map. """
+    f_idx, peak_mag, peak_score = column_peaks(raw_mag)
+    z_idx = where(peak_score > threshold)[0]
+    return list(f_idx[z_idx]), list(z_idx), list(peak_mag[z_idx])
 
-    sort(array(filtered),axis=0)
 
-    return array(filtered)
+def sortAndDecora(raw_z:ndarray,raw_XYF:ndarray,raw_mag:ndarray,threshold:float=3):
+    """
+    The peaks [z, xyf, mag] in `raw_mag` (freq, bias) by `filter_2D`, one per bias value.\n
+    If no peak passes `threshold`, it's lowered by 0.5 until some do (it stops at 0), the map is only scanned once for all the thresholds.
+    """
+    f_idx, peak_mag, peak_score = column_peaks(raw_mag)
+    best_score = peak_score.max() if peak_score.shape[0] != 0 else -inf
+    if not best_score > threshold:
+        # the first threshold - 0.5*k under the best score, the former loop kept 0 if it reached 0 exactly
+        steps = floor((threshold-best_score)/0.5)+1 if isfinite(best_score) else inf
+        if (threshold >= 0 and threshold % 0.5 == 0 and steps > threshold/0.5) or not isfinite(steps):
+            print(f"This interval can't find the trend : XYF={raw_XYF[0]}~{raw_XYF[-1]}")
+            return array([]).reshape(0,3)
+        threshold -= 0.5*steps
+
+    z_idx = where(peak_score > threshold)[0]
+    extracted = column_stack([array(raw_z)[z_idx], array(raw_XYF)[f_idx[z_idx]], peak_mag[z_idx]]) # [z, xyf, mag]
+    # keep the strongest peak of the same bias value, in the order the biases appear
+    order = lexsort((-extracted[:,-1], extracted[:,0]))
+    _, first = unique(extracted[order][:,0], return_index=True)
+    return extracted[sort(order[first])]
 
 def convert_netCDF_2_arrays(nc:(str|xr.Dataset)):
     """
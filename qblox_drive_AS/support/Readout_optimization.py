@@ -124,9 +124,10 @@ def Qubit_state_single_shot(quantum_device:QuantumDevice,shots:int=1000,run:bool
                 batched=True,
             )
             quantum_device.cfg_sched_repetitions(shots)
-            ss_ds= gettable.get()
+            ss_ds= gettable.get() # [I, Q], the 2 acq_index of a shot are adjacent
             
-            data[ini_state] = ss_ds
+            for state_idx, state in enumerate(ini_state):
+                data[state] = [np.array(ss_ds[0]).reshape(shots,2)[:,state_idx], np.array(ss_ds[1]).reshape(shots,2)[:,state_idx]]
             
             show_args(exp_kwargs, title="Single_shot_kwargs: Meas.qubit="+q)
             show_args(Experi_info(q))
@@ -138,8 +139,7 @@ def Qubit_state_single_shot(quantum_device:QuantumDevice,shots:int=1000,run:bool
             show_args(Experi_info(q))
             
     tau= R_integration[q]        
-    state_dep_sched('g')
-    state_dep_sched('e')
+    state_dep_sched('ge')
         
     analysis_result[q]= Qubit_state_single_shot_fit_analysis(data,T1=T1,tau=tau)
         
@@ -0,0 +1,298 @@
+""" Content-addressed cache for the compiled schedules made by `ScheduleGettable`. """
+import os, sys, time, pickle, hashlib, inspect, threading
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from numpy import ndarray, generic
+from pydantic import BaseModel
+from qcodes.parameters import Parameter
+from quantify_scheduler.gettables import ScheduleGettable
+from quantify_scheduler.backends.graph_compilation import SerialCompilationConfig
+from quantify_scheduler.device_under_test.quantum_device import QuantumDevice
+from qblox_drive_AS.support.UserFriend import *
+from qblox_drive_AS.support.PhaseTracer import tracer
+
+
+def _feed(hasher, obj):
+    """ Feed `obj` into `hasher` in a canonical way, dict keys are sorted and numpy arrays are hashed by bytes. """
+    if isinstance(obj, dict):
+        hasher.update(b"{")
+        for key in sorted(obj, key=str):
+            if key == "ts":  # qcodes snapshot timestamps change on every set, not a content change
+                continue
+            hasher.update(repr(key).encode())
+            _feed(hasher, obj[key])
+        hasher.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(b"[")
+        for item in obj:
+            _feed(hasher, item)
+        hasher.update(b"]")
+    elif isinstance(obj, ndarray):
+        hasher.update(f"nd{obj.dtype}{obj.shape}".encode())
+        hasher.update(obj.tobytes())
+    elif isinstance(obj, generic):
+        _feed(hasher, obj.item())
+    elif isinstance(obj, Parameter):
+        _feed(hasher, obj())
+    elif isinstance(obj, BaseModel):
+        # the compilation configs
+        hasher.update(type(obj).__qualname__.encode())
+        _feed(hasher, obj.model_dump())
+    elif isinstance(obj, type):
+        hasher.update(f"{obj.__module__}.{obj.__qualname__}".encode())
+    elif isinstance(obj, (str, int, float, complex, bool)) or obj is None:
+        hasher.update(repr(obj).encode())
+    elif inspect.isfunction(obj) or inspect.ismethod(obj):
+        hasher.update(f"{obj.__module__}.{obj.__qualname__}".encode())
+        try:
+            hasher.update(inspect.getsource(obj).encode())
+        except (OSError, TypeError):
+            pass
+    elif hasattr(obj, "__dict__"):
+        # ex. GateGenesis, the waveform logs decide the pulse shape
+        hasher.update(type(obj).__qualname__.encode())
+        _feed(hasher, vars(obj))
+    else:
+        hasher.update(repr(obj).encode())
+
+
+def evaluate_parameters(schedule_kwargs:dict)->dict:
+    """ Replace the qcodes Parameters in `schedule_kwargs` by their current values. """
+    return {name: (value() if isinstance(value, Parameter) else value) for name, value in schedule_kwargs.items()}
+
+
+def compilation_snapshot(quantum_device:QuantumDevice)->SerialCompilationConfig:
+    """ A deep copy of the compilation config (device and hardware configs) of `quantum_device` now, it doesn't follow the later changes of the device. """
+    return quantum_device.generate_compilation_config().model_copy(deep=True)
+
+
+def schedule_fingerprint(schedule_function:callable, schedule_kwargs:dict, compilation_config:SerialCompilationConfig, repetitions:int)->str:
+    """
+    Hash everything a compiled schedule depends on.\n
+    #### Args:\n
+    * schedule_function: the schedule builder, its qualified name and source code are hashed.\n
+    * schedule_kwargs: the kwargs given to the builder, qcodes Parameters are hashed by their current value.\n
+    * compilation_config: by `compilation_snapshot`, the device and hardware configs it's compiled with.\n
+    * repetitions: int, the schedule repetitions.
+    """
+    hasher = hashlib.sha256()
+    _feed(hasher, schedule_function)
+    _feed(hasher, schedule_kwargs)
+    _feed(hasher, repetitions)
+    _feed(hasher, compilation_config)
+    return hasher.hexdigest()
+
+
+def _feed_device(hasher, quantum_device:QuantumDevice):
+    _feed(hasher, quantum_device.hardware_config())
+    for element_name in sorted(quantum_device.elements()):
+        _feed(hasher, quantum_device.get_element(element_name).snapshot(update=False))
+    for edge_name in sorted(quantum_device.edges()):
+        _feed(hasher, quantum_device.get_edge(edge_name).snapshot(update=False))
+
+
+def device_fingerprint(quantum_device:QuantumDevice)->str:
+    """ Hash the hardware config and all the element and edge parameters, the same device state gives the same hash. """
+    hasher = hashlib.sha256()
+    _feed_device(hasher, quantum_device)
+    return hasher.hexdigest()
+
+
+class CompiledScheduleCache():
+    """
+    LRU cache of compiled schedules keyed by `schedule_fingerprint`.\n
+    #### Args:\n
+    * max_entries: int, how many compiled schedules are kept in memory.\n
+    * persist_folder: str, if given, the compiled schedules are also pickled into this folder and reloaded on a memory miss.
+    """
+    def __init__(self, max_entries:int=16, persist_folder:str=None):
+        self.max_entries:int = max_entries
+        self.persist_folder:str = persist_folder
+        self.hits:int = 0
+        self.misses:int = 0
+        self.compile_seconds:float = 0   # time the gettables spent on compiling (or waiting for the precompiler)
+        self.hardware_seconds:float = 0  # time the gettables spent on upload and acquisition
+        self.__memory = OrderedDict()
+        self.__lock = threading.RLock()  # the precompiler puts from its own thread
+
+    def __len__(self):
+        return len(self.__memory)
+
+    def __contains__(self, key:str):
+        return key in self.__memory or (self.persist_folder is not None and os.path.exists(self.__disk_path(key)))
+
+    def __disk_path(self, key:str)->str:
+        return os.path.join(self.persist_folder, f"{key}.pkl")
+
+    def set_persist_folder(self, folder_path:str=None):
+        """ Turn on the on-disk persistence in `folder_path`, or turn it off by giving None. """
+        if folder_path is not None and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+        self.persist_folder = folder_path
+
+    def get(self, key:str):
+        with self.__lock:
+            if key in self.__memory:
+                self.__memory.move_to_end(key)
+                self.hits += 1
+                return self.__memory[key]
+
+        if self.persist_folder is not None and os.path.exists(self.__disk_path(key)):
+            try:
+                with open(self.__disk_path(key), 'rb') as rec:
+                    compiled = pickle.load(rec)
+            except Exception as err:
+                warning_print(f"Broken compiled schedule cache {key[:10]} was ignored: {err}")
+            else:
+                if compiled is None:  # left by an older version which cached the None return of `_compile`
+                    os.remove(self.__disk_path(key))
+                    self.misses += 1
+                    return None
+                self.hits += 1
+                self.__store_in_memory(key, compiled)
+                return compiled
+
+        self.misses += 1
+        return None
+
+    def put(self, key:str, compiled_schedule):
+        if compiled_schedule is None:
+            return
+        self.__store_in_memory(key, compiled_schedule)
+        if self.persist_folder is not None:
+            try:
+                with open(self.__disk_path(key), 'wb') as rec:
+                    pickle.dump(compiled_schedule, rec)
+            except Exception as err:
+                warning_print(f"Compiled schedule can't be persisted: {err}")
+
+    def __store_in_memory(self, key:str, compiled_schedule):
+        with self.__lock:
+            self.__memory[key] = compiled_schedule
+            self.__memory.move_to_end(key)
+            while len(self.__memory) > self.max_entries:
+                self.__memory.popitem(last=False)
+
+    def clear(self, include_disk:bool=False):
+        self.__memory.clear()
+        self.hits, self.misses = 0, 0
+        if include_disk and self.persist_folder is not None:
+            for file in os.listdir(self.persist_folder):
+                if file.endswith(".pkl"):
+                    os.remove(os.path.join(self.persist_folder, file))
+
+
+class SchedulePrecompiler():
+    """
+    Compile the schedules of the upcoming job on a background thread while the current job is acquiring.\n
+    A job records what it compiled under `current_tag` (the experiment name): the schedule function, the evaluated kwargs
+    and the `compilation_snapshot` taken on the main thread. `arm(tag)` picks the records of the next job, they are compiled
+    from those snapshots (never from a live device) once the current gettable finishes its own compilation.
+    So it pays off when the next job runs with the same settings as its last run but its compiled schedule fell out of `cache`,
+    like the long cycles of `QubitMonitor`, a job changing its device or sweep in between simply misses the cache.
+    """
+    def __init__(self, cache:CompiledScheduleCache):
+        self.cache:CompiledScheduleCache = cache
+        self.current_tag:str = None
+        self.recorded_specs:dict = {}
+        self.__armed:list = []
+        self.__pending:dict = {}
+        self.__lock = threading.Lock()
+        self.__worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="precompiler")
+
+    def record(self, key:str, schedule_function:callable, schedule_kwargs:dict, compilation_config:SerialCompilationConfig, repetitions:int):
+        """ `schedule_kwargs` evaluated and `compilation_config` snapshotted by the caller, `key` is their `schedule_fingerprint`. """
+        if self.current_tag is not None:
+            self.recorded_specs.setdefault(self.current_tag, {})[schedule_function.__qualname__] = (key, schedule_function, schedule_kwargs, compilation_config, repetitions)
+
+    def arm(self, tag:str):
+        """ The schedules recorded under `tag` will be compiled when the current job starts acquiring. """
+        self.__armed = list(self.recorded_specs.get(tag, {}).values())
+
+    def notify_acquiring(self):
+        armed, self.__armed = self.__armed, []
+        for key, schedule_function, schedule_kwargs, compilation_config, repetitions in armed:
+            with self.__lock:
+                if key in self.__pending or key in self.cache:
+                    continue
+                self.__pending[key] = self.__worker.submit(self.__compile, key, schedule_function, schedule_kwargs, compilation_config, repetitions)
+
+    def __compile(self, key:str, schedule_function:callable, schedule_kwargs:dict, compilation_config:SerialCompilationConfig, repetitions:int):
+        try:
+            sched = schedule_function(**schedule_kwargs, repetitions=repetitions)
+            # a copy, the recorded snapshot stays as it's keyed
+            config = compilation_config.model_copy(deep=True)
+            backend = config.backend(name=config.name)
+            compiled = backend.compile(schedule=sched, config=config)
+            self.cache.put(key, compiled)
+            return compiled
+        finally:
+            with self.__lock:
+                self.__pending.pop(key, None)
+
+    def wait_for(self, key:str):
+        """ Block until the background compilation of `key` is done, return None if nothing is pending or it failed. """
+        with self.__lock:
+            future = self.__pending.get(key)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as err:
+            warning_print(f"Background compilation failed, compile it again: {err}")
+            return None
+
+
+schedule_cache = CompiledScheduleCache()
+precompiler = SchedulePrecompiler(schedule_cache)
+
+
+class CachedScheduleGettable(ScheduleGettable):
+    """
+    Drop-in `ScheduleGettable` which looks up `schedule_cache` before compiling.
+    The schedule is still built (cheap), but the compilation is skipped when the fingerprint was seen before.
+    """
+    def __init__(self, *args, cache:CompiledScheduleCache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache:CompiledScheduleCache = schedule_cache if cache is None else cache
+
+    def _compile(self, sched):
+        start = time.time()
+        repetitions = self.quantum_device.cfg_sched_repetitions()
+        schedule_kwargs = evaluate_parameters(self.schedule_kwargs)
+        config = compilation_snapshot(self.quantum_device)
+        config.debug_mode = self._debug_mode
+        key = schedule_fingerprint(self.schedule_function, schedule_kwargs, config, repetitions)
+        precompiler.record(key, self.schedule_function, schedule_kwargs, config, repetitions)
+        compiled = self.cache.get(key)
+        if compiled is None:
+            compiled = precompiler.wait_for(key)
+        if compiled is None:
+            # `ScheduleGettable._compile` keeps the compiled schedule in `_compiled_schedule` and returns None
+            super()._compile(sched)
+            compiled = self._compiled_schedule
+            self.cache.put(key, compiled)
+        self._compiled_schedule = compiled
+        self.cache.compile_seconds += time.time()-start
+        precompiler.notify_acquiring()
+        return compiled
+
+    def initialize(self):
+        """ Same as `ScheduleGettable.initialize`, the schedule build, compile and upload are timed as separated phases of `tracer`. """
+        self._evaluated_sched_kwargs = evaluate_parameters(self.schedule_kwargs)
+        with tracer.phase("schedule_build"):
+            sched = self.schedule_function(**self._evaluated_sched_kwargs, repetitions=self.quantum_device.cfg_sched_repetitions())
+        with tracer.phase("compile"):
+            self._compile(sched)
+        with tracer.phase("upload"):
+            instr_coordinator = self.quantum_device.instr_instrument_coordinator.get_instr()
+            instr_coordinator.prepare(self._compiled_schedule)
+        self.is_initialized = True
+
+    def get(self):
+        start, compile_before = time.time(), self.cache.compile_seconds
+        with tracer.phase("acquisition"):
+            data = super().get()
+        self.cache.hardware_seconds += (time.time()-start)-(self.cache.compile_seconds-compile_before)
+        return data
@@ -0,0 +1,308 @@
+""" Offline stand-in for the Qblox cluster, the acquisitions are made by a synthetic chip instead of the hardware. """
+import os, sys, re
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from numpy import ndarray, array, arange, sqrt, pi, cos, sin, exp, abs, mean, isnan, clip
+from numpy.random import default_rng
+from scipy.linalg import expm
+from scipy.special import erf
+from xarray import Dataset, DataArray
+from qcodes import Instrument
+from qcodes.instrument import find_or_create_instrument
+from qblox_instruments import Cluster, ClusterType
+from quantify_scheduler.instrument_coordinator import InstrumentCoordinator
+from qblox_drive_AS.support.QDmanager import QDmanager
+from qblox_drive_AS.support.WaveformCtrl import XY_waveform, s_factor
+from qblox_drive_AS.support.UserFriend import *
+
+
+module_types = {"QCM":ClusterType.CLUSTER_QCM, "QRM":ClusterType.CLUSTER_QRM, "QCM_RF":ClusterType.CLUSTER_QCM_RF, "QRM_RF":ClusterType.CLUSTER_QRM_RF}
+
+
+def pulse_area(pulse_info:dict)->float:
+    """ The envelope area (amp*s) of a pulse in the `pulse_info` of a compiled operation. """
+    duration = pulse_info["duration"]
+    if pulse_info.get("samples") is not None:
+        return float(mean(abs(array(pulse_info["samples"]))))*duration
+    amp = pulse_info.get("amp", pulse_info.get("G_amp", pulse_info.get("amplitude", 0)))
+    wf_func = str(pulse_info.get("wf_func", "")).lower()
+    if "drag" in wf_func or "gauss" in wf_func:
+        sigma = pulse_info.get("sigma") or duration/s_factor
+        return amp*sigma*sqrt(2*pi)*erf(duration/(2*sqrt(2)*sigma))
+    return amp*duration
+
+
+class SyntheticQubit():
+    """
+    The physics of one qubit and its resonator, initialized from what the QD knows about it.\n
+    Transition frequency follows `FluxBiasDict.fqEqn_for_qub` if the qubit had been fit, otherwise a cosine-like arc around its f01.
+    The resonator is dispersively pushed by the qubit (Jaynes-Cummings) and goes back to its bare frequency at high readout amp.
+    """
+    def __init__(self, QD_agent:QDmanager, q:str, rng):
+        elem = QD_agent.quantum_device.get_element(q)
+        note, flux = QD_agent.Notewriter, QD_agent.Fluxmanager
+        self.name = q
+        self.f01 = self.__valid(elem.clock_freqs.f01(), 4.5e9)
+        self.sweet_bias = self.__valid(flux.get_sweetBiasFor(q), 0)
+        self.period = self.__valid(flux.get_PeriodFor(q), 0)
+        self.anharmonicity = -200e6
+        self.__fluxmanager = None
+        try:
+            if len(flux.get_bias_dict()[q]["qubFitParas"]) == 5 and float(flux.fqEqn_for_qub(q, array([self.sweet_bias]))[0]) > 0:
+                self.__fluxmanager = flux
+                self.anharmonicity = -flux.get_bias_dict()[q]["qubFitParas"][2]*1e9
+        except Exception:
+            pass
+        self.f_bare = self.__valid(note.get_bareFreqFor(q), self.__valid(elem.clock_freqs.readout(), 6e9))
+        self.g = self.__valid(note.get_sweetGFor(q), 48e6)
+        self.T1 = self.__valid(note.get_T1For(q), 20e-6)
+        self.T2 = min(self.__valid(note.get_T2For(q), 15e-6), 2*self.T1)
+        self.kappa = 1.5e6
+        self.Qc_over_Ql = 2
+        self.punchout_amp = 0.4
+        self.phase_offset = rng.uniform(0, 2*pi)
+        # a pi-pulse as the QD describes it defines the Rabi rate per amp
+        amp180, pi_duration = self.__valid(elem.rxy.amp180(), 0.2), self.__valid(elem.rxy.duration(), 40e-9)
+        self.pi_area = pulse_area({"wf_func":XY_waveform, "G_amp":amp180, "duration":pi_duration, "sigma":pi_duration/s_factor})
+
+    @staticmethod
+    def __valid(value, default:float)->float:
+        try:
+            if value is None or isnan(value) or value == 0:
+                return default
+        except TypeError:
+            return default
+        return float(value)
+
+    def fq(self, bias:float)->float:
+        if self.__fluxmanager is not None:
+            return float(self.__fluxmanager.fqEqn_for_qub(self.name, array([bias]))[0])*1e9
+        if self.period != 0:
+            return self.f01*sqrt(abs(cos(pi*(bias-self.sweet_bias)/self.period)))
+        return self.f01
+
+    def resonator_freqs(self, bias:float, ro_amp:float)->tuple[float, float]:
+        """ Resonator frequency with the qubit in |g> and in |e>. """
+        detune = self.fq(bias)-self.f_bare
+        if abs(detune) < 2*self.g:
+            detune = 2*self.g if detune >= 0 else -2*self.g
+        lamb_shift = self.g**2/detune
+        denominator = detune+self.anharmonicity if abs(detune+self.anharmonicity) > self.g else self.g
+        chi = lamb_shift*self.anharmonicity/denominator
+        saturation = 1/(1+(ro_amp/self.punchout_amp)**2)
+        f_g = self.f_bare-lamb_shift*saturation
+        return f_g, f_g+2*chi*saturation
+
+    def S21(self, freq:float, f_r:float)->complex:
+        Ql = f_r/self.kappa
+        return (1-(1/self.Qc_over_Ql)/(1+2j*Ql*(freq-f_r)/f_r))*exp(1j*self.phase_offset)
+
+
+class SimulatedInstrumentCoordinator(InstrumentCoordinator):
+    """ InstrumentCoordinator without hardware components, `retrieve_acquisition` returns what `simulator` made for the prepared schedule. """
+    def __init__(self, name:str, cluster_name:str=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.cluster_name = cluster_name
+        self.__compiled_schedule = None
+
+    def prepare(self, compiled_schedule):
+        self.__compiled_schedule = compiled_schedule
+
+    def retrieve_acquisition(self)->Dataset:
+        return simulator.simulate(self.cluster_name, self.__compiled_schedule)
+
+
+class ClusterSimulator():
+    """
+    Offline backend, `init_meas` builds a dummy `Cluster` (same modules as the hardware config) and a `SimulatedInstrumentCoordinator`
+    instead of connecting to the cluster once it's enabled.\n
+    The synthetic chip is made from the QD when its cluster is built, later changes in the QD (calibrations) don't change the chip.\n
+    #### Args of `enable()`:\n
+    * seed: int, seed of the noise.\n
+    * noise_V: float, std of the integrated IQ noise in one shot.\n
+    * qubit_overrides: {"q0":{"T1":30e-6, "f01":4.2e9}, ...}, overwrite the attributes of `SyntheticQubit`.
+    """
+    def __init__(self):
+        self.enabled:bool = False
+        self.noise_V:float = 0.01
+        self.time_of_flight:float = 280e-9
+        self.qubit_overrides:dict = {}
+        self.chips:dict = {}         # cluster name -> {q: SyntheticQubit}
+        self.bias_readers:dict = {}  # cluster name -> {q: flux offset parameter}
+        self.rng = default_rng()
+
+    def enable(self, seed:int=None, noise_V:float=0.01, **qubit_overrides):
+        self.enabled = True
+        self.noise_V = noise_V
+        self.qubit_overrides = qubit_overrides
+        self.rng = default_rng(seed)
+        self.chips, self.bias_readers = {}, {}
+        eyeson_print("Cluster simulator is on, no hardware will be touched.")
+
+    def disable(self):
+        self.enabled = False
+
+    def make_cluster(self, dr_loc:str, QuantumDevice_path:str)->Cluster:
+        name = f"cluster{dr_loc.lower()}"
+        QD_agent = QDmanager(QuantumDevice_path)
+        QD_agent.QD_loader()
+        dummy_cfg = {}
+        for key, module in QD_agent.Hcfg.get(name, {}).items():
+            slot = re.search(r"_module(\d+)$", key)
+            if slot is not None and isinstance(module, dict) and module.get("instrument_type") in module_types:
+                dummy_cfg[int(slot.group(1))] = module_types[module["instrument_type"]]
+        if len(dummy_cfg) == 0:
+            raise KeyError(f"Can't find the modules of '{name}' in the hardware config of {QuantumDevice_path}")
+        if Instrument.exist(name):
+            Instrument.find_instrument(name).close()
+        cluster = Cluster(name=name, dummy_cfg=dummy_cfg)
+
+        if name not in self.chips:
+            chip = {}
+            for q in QD_agent.quantum_device.elements():
+                if q[0] == 'q':
+                    chip[q] = SyntheticQubit(QD_agent, q, self.rng)
+                    for attr, value in self.qubit_overrides.get(q, {}).items():
+                        setattr(chip[q], attr, value)
+            self.chips[name] = chip
+        bias_ctrl = QD_agent.activate_str_Fctrl(cluster)
+        self.bias_readers[name] = {q: bias_ctrl[q] for q in self.chips[name] if q in bias_ctrl}
+        # init_meas loads the same QD again, leave the instrument names to it
+        device = QD_agent.quantum_device
+        for instr_name in list(device.elements())+list(device.edges())+[device.name]:
+            if Instrument.exist(instr_name):
+                Instrument.find_instrument(instr_name).close()
+        return cluster
+
+    def make_coordinator(self, cluster:Cluster)->SimulatedInstrumentCoordinator:
+        return find_or_create_instrument(SimulatedInstrumentCoordinator, recreate=True, name="ic", cluster_name=cluster.name)
+
+    def __static_bias(self, cluster_name:str, q:str)->float:
+        try:
+            return float(self.bias_readers[cluster_name][q]())
+        except Exception:
+            return 0.0
+
+    def simulate(self, cluster_name:str, compiled_schedule)->Dataset:
+        """ Play the compiled schedule on the synthetic chip, return the acquisitions like `InstrumentCoordinator.retrieve_acquisition`. """
+        chip = self.chips[cluster_name]
+        repetitions = compiled_schedule.repetitions
+        clocks = {clock: resource.data.get("freq") for clock, resource in compiled_schedule.resources.items()}
+        static_bias = {q: self.__static_bias(cluster_name, q) for q in chip}
+
+        # (time, priority, kind, payload), the priority orders the events at the same time
+        events = []
+        for schedulable in compiled_schedule.schedulables.values():
+            t = schedulable["abs_time"]
+            op = compiled_schedule.operations[schedulable["operation_id"]]
+            gate_info = op.data.get("gate_info", {})
+            if gate_info.get("operation_type") == "reset":
+                for q in gate_info.get("qubits", []):
+                    events.append((t, 0, "reset", q))
+                continue
+            for p in op.data.get("pulse_info", []):
+                start = t+p.get("t0", 0)
+                port = p.get("port") or ""
+                if p.get("clock_freq_new") is not None:
+                    events.append((start, 1, "clock", (p["clock"], p["clock_freq_new"])))
+                elif p.get("wf_func") is None:
+                    continue
+                elif port.endswith(":fl"):
+                    events.append((start, 2, "flux", (port.split(":")[0], p.get("amp", 0))))
+                    events.append((start+p["duration"], 2, "flux", (port.split(":")[0], -p.get("amp", 0))))
+                elif port.endswith(":res"):
+                    events.append((start, 3, "readout", (p["clock"].split(".")[0], p.get("amp", 0), p["clock"])))
+                elif port.endswith(":mw"):
+                    events.append((start, 4, "drive", (port.split(":")[0], p)))
+            for a in op.data.get("acquisition_info", []):
+                events.append((t+a.get("t0", 0), 5, "acq", a))
+        events.sort(key=lambda event: (event[0], event[1]))
+
+        bloch = {q: array([0., 0., 1.]) for q in chip}
+        clock_t = {q: 0. for q in chip}
+        z_pulse = {q: 0. for q in chip}
+        ro_pulse = {q: (0., chip[q].f_bare) for q in chip}
+        acquired = {}   # acq_channel -> {acq_index: (protocol, bin_mode, P_e, S_g, S_e, duration)}
+
+        def evolve(q:str, t:float, drive:dict=None):
+            dt = t-clock_t[q]
+            if dt <= 0 or q not in chip:
+                return
+            qubit = chip[q]
+            frame = clocks.get(f"{q}.01") or qubit.fq(static_bias[q])
+            if drive is not None:
+                frame = clocks.get(drive["clock"]) or frame
+            wz = 2*pi*(qubit.fq(static_bias[q]+z_pulse[q])-frame)
+            wx, wy = 0., 0.
+            if drive is not None:
+                rabi = pi*pulse_area(drive)/drive["duration"]/qubit.pi_area
+                phase = drive.get("phase", 0)*pi/180
+                wx, wy = rabi*cos(phase), rabi*sin(phase)
+            M = array([[-1/qubit.T2, -wz, wy, 0], [wz, -1/qubit.T2, -wx, 0], [-wy, wx, -1/qubit.T1, 1/qubit.T1], [0, 0, 0, 0]])
+            bloch[q] = (expm(M*dt)@array([*bloch[q], 1.]))[:3]
+            clock_t[q] = t
+
+        for t, _, kind, payload in events:
+            if kind == "reset":
+                bloch[payload], clock_t[payload] = array([0., 0., 1.]), t
+            elif kind == "clock":
+                clocks[payload[0]] = payload[1]
+            elif kind == "flux":
+                if payload[0] in chip:
+                    evolve(payload[0], t)
+                    z_pulse[payload[0]] += payload[1]
+            elif kind == "readout":
+                if payload[0] in chip:
+                    ro_pulse[payload[0]] = (payload[1], clocks.get(payload[2]) or chip[payload[0]].f_bare)
+            elif kind == "drive":
+                q, drive = payload
+                if q in chip:
+                    evolve(q, t)
+                    evolve(q, t+drive["duration"], drive)
+            elif kind == "acq":
+                q = payload["clock"].split(".")[0]
+                if q not in chip:
+                    continue
+                evolve(q, t)
+                ro_amp, ro_freq = ro_pulse[q]
+                f_g, f_e = chip[q].resonator_freqs(static_bias[q]+z_pulse[q], ro_amp)
+                P_e = float(clip((1-bloch[q][2])/2, 0, 1))
+                acquired.setdefault(payload["acq_channel"], {})[payload["acq_index"]] = (
+                    payload["protocol"], str(payload["bin_mode"]).lower(), P_e,
+                    ro_amp*chip[q].S21(ro_freq, f_g), ro_amp*chip[q].S21(ro_freq, f_e), payload["duration"])
+                bloch[q] = array([0., 0., bloch[q][2]])  # measurement dephases
+
+        return Dataset({channel: self.__make_acquisition(channel, acquired[channel], repetitions) for channel in acquired})
+
+    def __make_acquisition(self, channel, bins:dict, repetitions:int)->DataArray:
+        indices = sorted(bins)
+        protocol, bin_mode = bins[indices[0]][0], bins[indices[0]][1]
+        P_e = array([bins[i][2] for i in indices])
+        S_g, S_e = array([bins[i][3] for i in indices]), array([bins[i][4] for i in indices])
+        index_dim = f"acq_index_{channel}"
+
+        if protocol == "Trace":
+            samples = int(round(bins[indices[0]][5]*1e9))
+            t = arange(samples)*1e-9
+            level = (1-P_e)*S_g+P_e*S_e
+            values = level[:, None]*(t >= self.time_of_flight)[None, :]+self.__noise((len(indices), samples), self.noise_V)
+            return DataArray(values, dims=[index_dim, f"trace_index_{channel}"], coords={index_dim: indices}, attrs={"acq_protocol": protocol})
+
+        if "append" in bin_mode:
+            excited = self.rng.random((repetitions, len(indices))) < P_e[None, :]
+            if protocol == "ThresholdedAcquisition":
+                values = excited.astype(float)
+            else:
+                values = S_g[None, :]*(~excited)+S_e[None, :]*excited+self.__noise(excited.shape, self.noise_V)
+            return DataArray(values, dims=["repetition", index_dim], coords={index_dim: indices}, attrs={"acq_protocol": protocol})
+
+        if protocol == "ThresholdedAcquisition":
+            values = P_e
+        else:
+            values = (1-P_e)*S_g+P_e*S_e+self.__noise(P_e.shape, self.noise_V/sqrt(repetitions))
+        return DataArray(values, dims=[index_dim], coords={index_dim: indices}, attrs={"acq_protocol": protocol})
+
+    def __noise(self, shape:tuple, sigma:float)->ndarray:
+        return self.rng.normal(0, sigma, shape)+1j*self.rng.normal(0, sigma, shape)
+
+
+simulator = ClusterSimulator()
@@ -1,5 +1,6 @@
 import pickle, os
 from typing import Callable
+from contextlib import contextmanager
 from qblox_drive_AS.Configs.ClusterAddress_rec import ip_register, port_register
 from qcodes.instrument import find_or_create_instrument
 from typing import Tuple
@@ -20,6 +21,8 @@ from utils.tutorial_utils import (
 )
 
 from qblox_drive_AS.support.QDmanager import QDmanager, Data_manager
+from qblox_drive_AS.support.SimulatedCluster import simulator
+from qblox_drive_AS.support.PhaseTracer import traced
 import qblox_drive_AS.support.UI_Window as uw
 import qblox_drive_AS.support.Chip_Data_Store as cds
 from numpy import ndarray
@@ -40,24 +43,13 @@ def find_nearest(ary:ndarray, value:float):
     return float(ary[idx])
 
 # initialize a measurement
-def init_meas(QuantumDevice_path:str)->Tuple[QDmanager, Cluster, MeasurementControl, InstrumentCoordinator, dict]:
-    """
-    Initialize a measurement by the following 2 cases:\n
-    ### Case 1: QD_path isn't given, create a new QD accordingly.\n
-    ### Case 2: QD_path is given, load the QD with that given path.\n
-    args:\n
-    mode: 'new'/'n' or 'load'/'l'. 'new' need a self defined hardware config. 'load' load the given path. 
-    """
+@traced("connect")
+def connect_cluster(dr_loc:str, QuantumDevice_path:str=None)->Cluster:
+    """ Connect the cluster registered for the DR named `dr_loc` in `ip_register`. If `simulator` is enabled, build its dummy cluster from the QD instead. """
     from qblox_drive_AS.support.UserFriend import warning_print
-    import quantify_core.data.handling as dh
-    meas_datadir = '.data'
-    dh.set_datadir(meas_datadir)
-
-
-    cfg, pth = {}, QuantumDevice_path 
-    dr_loc = get_dr_loca(QuantumDevice_path)
+    if simulator.enabled:
+        return simulator.make_cluster(dr_loc, QuantumDevice_path)
     cluster_ip = ip_register[dr_loc.lower()]
-
     
     if cluster_ip in list(port_register.keys()):
         # try maximum 3 connections to prevent connect timeout error 
@@ -77,7 +69,29 @@ def init_meas(QuantumDevice_path:str)->Tuple[QDmanager, Cluster, MeasurementCont
         except:
             raise KeyError("Check your cluster ip had been log into Experiment_setup.py with its connected DR, and also is its ip-port")
     
-    ip = ip_register[dr_loc.lower()]
+    return cluster
+
+
+@traced("init_meas")
+def init_meas(QuantumDevice_path:str)->Tuple[QDmanager, Cluster, MeasurementControl, InstrumentCoordinator, dict]:
+    """
+    Initialize a measurement by the following 2 cases:\n
+    ### Case 1: QD_path isn't given, create a new QD accordingly.\n
+    ### Case 2: QD_path is given, load the QD with that given path.\n
+    args:\n
+    mode: 'new'/'n' or 'load'/'l'. 'new' need a self defined hardware config. 'load' load the given path. \n
+    While `cluster_sessions.hold()` is active, the cluster and the instrument coordinator are leased from the kept session instead.
+    """
+    import quantify_core.data.handling as dh
+    meas_datadir = '.data'
+    dh.set_datadir(meas_datadir)
+
+    if cluster_sessions.is_holding:
+        return cluster_sessions.lease(QuantumDevice_path)
+
+    cfg, pth = {}, QuantumDevice_path 
+    dr_loc = get_dr_loca(QuantumDevice_path)
+    cluster = connect_cluster(dr_loc, pth)
     
     # enable_QCMRF_LO(cluster) # for v0.6 firmware
     QRM_nco_init(cluster)
@@ -141,11 +155,14 @@ def configure_measurement_control_loop(
     device: QuantumDevice, cluster: Cluster, live_plotting: bool = False
     ) ->Tuple[MeasurementControl,InstrumentCoordinator]:
     meas_ctrl = find_or_create_instrument(MeasurementControl, recreate=True, name="meas_ctrl")
-    ic = find_or_create_instrument(InstrumentCoordinator, recreate=True, name="ic")
+    if simulator.enabled:
+        ic = simulator.make_coordinator(cluster)
+    else:
+        ic = find_or_create_instrument(InstrumentCoordinator, recreate=True, name="ic")
+        # Add cluster to instrument coordinator
+        ic_cluster = ClusterComponent(cluster)
+        ic.add_component(ic_cluster)
     ic.timeout(60*60*120) # 120 hr maximum
-    # Add cluster to instrument coordinator
-    ic_cluster = ClusterComponent(cluster)
-    ic.add_component(ic_cluster)
 
     if live_plotting:
         # Associate plot monitor with measurement controller
@@ -163,8 +180,11 @@ def configure_measurement_control_loop(
 # close all instruments
 def shut_down(cluster:Cluster,flux_map:dict):
     '''
-        Disconnect all the instruments.
+        Disconnect all the instruments. If the cluster is leased from `cluster_sessions`, zero the flux bias and give the lease back instead.
     '''
+    if cluster_sessions.owns(cluster):
+        cluster_sessions.release(cluster)
+        return
     reset_offset(flux_map)
     cluster.reset() 
     Instrument.close_all() 
@@ -294,6 +314,188 @@ def QRM_nco_init(cluster):
     print(f" NCO in QRM_RF: {list(QRM_RFs.keys())} had initialized NCO successfully!")
 
 
+class RememberedBias():
+    """
+    Wrap a flux-bias qcodes parameter, setting the same value as the last one set through this wrapper is skipped.\n
+    It still behaves like the parameter: `bias(0.1)`, `bias()`, `bias.set(0.1)` and it can be a settable of MeasurementControl.
+    """
+    def __init__(self, parameter):
+        self.parameter = parameter
+        self.last_value:float = None
+
+    def __call__(self, *value):
+        if len(value) == 0:
+            return self.get()
+        self.set(value[0])
+
+    def set(self, value:float):
+        if self.last_value is None or value != self.last_value:
+            self.parameter(value)
+            self.last_value = value
+
+    def get(self):
+        return self.parameter()
+
+    def forget(self):
+        self.last_value = None
+
+    def __getattr__(self, name):
+        return getattr(self.parameter, name)
+
+
+class ClusterSession():
+    """ One connected cluster with its meas_ctrl and ic, leased to the experiments on the same DR one after another. """
+    def __init__(self, dr_loc:str):
+        self.dr_loc:str = dr_loc
+        self.cluster:Cluster = None
+        self.meas_ctrl:MeasurementControl = None
+        self.ic:InstrumentCoordinator = None
+        self.QD_agent:QDmanager = None
+        self.biases:dict = {}       # Fctrl string -> RememberedBias, kept over leases
+        self.leased:bool = False
+        self.broken:bool = False
+
+    def is_alive(self)->bool:
+        if self.cluster is None or self.broken:
+            return False
+        try:
+            self.cluster.get_system_state()
+            # another session recreates meas_ctrl and ic with the same names
+            if Instrument.find_instrument("ic") is not self.ic or Instrument.find_instrument("meas_ctrl") is not self.meas_ctrl:
+                return False
+        except Exception:
+            return False
+        return True
+
+    def connect(self, QuantumDevice_path:str):
+        from qblox_drive_AS.support.UserFriend import warning_print
+        if self.cluster is not None:
+            warning_print(f"Reconnect the cluster of {self.dr_loc}")
+            try:
+                self.cluster.close()
+            except Exception:
+                pass
+        self.cluster = connect_cluster(self.dr_loc, QuantumDevice_path)
+        QRM_nco_init(self.cluster)
+        self.meas_ctrl = find_or_create_instrument(MeasurementControl, recreate=True, name="meas_ctrl")
+        if simulator.enabled:
+            self.ic = simulator.make_coordinator(self.cluster)
+        else:
+            self.ic = find_or_create_instrument(InstrumentCoordinator, recreate=True, name="ic")
+            self.ic.add_component(ClusterComponent(self.cluster))
+        self.ic.timeout(60*60*120) # 120 hr maximum
+        self.biases = {}
+        self.broken = False
+        self.cluster.reset()
+
+    def lease(self, QuantumDevice_path:str)->Tuple[QDmanager, Cluster, MeasurementControl, InstrumentCoordinator, dict]:
+        if self.leased:
+            # the last experiment didn't give it back, it was stopped by an error
+            self.broken = True
+            self.close_device()
+        if not self.is_alive():
+            self.connect(QuantumDevice_path)
+
+        self.QD_agent = QDmanager(QuantumDevice_path)
+        self.QD_agent.QD_loader()
+        self.QD_agent.quantum_device.instr_measurement_control(self.meas_ctrl.name)
+        self.QD_agent.quantum_device.instr_instrument_coordinator(self.ic.name)
+        bias_controller = {}
+        for q, bias in self.QD_agent.activate_str_Fctrl(self.cluster).items():
+            bias_controller[q] = self.biases.setdefault(self.QD_agent.Fctrl_str_ver[q], RememberedBias(bias))
+        reset_offset(bias_controller)
+        self.leased = True
+
+        return self.QD_agent, self.cluster, self.meas_ctrl, self.ic, bias_controller
+
+    def close_device(self):
+        """ Close the QuantumDevice of the last lease, the next lease loads the QD again. """
+        if self.QD_agent is None:
+            return
+        device = self.QD_agent.quantum_device
+        for name in list(device.elements()) + list(device.edges()):
+            try:
+                Instrument.find_instrument(name).close()
+            except KeyError:
+                pass
+        device.close()
+        self.QD_agent = None
+
+    def release(self):
+        for q in self.biases:
+            self.biases[q](0.0)
+        self.close_device()
+        self.leased = False
+
+    def close(self):
+        if self.cluster is not None:
+            for q in self.biases:
+                self.biases[q].forget()
+                self.biases[q](0.0)
+            self.cluster.reset()
+        self.close_device()
+        self.cluster, self.meas_ctrl, self.ic = None, None, None
+        self.biases = {}
+        self.leased = False
+
+
+class ClusterSessionManager():
+    """
+    Keep one `ClusterSession` per DR in `ip_register` while `hold()` is active. Inside it, `init_meas` hands out a lease
+    of the kept session and `shut_down` gives it back, so the connection, NCO init and `cluster.reset()` are done once.
+    A session is reconnected and reset only when it doesn't respond or the last lease wasn't given back.\n
+    Ex.\n
+    with cluster_sessions.hold():\n
+        for _ in range(100): EXP.WorkFlow()
+    """
+    def __init__(self):
+        self.sessions:dict = {}
+        self.__depth:int = 0
+
+    @property
+    def is_holding(self)->bool:
+        return self.__depth > 0
+
+    @contextmanager
+    def hold(self):
+        self.__depth += 1
+        try:
+            yield self
+        finally:
+            self.__depth -= 1
+            if self.__depth == 0:
+                self.close_all()
+
+    def lease(self, QuantumDevice_path:str)->Tuple[QDmanager, Cluster, MeasurementControl, InstrumentCoordinator, dict]:
+        dr_loc = get_dr_loca(QuantumDevice_path).lower()
+        if dr_loc not in ip_register:
+            raise KeyError(f"DR '{dr_loc}' isn't in ip_register, check Configs/ClusterAddress_rec.py")
+        return self.sessions.setdefault(dr_loc, ClusterSession(dr_loc)).lease(QuantumDevice_path)
+
+    def owns(self, cluster:Cluster)->bool:
+        return any(session.cluster is cluster for session in self.sessions.values())
+
+    def release(self, cluster:Cluster):
+        for session in self.sessions.values():
+            if session.cluster is cluster:
+                session.release()
+        print("Zeroed all flux bias, the cluster session is kept!")
+
+    def close_all(self):
+        for session in self.sessions.values():
+            try:
+                session.close()
+            except Exception as err:
+                from qblox_drive_AS.support.UserFriend import warning_print
+                warning_print(f"Cluster session of {session.dr_loc} can't be closed properly: {err}")
+        self.sessions = {}
+        Instrument.close_all()
+        print("All instr are closed and zeroed all flux bias!")
+
+
+cluster_sessions = ClusterSessionManager()
+
+
 def advise_where_fq(QD:QDmanager,target_q:str,guess_g_Hz:float=48e6):
     fb = QD.Notewriter.get_bareFreqFor(target_q)
     fd = QD.quantum_device.get_element(target_q).clock_freqs.readout()
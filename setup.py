@@ -20,7 +20,8 @@ setup(
         'sympy',
         'numpy>=1.26.2',
         'matplotlib>=3.9',
-        'xarray>=2024.6.0'
+        'xarray>=2024.6.0',
+        'h5netcdf'
     ],
     classifiers=[
         'Programming Language :: Python :: 3.10',
@@ -0,0 +1,86 @@
+""" Smoke test of the offline cluster: a T1 schedule played on the synthetic chip gives back the T1 of the chip. """
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from types import SimpleNamespace
+import pytest
+from numpy import array, linspace, real, conj, abs
+
+pytest.importorskip("qcodes")
+pytest.importorskip("qblox_instruments")
+pytest.importorskip("quantify_scheduler")
+
+from qblox_drive_AS.support.SimulatedCluster import SyntheticQubit, simulator
+from qblox_drive_AS.analysis.BatchFitting import batch_T1_fit
+
+
+cluster_name = "cluster_test"
+chip_T1 = 25e-6
+pi_amp, pi_duration = 0.2, 40e-9
+ro_amp, ro_duration = 0.1, 1e-6
+
+
+def fake_QD(q:str)->SimpleNamespace:
+    """ What `SyntheticQubit` reads from a QD, without the hardware config. """
+    value = lambda x: (lambda *args: x)
+    element = SimpleNamespace(clock_freqs=SimpleNamespace(f01=value(4.5e9), readout=value(6e9)),
+                              rxy=SimpleNamespace(amp180=value(pi_amp), duration=value(pi_duration)))
+    return SimpleNamespace(quantum_device=SimpleNamespace(get_element=lambda name: element),
+                           Notewriter=SimpleNamespace(get_bareFreqFor=value(6e9), get_sweetGFor=value(60e6), get_T1For=value(chip_T1), get_T2For=value(20e-6)),
+                           Fluxmanager=SimpleNamespace(get_sweetBiasFor=value(0), get_PeriodFor=value(0), get_bias_dict=value({})))
+
+
+class Resource():
+    def __init__(self, freq:float):
+        self.data = {"freq":freq}
+
+
+class Operation():
+    def __init__(self, **data):
+        self.data = data
+
+
+def T1_schedule(q:str, delays, repetitions:int)->SimpleNamespace:
+    """ The parts of a compiled T1 schedule the simulator reads: reset, pi-pulse, wait `delay`, readout and one acquisition bin per delay. """
+    operations = {
+        "reset": Operation(gate_info={"operation_type":"reset", "qubits":[q]}),
+        "pi": Operation(pulse_info=[{"wf_func":"quantify_scheduler.waveforms.drag", "G_amp":pi_amp, "duration":pi_duration, "sigma":None,
+                                     "port":f"{q}:mw", "clock":f"{q}.01", "phase":0, "t0":0}]),
+        "readout": Operation(pulse_info=[{"wf_func":"quantify_scheduler.waveforms.square", "amp":ro_amp, "duration":ro_duration,
+                                          "port":f"{q}:res", "clock":f"{q}.ro", "t0":0}]),
+    }
+    schedulables, t = {}, 0
+    for idx, delay in enumerate(delays):
+        operations[f"acq{idx}"] = Operation(acquisition_info=[{"acq_channel":0, "acq_index":idx, "protocol":"SSBIntegrationComplex",
+                                                               "bin_mode":"average", "duration":ro_duration, "clock":f"{q}.ro", "t0":0}])
+        for name, start in [("reset", t), ("pi", t+200e-6), ("readout", t+200e-6+pi_duration+delay), (f"acq{idx}", t+200e-6+pi_duration+delay)]:
+            schedulables[f"{name}_{idx}"] = {"abs_time":start, "operation_id":name}
+        t += 200e-6+pi_duration+delay+ro_duration
+    return SimpleNamespace(repetitions=repetitions, schedulables=schedulables, operations=operations,
+                           resources={f"{q}.01":Resource(4.5e9), f"{q}.ro":Resource(6e9)})
+
+
+@pytest.fixture
+def chip():
+    simulator.enable(seed=7, noise_V=1e-3)
+    qubit = SyntheticQubit(fake_QD("q0"), "q0", simulator.rng)
+    simulator.chips[cluster_name] = {"q0":qubit}
+    yield qubit
+    simulator.chips.pop(cluster_name, None)
+    simulator.disable()
+
+
+def test_T1_through_simulated_coordinator(chip):
+    delays = linspace(0, 5*chip_T1, 40)
+    ic = simulator.make_coordinator(SimpleNamespace(name=cluster_name))
+    try:
+        ic.prepare(T1_schedule("q0", delays, repetitions=1000))
+        acquired = array(ic.retrieve_acquisition()[0])
+    finally:
+        ic.close()
+
+    # project onto the |g>-|e> axis of the resonator response, then fit like `Multiplex_analyzer.T1_ana`
+    S_g, S_e = [ro_amp*chip.S21(6e9, f_r) for f_r in chip.resonator_freqs(0, ro_amp)]
+    P_e = real((acquired-S_g)*conj(S_e-S_g))/abs(S_e-S_g)**2
+    assert P_e[0] > 0.9
+    fitted = batch_T1_fit(delays*1e6, P_e)
+    assert abs(float(fitted["tau"])*1e-6-chip_T1) < 0.1*chip_T1